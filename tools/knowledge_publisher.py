@@ -13,27 +13,122 @@ Knowledge Publisher - 知识发布工具
   3. <files>    : 处理指定文档
 
 核心能力：
-  - 提取 Markdown 中的 Mermaid 流程图
+  - 提取 Markdown 中的 Mermaid 流程图（单遍围栏扫描，重复运行结果不变）
   - 生成高质量 PNG 图片（2000px，3x scale）
-  - 按文档分子目录管理图片
+  - 渲染缓存：按源码哈希 + 渲染参数跳过未变化的图表
+  - 批量渲染：整次运行只启动一个 mmdc（一个无头浏览器），失败时回退逐个渲染
+  - 并发渲染：--jobs N 限制并发进程数，单图超时，日志按顺序输出
+  - 语法预检查：渲染前用纯 Python 检查全部图表（类型、括号、subgraph/end、箭头），
+    一次列出所有问题，有问题的图表不会启动浏览器；大图的超时按行数放宽
+  - 图片优化：--optimize 量化/无损压缩/去元数据，--format 可选 png/webp/svg
+  - 字节稳定：PNG 归一化（去时间戳/文本块、固定压缩参数），
+    与已有图片字节或像素一致时不改动文件，重复发布不产生 diff
+  - 增量发布：从 git diff 推导变更文档，只处理这些文档
+  - 内容寻址的共享图片存储（跨文档去重），--gc 回收未引用图片
   - 直接在原文档中替换 Mermaid 为图片链接（保留源码在折叠块）
+  - 性能追踪：--trace-json / --trace-chrome 输出分阶段耗时，--profile 输出 cProfile
+  - 多根目录：--root 可重复（递归，--include / --exclude glob 过滤），所有根目录的图表
+    进入同一个去重的渲染队列，一次渲染；图片写到各自根目录的 images/
+  - 库 API：Publisher 类（可配置文档目录、仓库、分支、渲染后端），可直接 import 使用
+  - 监听预览：--watch 保存后只重新提取该文档、只渲染源码有变化的图表，
+    预览写到 .cache/knowledge_publisher/preview/（不改原文档），inotify 或轮询 + 去抖
+  - 常驻服务：--serve 提供 JSON-RPC 2.0（stdio 或 Unix socket），
+    渲染后端、渲染缓存和文档清单在请求之间保持，--socket 把调用转发给服务
+  - 文档清单：.cache/knowledge_publisher/manifest.json 记录每个文档的标题、章节、
+    图表、图片引用和内容哈希，按 mtime/size 增量更新；--catalog 据此重新生成
+    README 的 Knowledge Base 表格和 .cursor/commands/index.md 的目录
   - 智能生成 commit message
-  - Git 操作（检查、提交、推送、验证）
+  - Git 操作（检查、提交、推送、验证）：一次 `git status --porcelain=v2` 拿到全部状态，
+    只暂存发布范围内的修改和流水线写入的文件，用 `git push --porcelain` 的输出验证推送
+  - 离线导出：--export 为每个文档生成自包含的包（本地图片目录 / zip / data URI 内联 /
+    固定到 commit 的链接），图片来自已发布的图片和渲染缓存，导入飞书不依赖推送
+  - 资源分支：--assets-branch 把图片用 git 底层命令（hash-object / update-index /
+    write-tree / commit-tree / update-ref）写进孤儿分支并先于主分支推送，链接指向该分支；
+    --prune-assets 只重写资源分支的历史来回收旧图片
+  - 断点续传：--publish 把计划和进度（渲染、回写、提交、推送）记在
+    .cache/knowledge_publisher/journal.json，文档原子写入；中断后重新运行从断点继续，
+    推送失败时只重试推送（--no-resume 丢弃日志重新开始）
 
 依赖：
   npm install -g @mermaid-js/mermaid-cli
+  pip install Pillow   # 可选，--optimize / --format webp 需要
 
 使用示例：
   # 完整发布流程（推荐，由 Skill 调用）
   python tools/knowledge_publisher.py --publish
 
+  # 增量发布：只处理相对 HEAD（或 --since 指定的 ref）有变更的文档
+  python tools/knowledge_publisher.py --publish --incremental
+  python tools/knowledge_publisher.py --publish --since origin/main
+
+  # 发布前先校验文档（规则见 knowledge_validator.py），有 error 时不发布
+  python tools/knowledge_publisher.py --publish --validate
+
+  # 上次发布中断 / 推送失败：直接重新运行即可从断点继续；--no-resume 从头开始
+  python tools/knowledge_publisher.py --publish --no-resume
+
+  # 一次处理整个仓库：多个根目录共用一次工具检查和一个渲染队列
+  python tools/knowledge_publisher.py --publish --root knowledge --root agent-client --root oral
+  python tools/knowledge_publisher.py --all --root agent-client --exclude "**/drafts/**"
+
   # 仅生成图片（适合调试）
   python tools/knowledge_publisher.py --all
   python tools/knowledge_publisher.py knowledge/xxx.md
 
+  # 使用旧的逐个渲染后端
+  python tools/knowledge_publisher.py --all --renderer spawn
+
+  # 8 个 mmdc 并发渲染
+  python tools/knowledge_publisher.py --all --jobs 8
+
+  # 把旧布局的图片迁移到当前布局（移动文件 + 改写链接）
+  python tools/knowledge_publisher.py --migrate-images
+  python tools/knowledge_publisher.py --migrate-images --layout doc
+
+  # 列出 / 删除未被引用的图片
+  python tools/knowledge_publisher.py --gc
+  python tools/knowledge_publisher.py --gc --delete
+
+  # 离线导出给飞书导入（图片在本地，不用等推送）：目录 / zip / 内联 / 固定到 commit
+  python tools/knowledge_publisher.py --export knowledge/xxx.md
+  python tools/knowledge_publisher.py --export --all --bundle zip
+  python tools/knowledge_publisher.py --export knowledge/xxx.md --bundle inline
+  python tools/knowledge_publisher.py --export knowledge/xxx.md --bundle pinned
+
+  # 图片放到独立的资源分支（主分支只有文档，clone 体积不随图表改动增长）
+  python tools/knowledge_publisher.py --publish --assets-branch assets
+  python tools/knowledge_publisher.py --prune-assets --assets-branch assets   # 只保留仍被引用的图片
+
+  # 重新生成 README / 命令索引里的目录（--check 只检查是否过期，适合 CI）
+  python tools/knowledge_publisher.py --catalog
+  python tools/knowledge_publisher.py --catalog --check
+
+  # 优化图片体积 / 输出 WebP
+  python tools/knowledge_publisher.py --publish --optimize
+  python tools/knowledge_publisher.py --all --format webp --optimize
+
+  # 分阶段耗时（JSON 汇总 / Chrome trace）与 cProfile
+  python tools/knowledge_publisher.py --publish --trace-json .cache/trace.json
+  python tools/knowledge_publisher.py --all --trace-chrome .cache/trace.chrome.json
+  python tools/knowledge_publisher.py --all --profile .cache/publish.prof
+
+  # 边写边预览：保存后渲染有变化的图表，预览见 .cache/knowledge_publisher/preview/
+  python tools/knowledge_publisher.py --watch
+
+  # 常驻服务（Unix socket），之后的调用通过 --socket 转发，服务未运行或配置不同时在本进程执行
+  python tools/knowledge_publisher.py --serve --socket
+  python tools/knowledge_publisher.py --publish --socket
+
+  # 常驻服务（stdio），每行一个 JSON-RPC 请求：
+  #   {"jsonrpc": "2.0", "id": 1, "method": "build", "params": {"all": true}}
+  # 方法：ping / publish {incremental, since, validate, resume} / build {files, all}
+  #       / preview {files} / shutdown
+  python tools/knowledge_publisher.py --serve
+
 注意：
-  - --publish 会直接修改原文档、提交并推送
+  - --publish 会直接修改原文档、提交并推送（knowledge/ 以外的修改不会被带进提交）
   - 图片通过 GitHub Raw URL 引用
+  - 渲染缓存位于 .cache/knowledge_publisher/（不提交），删除即可强制全量重渲染
   - 飞书导入后可直接显示图片
 """
 
@@ -42,492 +137,4103 @@ import subprocess
 import sys
 import argparse
 from pathlib import Path
+import base64
 import hashlib
+import io
+import json
+import os
+import select
+import shutil
+import signal
+import socket
+import socketserver
+import struct
 import tempfile
+import threading
+import zipfile
+import zlib
+import contextlib
+import ctypes
+import ctypes.util
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Optional
+from urllib.parse import unquote
 import time
 
+try:
+    from PIL import Image
+except ImportError:  # Pillow 是可选依赖，只有 --optimize / --format webp 需要
+    Image = None
+
 # GitHub 配置（用于生成图片 URL）
 GITHUB_REPO = "wangsc02/lessoning-ai"
 GITHUB_BRANCH = "main"
 
+# 图片所在的资源分支（孤儿分支，只放图片）；None 表示图片和文档一起提交到 GITHUB_BRANCH
+ASSETS_BRANCH = None
+
 # 图片根目录
 IMAGES_ROOT = Path("knowledge/images")
 
+# 本地缓存目录（不提交到 Git）
+CACHE_DIR = Path(".cache/knowledge_publisher")
+RENDER_CACHE_FILE = CACHE_DIR / "render_cache.json"
+
+# --watch 的预览输出：替换成图片后的 Markdown + 内容寻址的预览图片
+PREVIEW_DIR = CACHE_DIR / "preview"
+PREVIEW_IMAGES = PREVIEW_DIR / "images"
+
+# --export 的默认输出目录
+EXPORT_DIR = CACHE_DIR / "export"
+
+# 渲染参数（同时参与渲染缓存的 key 计算）
+# format / optimize 可以按次运行通过命令行修改，见 configure_output()
+RENDER_OPTIONS = {
+    "width": 2000,
+    "scale": 3,
+    "background": "transparent",
+    "format": "png",
+    "optimize": False,
+}
+
+# 支持的输出格式：png/svg 由 mmdc 直接输出，webp 由 PNG 转换而来
+IMAGE_FORMATS = ("png", "webp", "svg")
+
+# 图片目录布局：
+#   shared : 内容寻址的共享存储 knowledge/images/store/{源码哈希}.png，跨文档去重
+#   doc    : 旧布局，按文档分目录 knowledge/images/{文档名}/{序号}_{哈希}.png
+IMAGE_LAYOUTS = ("shared", "doc")
+IMAGE_LAYOUT = "shared"
+IMAGE_STORE = IMAGES_ROOT / "store"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
+# mmdc 版本（进程内只探测一次）
+_mmdc_version: Optional[str] = None
+
+
+# ==================== 性能追踪 ====================
+
+
+class Tracer:
+    """
+    轻量级分段计时：嵌套 span 记录每个阶段的起止时间
+    可导出 JSON 汇总（按 span 路径聚合）和 Chrome trace-event 文件
+    （chrome://tracing 或 https://ui.perfetto.dev 打开）
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.local = threading.local()
+        self.main_stack = self.local.stack = []
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        stack = self.local.__dict__.setdefault("stack", [])
+        # 工作线程里的 span 挂在主线程当前所处的阶段下面
+        parent = self.main_stack if stack is not self.main_stack else []
+        stack.append(name)
+        path = "/".join([*parent, *stack])
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            self.events.append(
+                {
+                    "name": name,
+                    "path": path,
+                    "start": begin - self.origin,
+                    "duration": end - begin,
+                    "thread": threading.get_ident(),
+                    "attrs": attrs,
+                }
+            )
+
+    def summary(self) -> dict:
+        """按 span 路径聚合：调用次数、总耗时、最大单次耗时"""
+        spans = {}
+        for event in sorted(self.events, key=lambda e: e["start"]):
+            stat = spans.setdefault(
+                event["path"], {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            stat["calls"] += 1
+            stat["seconds"] += event["duration"]
+            stat["max_seconds"] = max(stat["max_seconds"], event["duration"])
+        for stat in spans.values():
+            stat["seconds"] = round(stat["seconds"], 6)
+            stat["max_seconds"] = round(stat["max_seconds"], 6)
+        wall = time.perf_counter() - self.origin
+        return {"wall_seconds": round(wall, 6), "spans": spans}
+
+    def chrome_trace(self) -> dict:
+        """Chrome trace-event 格式（完整事件 ph=X，时间单位微秒）"""
+        pid = os.getpid()
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {
+                    "name": e["name"],
+                    "cat": e["path"].split("/")[0],
+                    "ph": "X",
+                    "ts": round(e["start"] * 1e6, 1),
+                    "dur": round(e["duration"] * 1e6, 1),
+                    "pid": pid,
+                    "tid": e["thread"],
+                    "args": {k: str(v) for k, v in e["attrs"].items()},
+                }
+                for e in self.events
+            ],
+        }
+
+    def report(self) -> None:
+        print(f"\n⏱️  阶段耗时（共 {time.perf_counter() - self.origin:.2f}s）")
+        for path, stat in self.summary()["spans"].items():
+            indent = "  " * path.count("/")
+            name = path.rsplit("/", 1)[-1]
+            print(
+                f"   {indent}{name:<24}{stat['calls']:>5} 次"
+                f"{stat['seconds'] * 1000:>12.1f} ms"
+            )
+
+
+class NullTracer:
+    """未开启追踪时使用：span 是一个可复用的空上下文，几乎没有开销"""
+
+    _null_span = contextlib.nullcontext()
+
+    def span(self, name: str, **attrs):
+        return self._null_span
+
+
+_tracer = NullTracer()
+
+
+def enable_tracing() -> Tracer:
+    """开启本进程的追踪，返回 Tracer 以便最后导出"""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def span(name: str, **attrs):
+    """在当前追踪器上开启一个 span（未开启追踪时为空操作）"""
+    return _tracer.span(name, **attrs)
+
+
+def traced(name: str):
+    """装饰器：整个函数调用记为一个 span"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_mmdc_version() -> Optional[str]:
+    """获取 mmdc 版本（成功后缓存），未安装或 --version 失败时返回 None"""
+    global _mmdc_version
+    if _mmdc_version is None:
+        try:
+            result = subprocess.run(
+                ["mmdc", "--version"], capture_output=True, text=True, timeout=5
+            )
+        except FileNotFoundError:
+            return None
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        _mmdc_version = result.stdout.strip()
+    return _mmdc_version
+
+
+@traced("tool.check")
 def check_mmdc() -> bool:
     """检查 mmdc 是否已安装"""
     try:
-        result = subprocess.run(
-            ["mmdc", "--version"], capture_output=True, text=True, timeout=5
-        )
-        version = result.stdout.strip()
-        print(f"✅ mmdc 已安装: {version}\n")
-        return True
-    except FileNotFoundError:
-        print("❌ 错误：mmdc 未安装")
-        print("安装方法: npm install -g @mermaid-js/mermaid-cli\n")
-        return False
+        version = get_mmdc_version()
     except Exception as e:
         print(f"❌ 检查 mmdc 失败: {e}\n")
         return False
+    if version is None:
+        print("❌ 错误：mmdc 未安装或无法运行（mmdc --version 失败）")
+        print("安装方法: npm install -g @mermaid-js/mermaid-cli\n")
+        return False
+    print(f"✅ mmdc 已安装: {version}\n")
+    return True
+
+
+def configure_output(
+    fmt: str = "png", optimize: bool = False, layout: str = "shared"
+) -> bool:
+    """设置本次运行的输出格式、优化选项和图片布局，缺少 Pillow 时返回 False"""
+    global IMAGE_LAYOUT
+    if (fmt == "webp" or optimize) and Image is None:
+        print("❌ --format webp / --optimize 需要 Pillow")
+        print("安装方法: pip install Pillow\n")
+        return False
+    RENDER_OPTIONS["format"] = fmt
+    RENDER_OPTIONS["optimize"] = optimize
+    IMAGE_LAYOUT = layout
+    return True
 
 
-def extract_mermaid_blocks(md_file: Path) -> Tuple[List[dict], str]:
-    """提取所有 Mermaid 代码块"""
-    try:
-        content = md_file.read_text(encoding="utf-8")
-    except Exception as e:
-        print(f"❌ 读取文件失败: {e}")
-        return [], ""
-
-    pattern = r"```mermaid\n(.*?)```"
-    blocks = []
-
-    for i, match in enumerate(re.finditer(pattern, content, re.DOTALL), 1):
-        code = match.group(1).strip()
-        code_hash = hashlib.md5(code.encode()).hexdigest()[:8]
-
-        blocks.append(
-            {"index": i, "code": code, "hash": code_hash, "full_match": match.group(0)}
-        )
-
-    return blocks, content
+def configure_repo(
+    repo: str = GITHUB_REPO,
+    branch: str = GITHUB_BRANCH,
+    assets_branch: Optional[str] = None,
+) -> None:
+    """
+    设置图片 URL 引用的 GitHub 仓库和分支（推送验证也对比这个分支）
+    assets_branch 不为空时图片链接改为指向该资源分支
+    """
+    global GITHUB_REPO, GITHUB_BRANCH, ASSETS_BRANCH
+    GITHUB_REPO = repo
+    GITHUB_BRANCH = branch
+    ASSETS_BRANCH = assets_branch
+
+
+def has_image_signature(path: Path) -> bool:
+    """按扩展名检查文件头，过滤掉空文件或渲染失败留下的残骸"""
+    with path.open("rb") as f:
+        head = f.read(256)
+    if path.suffix == ".png":
+        return head.startswith(PNG_SIGNATURE)
+    if path.suffix == ".webp":
+        return head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+    if path.suffix == ".svg":
+        return b"<svg" in head or head.lstrip().startswith(b"<?xml")
+    return False
+
+
+def write_text_atomic(path: Path, content: str) -> None:
+    """先写同目录的临时文件再 rename，中断时文件要么是旧内容要么是新内容"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """原子写入 JSON，避免中断时留下半个文件"""
+    write_text_atomic(
+        path, json.dumps(data, ensure_ascii=False, indent=1, sort_keys=True)
+    )
 
 
-def get_image_path(doc_name: str, index: int, code_hash: str) -> tuple[str, Path]:
+class RenderCache:
     """
-    生成图片路径和相对路径
-    目录结构: knowledge/images/{文档名}/{序号}_{哈希}.png
-    例如: knowledge/images/langchain1/1_abc123.png
+    内容寻址的渲染缓存
 
-    返回: (相对路径, 绝对路径)
+    key = sha256(源码 + 渲染参数 + 渲染器版本)，value 记录输出文件路径和大小。
+    命中且输出文件仍然有效时，完全跳过 generate_diagram()。
     """
-    # 提取文档名（去掉路径和扩展名）
-    doc_base = Path(doc_name).stem
 
-    # 简化文档名（转小写，去掉特殊字符）
-    doc_prefix = re.sub(r"[^a-z0-9]+", "_", doc_base.lower())
+    def __init__(
+        self, renderer_version: str = "", cache_file: Path = RENDER_CACHE_FILE
+    ):
+        self.renderer_version = renderer_version
+        self.cache_file = cache_file
+        self.hits = 0
+        self.misses = 0
+        self.load()
 
-    # 限制长度
-    if len(doc_prefix) > 20:
-        doc_prefix = doc_prefix[:20]
+    def file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.cache_file.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> None:
+        self.entries = {}
+        self.dirty = False
+        self.loaded_stat = self.file_stat()
+        try:
+            self.entries = json.loads(self.cache_file.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def refresh(self) -> None:
+        """常驻进程中使用：缓存文件被其他进程改写过时重新加载，并清零命中统计"""
+        if not self.dirty and self.file_stat() != self.loaded_stat:
+            self.load()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, code: str) -> str:
+        payload = json.dumps(
+            {
+                "code": code,
+                "options": RENDER_OPTIONS,
+                "renderer": self.renderer_version,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    # 图片文件名（不含文档名前缀）
-    img_filename = f"{index}_{code_hash}.png"
+    @staticmethod
+    def is_valid_output(path: Path, size: int) -> bool:
+        """输出文件存在、大小一致且文件头合法"""
+        try:
+            return path.stat().st_size == size and has_image_signature(path)
+        except OSError:
+            return False
 
-    # 文档专属目录
-    doc_dir = IMAGES_ROOT / doc_prefix
+    def lookup(self, code: str, output_path: Path) -> bool:
+        """
+        查询缓存，命中时保证 output_path 已就绪
+        若缓存的图片在别的路径（例如图表序号变化），直接复制过来；
+        没有缓存条目但 output_path 是共享存储中这份源码的图片时，也算命中
+        """
+        entry = self.entries.get(self.make_key(code))
+        if entry:
+            cached_path = Path(entry["output"])
+            if self.is_valid_output(cached_path, entry["size"]):
+                if cached_path != output_path:
+                    commit_image(cached_path.read_bytes(), output_path)
+                self.hits += 1
+                return True
+        # 缓存目录不提交：刚 clone 的仓库或 CI 里没有缓存条目，
+        # 但共享存储里按源码哈希命名的图片已经提交，直接认领，不必重新渲染
+        if (
+            output_path.parent.name == IMAGE_STORE.name
+            and output_path.stem == hashlib.sha256(code.encode()).hexdigest()[:16]
+            and output_path.is_file()
+            and has_image_signature(output_path)
+        ):
+            self.store(code, output_path)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
 
-    # 相对路径（用于 GitHub URL）
-    rel_path = f"{doc_prefix}/{img_filename}"
+    def store(self, code: str, output_path: Path) -> None:
+        """记录一次成功的渲染"""
+        self.entries[self.make_key(code)] = {
+            "output": output_path.as_posix(),
+            "size": output_path.stat().st_size,
+        }
+        self.dirty = True
 
-    # 绝对路径（用于本地保存）
-    abs_path = doc_dir / img_filename
+    def relocate(self, old_path: Path, new_path: Path) -> None:
+        """图片被移动后，让指向旧路径的缓存条目跟着更新"""
+        for entry in self.entries.values():
+            if entry["output"] == old_path.as_posix():
+                entry["output"] = new_path.as_posix()
+                self.dirty = True
 
-    return rel_path, abs_path
+    def save(self) -> None:
+        if self.dirty:
+            write_json_atomic(self.cache_file, self.entries)
+            self.dirty = False
+            self.loaded_stat = self.file_stat()
 
+    def report(self) -> None:
+        total = self.hits + self.misses
+        print(f"♻️  渲染缓存: 命中 {self.hits}/{total}，未命中 {self.misses}")
 
-def generate_diagram(mermaid_code: str, output_path: Path) -> bool:
-    """使用 mmdc 生成高质量图片"""
-    # 创建临时 .mmd 文件
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".mmd", delete=False, encoding="utf-8"
-    ) as f:
-        f.write(mermaid_code)
-        temp_mmd = f.name
 
-    try:
-        # 调用 mmdc
-        cmd = [
-            "mmdc",
-            "-i",
-            temp_mmd,
-            "-o",
-            str(output_path),
-            "-w",
-            "2000",  # 宽度 2000px
-            "-s",
-            "3",  # 3倍缩放
-            "-b",
-            "transparent",  # 透明背景
-        ]
+# ==================== Markdown 扫描 ====================
 
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+# 围栏代码块开头：最多 3 个空格缩进 + ``` 或 ~~~（至少 3 个）+ info string
+FENCE_OPEN_RE = re.compile(r"^( {0,3})(`{3,}|~{3,})(.*?)\r?$", re.MULTILINE)
 
-        if result.returncode == 0 and output_path.exists():
-            size = output_path.stat().st_size
-            print(f"    ✅ 成功 ({size:,} bytes)")
-            return True
-        else:
-            print(f"    ❌ 失败: {result.stderr}")
-            return False
+# 已发布图表的外壳：图片链接 + <details> 折叠块，紧贴在 mermaid 围栏前
+PUBLISHED_PREFIX_RE = re.compile(
+    r"[ \t]*!\[流程图 \d+\]\((?P<url>[^)\n]*)\)[ \t]*\r?\n"
+    r"[ \t]*\r?\n"
+    r"[ \t]*<details>[ \t]*\r?\n"
+    r"[ \t]*<summary>📝 查看/编辑 Mermaid 源码</summary>[ \t]*\r?\n"
+    r"[ \t]*\r?\n\Z"
+)
+PUBLISHED_SUFFIX_RE = re.compile(
+    r"[ \t]*\r?\n[ \t]*\r?\n[ \t]*</details>[ \t]*(?=\r?\n|\Z)"
+)
 
-    except subprocess.TimeoutExpired:
-        print(f"    ❌ 超时")
-        return False
-    except Exception as e:
-        print(f"    ❌ 错误: {e}")
-        return False
-    finally:
-        Path(temp_mmd).unlink(missing_ok=True)
+# 向前查找外壳时的窗口大小（足够容纳一层外壳 + 长 URL）
+PUBLISHED_PREFIX_WINDOW = 1024
 
+_closing_re_cache = {}
 
-def replace_mermaid_with_images(
-    blocks: List[dict], original_content: str, doc_name: str
-) -> str:
+
+def _closing_fence_re(marker: str, legacy: bool) -> re.Pattern:
     """
-    将 Mermaid 代码块替换为图片链接 + 折叠的源码
-    直接修改原文档，不生成副本
+    围栏结束行的正则：同种字符、长度不小于开头
+    legacy=True 时额外接受 "代码```" 这种把结束符写在代码行末尾的旧格式
+    （早期版本生成的已发布文档就是这样）
     """
-    new_content = original_content
-
-    for block in blocks:
-        i = block["index"]
-        img_rel_path, _ = get_image_path(doc_name, i, block["hash"])
-        github_url = f"https://raw.githubusercontent.com/{GITHUB_REPO}/{GITHUB_BRANCH}/knowledge/images/{img_rel_path}"
-
-        # 替换为：图片 + 折叠的源码
-        replacement = f"""![流程图 {i}]({github_url})
-
-<details>
-<summary>📝 查看/编辑 Mermaid 源码</summary>
+    key = (marker, legacy)
+    if key not in _closing_re_cache:
+        fence = f"{re.escape(marker[0])}{{{len(marker)},}}"
+        prefix = r"(?P<pre>[^\n]*?)" if legacy else r"(?P<pre> {0,3})"
+        _closing_re_cache[key] = re.compile(
+            rf"^{prefix}{fence}[ \t]*\r?$", re.MULTILINE
+        )
+    return _closing_re_cache[key]
 
-```mermaid
-{block['code']}```
 
-</details>"""
+def scan_fences(content: str) -> List[dict]:
+    """
+    单遍扫描 Markdown 中的所有围栏代码块
+
+    只在候选行上做正则匹配，不逐行复制文本；支持 ``` / ~~~、info string、
+    CRLF、最多 3 个空格的缩进以及未闭合的围栏（延续到文末）。
+
+    返回按出现顺序排列的列表，每项包含：
+      start / end  : 围栏在 content 中的偏移（end 不含结束行的换行符）
+      line         : 开头行号（从 1 开始）
+      indent       : 开头缩进
+      marker       : 开头围栏字符串（如 ``` 或 ~~~~）
+      info / lang  : 完整 info string / 第一个单词（小写）
+      code         : 去掉缩进、统一为 \\n 换行的代码内容
+      closed       : 是否找到结束行
+    """
+    fences = []
+    pos = 0
+    line = 1
+    line_pos = 0
+    length = len(content)
+
+    while pos < length:
+        m = FENCE_OPEN_RE.search(content, pos)
+        if not m:
+            break
+
+        indent, marker, info = m.group(1), m.group(2), m.group(3).strip()
+        # 反引号围栏的 info string 不能包含反引号（否则是行内代码）
+        if marker[0] == "`" and "`" in info:
+            pos = m.end() + 1
+            continue
 
-        new_content = new_content.replace(block["full_match"], replacement, 1)
+        lang = info.split()[0].lower() if info else ""
+        body_start = min(m.end() + 1, length)
+        legacy = lang == "mermaid" and marker[0] == "`"
+        close = _closing_fence_re(marker, legacy).search(content, body_start)
+
+        if close:
+            code_end = close.start() + len(close.group("pre"))
+            if close.group("pre").strip() == "":
+                code_end = close.start()
+            end = close.end()
+            if content[end - 1] == "\r":
+                end -= 1
+        else:
+            code_end = end = length
+
+        body = content[body_start:code_end].replace("\r\n", "\n")
+        if indent:
+            width = len(indent)
+            body = "\n".join(
+                l[width:] if l.startswith(indent) else l.lstrip(" ")
+                for l in body.split("\n")
+            )
+
+        line += content.count("\n", line_pos, m.start())
+        line_pos = m.start()
+        fences.append(
+            {
+                "start": m.start(),
+                "end": end,
+                "line": line,
+                "indent": indent,
+                "marker": marker,
+                "info": info,
+                "lang": lang,
+                "code": body,
+                "closed": close is not None,
+            }
+        )
+        pos = end + 1
 
-    return new_content
+    return fences
 
 
-# ==================== Git 操作函数 ====================
+def find_published_wrapper(
+    content: str, start: int, end: int
+) -> Tuple[int, int, int, str]:
+    """
+    查找包裹在围栏外的已发布外壳（图片链接 + <details>）
+    早期版本会重复包裹，这里会把多层外壳一起识别出来
 
+    返回 (外壳起点, 外壳终点, 层数, 最外层图片 URL)，没有外壳时层数为 0
+    """
+    prefix_starts = []
+    urls = []
+    pos = start
+    while True:
+        window_start = max(0, pos - PUBLISHED_PREFIX_WINDOW)
+        # 先用 rfind 快速排除，绝大多数围栏前面没有外壳
+        if content.rfind("</summary>", window_start, pos) == -1:
+            break
+        m = PUBLISHED_PREFIX_RE.search(content, window_start, pos)
+        if not m:
+            break
+        prefix_starts.append(m.start())
+        urls.append(m.group("url"))
+        pos = m.start()
+
+    suffix_ends = []
+    pos = end
+    while len(suffix_ends) < len(prefix_starts):
+        m = PUBLISHED_SUFFIX_RE.match(content, pos)
+        if not m:
+            break
+        suffix_ends.append(m.end())
+        pos = m.end()
+
+    depth = len(suffix_ends)
+    if depth == 0:
+        return start, end, 0, ""
+    return prefix_starts[depth - 1], suffix_ends[-1], depth, urls[depth - 1]
+
+
+def find_mermaid_blocks(content: str) -> List[dict]:
+    """从 Markdown 文本中找出所有 Mermaid 图表（含已发布的）"""
+    blocks = []
+    mermaid_fences = (f for f in scan_fences(content) if f["lang"] == "mermaid")
 
-def run_git_command(cmd: List[str], check: bool = True) -> Tuple[bool, str, str]:
-    """运行 Git 命令并返回结果"""
-    try:
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=30, check=check
+    for i, fence in enumerate(mermaid_fences, 1):
+        code = fence["code"].strip()
+        code_hash = hashlib.md5(code.encode()).hexdigest()[:8]
+        digest = hashlib.sha256(code.encode()).hexdigest()
+        start, end, depth, url = find_published_wrapper(
+            content, fence["start"], fence["end"]
         )
-        return result.returncode == 0, result.stdout, result.stderr
-    except subprocess.TimeoutExpired:
-        return False, "", "命令超时"
-    except Exception as e:
-        return False, "", str(e)
 
+        blocks.append(
+            {
+                "index": i,
+                "code": code,
+                "hash": code_hash,
+                "digest": digest,
+                "line": fence["line"],
+                "indent": fence["indent"],
+                "start": start,
+                "end": end,
+                "published": depth > 0,
+                "wrapper_depth": depth,
+                "image_url": url,
+            }
+        )
 
-def check_git_status() -> bool:
-    """检查 Git 状态，返回是否有修改"""
-    print("📋 步骤 1/5: 检查 Git 状态\n")
+    return blocks
 
-    # 检查是否有修改（包括 staged 和 unstaged）
-    success, stdout, _ = run_git_command(["git", "diff", "--quiet"], check=False)
-    has_unstaged = not success
 
-    success, stdout, _ = run_git_command(
-        ["git", "diff", "--cached", "--quiet"], check=False
-    )
-    has_staged = not success
+@traced("extract")
+def extract_mermaid_blocks(md_file: Path) -> Tuple[List[dict], str]:
+    """提取所有 Mermaid 代码块"""
+    try:
+        content = md_file.read_text(encoding="utf-8")
+    except Exception as e:
+        print(f"❌ 读取文件失败: {e}")
+        return [], ""
 
-    if has_unstaged or has_staged:
-        print("✅ 检测到文件修改\n")
-        success, stdout, _ = run_git_command(["git", "status", "--short"])
-        print(stdout)
-        return True
-    else:
-        print("ℹ️  没有检测到修改\n")
-        return False
+    return find_mermaid_blocks(content), content
+
+
+# ==================== Mermaid 预检查 ====================
+
+# Mermaid 支持的图表类型（首个有效行的第一个单词）
+MERMAID_TYPES = {
+    "graph",
+    "flowchart",
+    "sequenceDiagram",
+    "classDiagram",
+    "classDiagram-v2",
+    "stateDiagram",
+    "stateDiagram-v2",
+    "erDiagram",
+    "journey",
+    "gantt",
+    "pie",
+    "quadrantChart",
+    "requirementDiagram",
+    "gitGraph",
+    "C4Context",
+    "C4Container",
+    "C4Component",
+    "C4Dynamic",
+    "C4Deployment",
+    "mindmap",
+    "timeline",
+    "zenuml",
+    "sankey-beta",
+    "xychart-beta",
+    "block-beta",
+    "packet-beta",
+    "architecture-beta",
+    "kanban",
+    "radar-beta",
+}
+
+FLOWCHART_DIRECTIONS = {"TB", "TD", "BT", "RL", "LR"}
+
+# 流程图里不参与节点/连线检查的语句
+FLOWCHART_STATEMENTS = {"style", "classDef", "class", "linkStyle", "click", "direction"}
+
+# 时序图中需要 end 结束的块，以及只能出现在对应块内的分支关键字
+SEQUENCE_BLOCKS = {"loop", "alt", "opt", "par", "critical", "break", "rect", "box"}
+SEQUENCE_BRANCHES = {"else": "alt", "and": "par", "option": "critical"}
+SEQUENCE_STATEMENTS = {
+    "participant",
+    "actor",
+    "note",
+    "activate",
+    "deactivate",
+    "autonumber",
+    "title",
+    "link",
+    "links",
+    "create",
+    "destroy",
+    "properties",
+    "details",
+    "accTitle",
+    "accDescr",
+}
+
+# 时序图消息：A->>B: text，箭头为 -> --> ->> -->> -x --x -) --) 以及双向 <<->>
+SEQUENCE_MESSAGE_RE = re.compile(
+    r"^[^:]+?\s*(?:<<-{1,2}>>|-{1,2}(?:>>|>|x|\)))\s*[+-]?\s*[^:\s][^:]*(?::|$)"
+)
+
+# 流程图中不合法的箭头：单横线 -> 和单等号 =>（合法的是 --> ==> -.-> 等）
+FLOWCHART_BAD_ARROW_RE = re.compile(r"(?<![-.=<])->|(?<![=<])=>")
+EDGE_LABEL_RE = re.compile(r"\|[^|]*\|")
+
+# 需要跨行配对 {} 的图表类型
+BRACED_TYPES = {
+    "stateDiagram",
+    "stateDiagram-v2",
+    "classDiagram",
+    "classDiagram-v2",
+    "erDiagram",
+}
+
+BRACKET_PAIRS = {")": "(", "]": "[", "}": "{"}
+
+# 自适应超时：基础时间 + 每行源码的增量，只会放宽 --timeout，不会收紧
+# （冷启动的 Chromium 在 --jobs N 下经常要十几秒，基础时间不低于原来的固定 30s）
+TIMEOUT_BASE = 30
+TIMEOUT_PER_LINE = 0.25
+
+
+def mermaid_lines(code: str):
+    """产出 (行号, 去掉首尾空白的行)，跳过空行、%% 注释和 front-matter"""
+    lines = code.split("\n")
+    n = 0
+    if lines and lines[0].strip() == "---":
+        n = 1
+        while n < len(lines) and lines[n].strip() != "---":
+            n += 1
+        n += 1
+    for i in range(n, len(lines)):
+        stripped = lines[i].strip()
+        if stripped and not stripped.startswith("%%"):
+            yield i + 1, stripped
+
+
+def scan_brackets(line: str) -> Tuple[str, Optional[str]]:
+    """
+    单行括号/引号检查，返回 (括号与引号之外的骨架文本, 问题描述)
+    流程图的不对称节点 A>文本] 里，括号外紧跟标识符的 > 视为开括号
+    """
+    skeleton = []
+    stack = []
+    quoted = False
+    prev = ""
+    for ch in line:
+        if ch == '"':
+            quoted = not quoted
+        elif quoted:
+            pass
+        elif ch in "([{" or (
+            ch == ">" and not stack and (prev.isalnum() or prev == "_")
+        ):
+            stack.append("[" if ch == ">" else ch)
+        elif ch in BRACKET_PAIRS:
+            if not stack or stack[-1] != BRACKET_PAIRS[ch]:
+                return "", f"多余的 '{ch}'"
+            stack.pop()
+        elif not stack:
+            skeleton.append(ch)
+        prev = ch
+    if quoted:
+        return "", '引号 " 未闭合'
+    if stack:
+        return "", f"'{stack[-1]}' 未闭合"
+    return "".join(skeleton), None
+
+
+def lint_mermaid(code: str) -> List[Tuple[int, str]]:
+    """
+    纯 Python 的 Mermaid 语法预检查（不启动浏览器），一次返回全部问题
+    只覆盖最常见的错误：图表类型、括号/引号、subgraph/块与 end 的配对、箭头写法
 
+    返回 [(图表内行号, 问题描述), ...]，空列表表示没有发现问题
+    """
+    lines = list(mermaid_lines(code))
+    if not lines:
+        return [(1, "图表为空")]
+
+    problems = []
+    header_no, header = lines[0]
+    words = header.split()
+    kind = words[0].rstrip(":;")
+    if kind not in MERMAID_TYPES:
+        return [(header_no, f"未知的图表类型 '{kind}'")]
+    if kind in ("graph", "flowchart") and len(words) > 1:
+        if words[1].rstrip(";") not in FLOWCHART_DIRECTIONS:
+            problems.append((header_no, f"未知的方向 '{words[1]}'"))
+
+    # 需要 end 闭合的块：[(关键字, 行号)]
+    blocks = []
+    braces = []
+    for line_no, line in lines[1:]:
+        keyword = line.split()[0].rstrip(":;")
+
+        if kind in ("graph", "flowchart"):
+            if keyword == "subgraph":
+                blocks.append((keyword, line_no))
+                continue
+            if keyword == "end":
+                if not blocks:
+                    problems.append((line_no, "多余的 end（没有对应的 subgraph）"))
+                else:
+                    blocks.pop()
+                continue
+            if keyword in FLOWCHART_STATEMENTS:
+                continue
+            skeleton, problem = scan_brackets(line)
+            if problem:
+                problems.append((line_no, problem))
+                continue
+            if FLOWCHART_BAD_ARROW_RE.search(EDGE_LABEL_RE.sub("", skeleton)):
+                problems.append((line_no, "箭头写法错误（流程图使用 --> 或 ==>）"))
+
+        elif kind == "sequenceDiagram":
+            lowered = keyword.lower()
+            if keyword in SEQUENCE_BLOCKS:
+                blocks.append((keyword, line_no))
+            elif keyword == "end":
+                if not blocks:
+                    problems.append((line_no, "多余的 end（没有对应的块）"))
+                else:
+                    blocks.pop()
+            elif keyword in SEQUENCE_BRANCHES:
+                parent = SEQUENCE_BRANCHES[keyword]
+                if not blocks or blocks[-1][0] != parent:
+                    problems.append((line_no, f"{keyword} 只能出现在 {parent} 块中"))
+            elif lowered not in {s.lower() for s in SEQUENCE_STATEMENTS}:
+                if not SEQUENCE_MESSAGE_RE.match(line):
+                    problems.append((line_no, "无法识别的消息（应为 A->>B: 文本）"))
+
+        elif kind in BRACED_TYPES:
+            if keyword == "note" and ":" not in line:
+                blocks.append(("note", line_no))
+                continue
+            if line == "end note":
+                if blocks and blocks[-1][0] == "note":
+                    blocks.pop()
+                else:
+                    problems.append((line_no, "多余的 end note"))
+                continue
+            if blocks and blocks[-1][0] == "note":
+                continue
+            head = line.split(":", 1)[0]
+            for ch in scan_brackets(head.replace("{", "").replace("}", ""))[1:]:
+                if ch:
+                    problems.append((line_no, ch))
+            if head.rstrip().endswith("{"):
+                braces.append(line_no)
+            elif head.strip() == "}":
+                if not braces:
+                    problems.append((line_no, "多余的 '}'"))
+                else:
+                    braces.pop()
+
+    for keyword, line_no in blocks:
+        closing = "end note" if keyword == "note" else "end"
+        problems.append((line_no, f"{keyword} 缺少对应的 {closing}"))
+    for line_no in braces:
+        problems.append((line_no, "'{' 未闭合"))
+
+    return sorted(problems)
+
+
+def diagram_timeout(code: str, limit: float) -> float:
+    """按图表规模估算渲染超时：至少 limit，大图按行数放宽"""
+    return max(limit, TIMEOUT_BASE + TIMEOUT_PER_LINE * code.count("\n"))
+
+
+def doc_key(doc_path: Path) -> str:
+    """文档的稳定标识：相对仓库根目录的 POSIX 路径"""
+    resolved = doc_path.resolve()
+    try:
+        return resolved.relative_to(Path.cwd().resolve()).as_posix()
+    except ValueError:
+        return resolved.as_posix()
 
-def detect_mermaid_in_knowledge() -> List[Path]:
-    """检测 Knowledge Base 中包含 Mermaid 的文档"""
-    print("📋 步骤 2/5: 检测 Mermaid 代码块\n")
 
-    mermaid_docs = []
-    for doc_path in Path("knowledge").glob("*.md"):
-        try:
-            content = doc_path.read_text(encoding="utf-8")
-            if "```mermaid" in content:
-                print(f"✅ 发现 Mermaid: {doc_path.name}")
-                mermaid_docs.append(doc_path)
-        except Exception:
-            continue
+def doc_namespace(doc_name: str) -> str:
+    """
+    文档的图片命名空间：{可读 slug}-{完整相对路径的短哈希}
+    slug 只保留文件名中的 ASCII 字母数字，中文标题也不会互相冲突
+    例如: knowledge/Agent开发深度学习指南.md → agent-09e42b92
+    """
+    slug = re.sub(r"[^a-z0-9]+", "-", Path(doc_name).stem.lower()).strip("-")
+    slug = slug[:24].strip("-") or "doc"
+    digest = hashlib.sha1(doc_name.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}"
 
-    print()
-    return mermaid_docs
 
+def get_image_path(
+    doc_name: str, block: dict, images_root: Path = IMAGES_ROOT
+) -> tuple[str, Path]:
+    """
+    生成图片路径和相对路径（相对图片目录 images_root，默认 knowledge/images/）
+    doc_name 是文档相对仓库根目录的路径（见 doc_key）
 
-def generate_commit_message() -> str:
-    """根据 Git 状态生成智能 commit message"""
-    success, stdout, _ = run_git_command(["git", "status", "--short"])
-    if not success:
-        return "docs: 更新知识库"
+    shared 布局: knowledge/images/store/{源码 sha256 前 16 位}.{格式}
+      例如: knowledge/images/store/<源码 sha256 前 16 位>.png
+      同一份源码无论出现在哪个文档、第几个位置，都对应同一个文件
+    doc 布局: knowledge/images/{文档命名空间}/{序号}_{哈希}.{格式}
+      例如: knowledge/images/langchain1-0-fe6b4662/1_<源码 md5 前 8 位>.png
 
-    lines = stdout.strip().split("\n")
+    返回: (相对路径, 绝对路径)
+    """
+    fmt = RENDER_OPTIONS["format"]
 
-    # 分析修改类型
-    doc_modified = sum(
-        1
-        for line in lines
-        if line.strip().startswith("M") and "knowledge/" in line and ".md" in line
-    )
-    doc_added = sum(
-        1
-        for line in lines
-        if line.strip().startswith("A") and "knowledge/" in line and ".md" in line
-    )
-    img_modified = sum(1 for line in lines if "knowledge/images/" in line)
+    if IMAGE_LAYOUT == "shared":
+        img_filename = f"{block['digest'][:16]}.{fmt}"
+        store = images_root / IMAGE_STORE.name
+        return f"{store.name}/{img_filename}", store / img_filename
 
-    # 生成消息
-    if doc_added > 0:
-        # 获取新增文档名
-        for line in lines:
-            if line.strip().startswith("A") and "knowledge/" in line and ".md" in line:
-                doc_name = Path(line.split()[-1]).stem
-                return f"docs: 添加知识 {doc_name}"
+    # 文档专属目录（按完整路径区分，不同文档不会共用目录）
+    namespace = doc_namespace(doc_name)
 
-    if doc_modified > 0 and img_modified > 0:
-        return "docs: 更新知识及流程图"
-    elif doc_modified > 0:
-        return "docs: 更新知识内容"
-    elif img_modified > 0:
-        return "docs: 更新流程图"
+    # 图片文件名（不含文档名前缀）
+    img_filename = f"{block['index']}_{block['hash']}.{fmt}"
 
-    return "docs: 更新知识库"
+    # 相对路径（用于 GitHub URL）
+    rel_path = f"{namespace}/{img_filename}"
 
+    # 绝对路径（用于本地保存）
+    abs_path = images_root / namespace / img_filename
 
-def commit_and_push(commit_msg: str) -> Tuple[bool, str]:
-    """提交并推送到 GitHub"""
-    print("📋 步骤 4/5: 提交并推送\n")
+    return rel_path, abs_path
 
-    # 暂存所有修改
-    print("📝 暂存修改...")
-    success, _, stderr = run_git_command(["git", "add", "-A"])
-    if not success:
-        return False, f"暂存失败: {stderr}"
 
-    # 提交
-    print(f"📝 Commit Message: {commit_msg}")
-    success, _, stderr = run_git_command(["git", "commit", "-m", commit_msg])
-    if not success:
-        return False, f"提交失败: {stderr}"
+# ==================== 文档根目录 ====================
+
+# 根目录下默认处理的文档 / 默认跳过的路径（glob，相对根目录，支持 **）
+DEFAULT_INCLUDE = ("**/*.md",)
+DEFAULT_EXCLUDE = ("images/**",)
+
+
+def glob_regex(patterns) -> re.Pattern:
+    """把一组 glob 编译成一个正则（整串匹配相对根目录的 POSIX 路径），** 可跨目录"""
+    alternatives = []
+    for pattern in patterns:
+        regex = ""
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif pattern.startswith("**", i):
+                regex += ".*"
+                i += 2
+            elif pattern[i] == "*":
+                regex += "[^/]*"
+                i += 1
+            elif pattern[i] == "?":
+                regex += "[^/]"
+                i += 1
+            else:
+                regex += re.escape(pattern[i])
+                i += 1
+        alternatives.append(regex)
+    if not alternatives:
+        return re.compile(r"(?!)")
+    return re.compile("(?:" + "|".join(alternatives) + r")\Z")
+
+
+def make_root(
+    path: Path,
+    include=DEFAULT_INCLUDE,
+    exclude=DEFAULT_EXCLUDE,
+    images: Optional[Path] = None,
+) -> dict:
+    """
+    一个文档根目录：path 下匹配 include 且不匹配 exclude 的 Markdown 会被处理，
+    图片写到 images（默认 {path}/images），隐藏目录总是跳过
+    """
+    path = Path(path)
+    return {
+        "path": path,
+        "include": glob_regex(include),
+        "exclude": glob_regex(exclude),
+        "images": Path(images) if images else path / "images",
+    }
+
+
+def parse_root_spec(spec: str, include=None, exclude=None) -> dict:
+    """命令行的 --root：DIR 或 DIR=IMAGES_DIR"""
+    path, _, images = spec.partition("=")
+    return make_root(
+        Path(path),
+        include or DEFAULT_INCLUDE,
+        tuple(DEFAULT_EXCLUDE) + tuple(exclude or ()),
+        Path(images) if images else None,
+    )
 
-    print("✅ 提交成功\n")
 
-    # 获取本地 commit hash
-    success, local_hash, _ = run_git_command(["git", "rev-parse", "HEAD"])
-    if not success:
-        return False, "无法获取 commit hash"
+def root_relpath(root: dict, path: Path) -> Optional[str]:
+    rel = os.path.relpath(path, root["path"])
+    if rel == ".." or rel.startswith("../"):
+        return None
+    return Path(rel).as_posix()
 
-    local_hash = local_hash.strip()
-    print(f"本地 Commit: {local_hash[:7]}")
 
-    # 推送
-    print("正在推送...")
-    success, _, stderr = run_git_command(["git", "push"])
-    if not success:
-        return False, f"推送失败: {stderr}"
+def root_matches(root: dict, doc_path: Path) -> bool:
+    """doc_path 是否属于这个根目录（在 path 下、匹配 include、不匹配 exclude、不在隐藏目录）"""
+    rel = root_relpath(root, doc_path)
+    if rel is None or any(part.startswith(".") for part in rel.split("/")):
+        return False
+    return bool(root["include"].match(rel)) and not root["exclude"].match(rel)
+
+
+def walk_root(root: dict):
+    """遍历根目录，跳过隐藏目录和被 exclude 整体排除的目录，产出 (目录, 文件名列表)"""
+    for dirpath, dirnames, filenames in os.walk(root["path"]):
+        directory = Path(dirpath)
+        kept = []
+        for name in sorted(dirnames):
+            rel = root_relpath(root, directory / name)
+            if not name.startswith(".") and not root["exclude"].match(rel + "/"):
+                kept.append(name)
+        dirnames[:] = kept
+        yield directory, filenames
+
+
+def iter_root_documents(root: dict) -> List[Path]:
+    return sorted(
+        directory / name
+        for directory, filenames in walk_root(root)
+        for name in filenames
+        if root_matches(root, directory / name)
+    )
 
-    print("✅ 推送命令执行成功\n")
 
-    return True, local_hash
+def find_root(doc_path: Path, roots) -> Optional[dict]:
+    """包含该文档的根目录（嵌套时取最深的一个）"""
+    containing = [r for r in roots if root_relpath(r, doc_path) is not None]
+    return max(containing, key=lambda r: len(r["path"].parts), default=None)
 
 
-def verify_push(local_hash: str) -> bool:
-    """验证推送是否成功"""
-    print("📋 步骤 5/5: 验证推送\n")
+def images_root_for(doc_path: Path, roots) -> Path:
+    """文档的图片目录：所属根目录的 images，不属于任何根目录时用 IMAGES_ROOT"""
+    root = find_root(doc_path, roots)
+    return root["images"] if root else IMAGES_ROOT
 
-    # 等待远程更新
-    time.sleep(1)
 
-    # 拉取最新信息
-    print("正在验证...")
-    success, _, _ = run_git_command(["git", "fetch", "origin", "main", "--quiet"])
-    if not success:
-        print("⚠️  无法验证推送状态\n")
-        return False
+# 默认只处理 knowledge/（--root 可以指定多个根目录，一次运行共用一个渲染队列）
+KNOWLEDGE_ROOTS = (make_root(Path("knowledge"), images=IMAGES_ROOT),)
 
-    # 获取远程 hash
-    success, remote_hash, _ = run_git_command(["git", "rev-parse", "origin/main"])
-    if not success:
-        print("⚠️  无法获取远程 commit\n")
-        return False
 
-    remote_hash = remote_hash.strip()
+# ==================== 图片引用索引与回收 ====================
 
-    if local_hash == remote_hash:
-        print(f"✅ 验证成功！本地和远程一致\n")
-        return True
-    else:
-        print(f"⚠️  推送可能未完全同步")
-        print(f"   本地: {local_hash[:7]}")
-        print(f"   远程: {remote_hash[:7]}\n")
-        return False
+# Markdown 图片语法和 <img src="..."> 中的链接目标
+IMAGE_LINK_RE = re.compile(
+    r"!\[[^\]\n]*\]\(\s*<?([^)\s>]+)>?[^)]*\)|<img\s[^>]*?src=[\"']([^\"']+)[\"']"
+)
 
+IMAGE_SUFFIXES = {".png", ".webp", ".svg"}
 
-# ==================== 文档处理函数 ====================
 
+def iter_markdown_files() -> List[Path]:
+    """仓库内所有 Markdown 文件（跳过 .git、.cache 等隐藏目录）"""
+    return sorted(
+        p
+        for p in Path(".").rglob("*.md")
+        if not any(part.startswith(".") for part in p.parts)
+    )
 
-def process_document(doc_path: Path) -> bool:
-    """处理单个文档"""
-    print(f"\n{'='*60}")
-    print(f"📄 处理文档: {doc_path}")
-    print(f"{'='*60}\n")
 
-    # 检查文件是否存在
-    if not doc_path.exists():
-        print(f"❌ 文件不存在: {doc_path}\n")
-        return False
+def resolve_image_ref(
+    doc_path: Path, target: str, images_root: Path = IMAGES_ROOT
+) -> Optional[str]:
+    """
+    把文档里的图片链接解析为相对图片目录（默认 knowledge/images/）的路径
+    支持 GitHub Raw URL、仓库根相对路径以及相对当前文档的路径；其他返回 None
+    """
+    target = unquote(target.split("#")[0].split("?")[0])
+    root = images_root.as_posix() + "/"
 
-    # 提取 Mermaid 代码块
-    blocks, original_content = extract_mermaid_blocks(doc_path)
+    if root in target:
+        return target.split(root, 1)[1]
+    if "://" in target or target.startswith("data:"):
+        return None
 
-    if not blocks:
-        print(f"ℹ️  未找到 Mermaid 代码块，跳过\n")
-        return True
+    resolved = Path(os.path.normpath(doc_path.parent / target))
+    try:
+        return resolved.relative_to(images_root).as_posix()
+    except ValueError:
+        return None
 
-    print(f"📊 找到 {len(blocks)} 个 Mermaid 图表\n")
 
-    # 生成图片
-    print("🎨 生成高质量图片（2000px 宽，3x scale）\n")
-    success_count = 0
-    doc_name = doc_path.stem
+def build_image_references(
+    doc_paths: List[Path], images_root: Path = IMAGES_ROOT, manifest=None
+) -> dict:
+    """
+    从 Markdown 构建引用索引：{图片相对路径: [引用它的文档, ...]}
+    传入 manifest（文档清单）时直接用其中记录的图片链接，只重读有变化的文档
+    """
+    references = {}
+    for doc_path in doc_paths:
+        if manifest is not None:
+            entry = manifest.get(doc_path)
+            targets = entry["images"] if entry is not None else []
+        else:
+            try:
+                content = doc_path.read_text(encoding="utf-8")
+            except Exception:
+                continue
+            targets = [
+                m.group(1) or m.group(2) for m in IMAGE_LINK_RE.finditer(content)
+            ]
+        for target in targets:
+            rel = resolve_image_ref(doc_path, target, images_root)
+            if rel is not None:
+                references.setdefault(rel, []).append(doc_path)
+    return references
+
+
+def find_orphan_images(
+    images_root: Path = IMAGES_ROOT,
+    doc_paths: Optional[List[Path]] = None,
+    manifest=None,
+) -> List[Path]:
+    """图片目录（默认 knowledge/images/）下没有被任何 Markdown 引用的图片"""
+    if doc_paths is None:
+        doc_paths = iter_markdown_files()
+    references = build_image_references(doc_paths, images_root, manifest)
+    orphans = []
+    for path in sorted(images_root.rglob("*")):
+        if path.suffix not in IMAGE_SUFFIXES or path.name.startswith("."):
+            continue
+        if path.relative_to(images_root).as_posix() not in references:
+            orphans.append(path)
+    return orphans
 
-    for block in blocks:
-        i = block["index"]
-        img_rel_path, img_abs_path = get_image_path(doc_name, i, block["hash"])
 
-        # 创建文档专属目录
-        img_abs_path.parent.mkdir(parents=True, exist_ok=True)
+def collect_garbage(
+    delete: bool = False, images_roots=(IMAGES_ROOT,), manifest=None
+) -> int:
+    """
+    列出（delete=True 时删除）各图片目录下未被引用的图片，并清理空目录
+    返回退出码：0=成功
+    """
+    doc_paths = iter_markdown_files()
+    orphans = []
+    for images_root in images_roots:
+        print(f"🧹 扫描未引用的图片: {images_root}")
+        orphans += find_orphan_images(images_root, doc_paths, manifest)
+    print()
+    if manifest is not None:
+        manifest.save()
 
-        print(f"  [{i}/{len(blocks)}] {img_rel_path}")
+    if not orphans:
+        print("✅ 没有未引用的图片\n")
+        return 0
 
-        if generate_diagram(block["code"], img_abs_path):
-            success_count += 1
+    total = 0
+    for path in orphans:
+        size = path.stat().st_size
+        total += size
+        print(f"  {'🗑️ ' if delete else '  '}{path} ({size:,} bytes)")
+        if delete:
+            path.unlink()
+
+    if delete:
+        for images_root in images_roots:
+            for directory in sorted(images_root.rglob("*"), reverse=True):
+                if directory.is_dir() and not any(directory.iterdir()):
+                    directory.rmdir()
+        print(f"\n✅ 已删除 {len(orphans)} 张未引用图片，释放 {total:,} bytes\n")
+    else:
+        print(f"\nℹ️  共 {len(orphans)} 张未引用图片（{total:,} bytes）")
+        print("   使用 --gc --delete 删除\n")
+    return 0
 
-    # 替换原文档中的 Mermaid 代码块
-    if success_count > 0:
-        print(f"\n📝 更新原文档: {doc_path}")
 
-        new_content = replace_mermaid_with_images(blocks, original_content, doc_name)
-        doc_path.write_text(new_content, encoding="utf-8")
-        print(f"   ✅ 已将 Mermaid 代码块替换为图片链接\n")
+# ==================== 文档清单 ====================
 
-    # 总结
-    print(f"✅ 成功生成 {success_count}/{len(blocks)} 个图表")
+# 每个文档一条：标题、章节、大小、图表哈希、图片引用、内容哈希
+# 按 (mtime_ns, size) 判断是否需要重读，目录生成 / Mermaid 检测 / 图片回收共用
+MANIFEST_FILE = CACHE_DIR / "manifest.json"
+MANIFEST_VERSION = 1
 
-    return success_count == len(blocks)
+HEADING_RE = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$")
+FRONTMATTER_RE = re.compile(r"\A---\r?\n(.*?)\r?\n---\r?\n", re.S)
+DESCRIPTION_RE = re.compile(r"^description:[ \t]*(.+?)[ \t]*$", re.M)
 
 
-def publish() -> int:
+def document_outline(content: str) -> List[Tuple[int, str]]:
+    """文档的标题列表 [(级别, 文本)]，跳过代码块里的 # 行"""
+    lines = content.splitlines()
+    in_code = set()
+    for fence in scan_fences(content):
+        last = fence["line"] + content.count("\n", fence["start"], fence["end"])
+        in_code.update(range(fence["line"], last + 1))
+    outline = []
+    for number, line in enumerate(lines, 1):
+        if number in in_code:
+            continue
+        m = HEADING_RE.match(line)
+        if m:
+            outline.append((len(m.group(1)), m.group(2)))
+    return outline
+
+
+def document_entry(doc_path: Path, content: str, blocks: List[dict]) -> dict:
+    """从文档内容生成清单条目（blocks 为 find_mermaid_blocks 的结果）"""
+    outline = document_outline(content)
+    title = next((text for level, text in outline if level == 1), None)
+    if title is None:
+        title = outline[0][1] if outline else doc_path.stem
+    frontmatter = FRONTMATTER_RE.match(content)
+    description = ""
+    if frontmatter:
+        m = DESCRIPTION_RE.search(frontmatter.group(1))
+        if m:
+            description = m.group(1).strip("\"'")
+    images = [m.group(1) or m.group(2) for m in IMAGE_LINK_RE.finditer(content)]
+    return {
+        "sha256": hashlib.sha256(content.encode("utf-8")).hexdigest(),
+        "title": title,
+        "description": description,
+        "headings": [[level, text] for level, text in outline],
+        "diagrams": [block["digest"][:16] for block in blocks],
+        "unpublished": sum(1 for block in blocks if not block["published"]),
+        "images": images,
+    }
+
+
+class Manifest:
     """
-    完整的发布流程：检查 → 生成图片 → 提交 → 推送 → 验证
-    返回退出码：0=成功，1=失败
+    文档清单，持久化在 MANIFEST_FILE
+
+    get() 先比较 (mtime_ns, size)，没变的文档直接返回缓存的条目；
+    变了再比较内容哈希，只有内容真的变了才重新解析。
     """
-    print("=" * 60)
-    print("📦 自动化知识发布流程")
-    print("=" * 60)
-    print()
 
-    # 步骤 1: 检查 Git 状态
-    if not check_git_status():
-        print("ℹ️  没有修改需要发布，退出")
-        return 0
+    def __init__(self, manifest_file: Path = MANIFEST_FILE):
+        self.manifest_file = manifest_file
+        self.dirty = False
+        self.reads = 0
+        try:
+            data = json.loads(manifest_file.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            data = {}
+        if data.get("version") != MANIFEST_VERSION:
+            data = {"docs": {}}
+        self.docs = data["docs"]
+
+    @staticmethod
+    def key(doc_path: Path) -> str:
+        return Path(os.path.relpath(doc_path)).as_posix()
+
+    def update(
+        self,
+        doc_path: Path,
+        content: str,
+        blocks: Optional[List[dict]] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> dict:
+        """用已经读到的内容刷新条目（plan_document 提取图表时顺带调用）"""
+        stat = stat or doc_path.stat()
+        key = self.key(doc_path)
+        entry = self.docs.get(key)
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if entry is None or entry["sha256"] != digest:
+            if blocks is None:
+                blocks = find_mermaid_blocks(content)
+            entry = document_entry(doc_path, content, blocks)
+        entry["mtime_ns"] = stat.st_mtime_ns
+        entry["size"] = stat.st_size
+        self.docs[key] = entry
+        self.dirty = True
+        return entry
+
+    def get(self, doc_path: Path) -> Optional[dict]:
+        """文档的最新条目，文件不存在或无法读取时返回 None"""
+        try:
+            stat = doc_path.stat()
+        except OSError:
+            if self.docs.pop(self.key(doc_path), None) is not None:
+                self.dirty = True
+            return None
+        entry = self.docs.get(self.key(doc_path))
+        if (
+            entry is not None
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            return entry
+        try:
+            content = doc_path.read_text(encoding="utf-8")
+        except Exception:
+            return None
+        self.reads += 1
+        return self.update(doc_path, content, stat=stat)
 
-    # 步骤 2: 检测 Mermaid
-    mermaid_docs = detect_mermaid_in_knowledge()
+    def has_mermaid(self, doc_path: Path) -> bool:
+        entry = self.get(doc_path)
+        return bool(entry and entry["diagrams"])
 
-    # 步骤 3: 生成图片（如果需要）
-    if mermaid_docs:
-        print("📋 步骤 3/5: 生成高质量流程图\n")
+    def refresh(self, doc_paths: List[Path]) -> dict:
+        """刷新一组文档并删除清单里已经不存在的文档，返回 {路径: 条目}"""
+        entries = {}
+        for doc_path in doc_paths:
+            entry = self.get(doc_path)
+            if entry is not None:
+                entries[self.key(doc_path)] = entry
+        for key in list(self.docs):
+            if key not in entries and not Path(key).exists():
+                del self.docs[key]
+                self.dirty = True
+        return entries
 
-        if not check_mmdc():
-            return 1
+    def save(self) -> None:
+        if self.dirty:
+            write_json_atomic(
+                self.manifest_file, {"version": MANIFEST_VERSION, "docs": self.docs}
+            )
+            self.dirty = False
 
-        success_count = 0
-        for doc_path in mermaid_docs:
-            if process_document(doc_path):
-                success_count += 1
 
-        if success_count == 0:
-            print("\n❌ 图片生成失败")
-            return 1
+# ==================== 目录生成 ====================
 
-        print(f"\n✅ 成功生成 {success_count}/{len(mermaid_docs)} 个文档的流程图\n")
-    else:
-        print("ℹ️  无需生成图片\n")
-        print("📋 步骤 3/5: 跳过图片生成\n")
+README_FILE = Path("README.md")
+COMMANDS_DIR = Path(".cursor/commands")
+COMMAND_INDEX_FILE = COMMANDS_DIR / "index.md"
 
-    # 步骤 4: 生成 commit message 并提交推送
-    commit_msg = generate_commit_message()
-    success, result = commit_and_push(commit_msg)
+# 生成区域的起止标记，标记之间的内容每次重新生成，之外的内容保持手写
+CATALOG_START = "<!-- catalog:{name} 自动生成，请勿手改（--catalog） -->"
+CATALOG_END = "<!-- /catalog:{name} -->"
+CATALOG_BLOCK_RE = r"<!-- catalog:{name}\b.*?-->.*?<!-- /catalog:{name} -->"
 
-    if not success:
-        print(f"❌ {result}")
-        return 1
+# 已有表格行：| [链接文字](路径) | 第二列 | ...
+TABLE_LINK_ROW_RE = re.compile(r"^\|\s*\[([^\]]+)\]\(([^)]+)\)\s*\|\s*([^|]*?)\s*\|")
 
-    local_hash = result
 
-    # 步骤 5: 验证推送
-    verify_push(local_hash)
+# 标题里主副标题之间的分隔符：全角冒号、半角冒号加空格、前后带空格的连字符
+TITLE_SEPARATOR_RE = re.compile(r"\s*(?:：|:\s| - )\s*")
 
-    # 最终总结
-    print("=" * 60)
-    print("🎉 发布成功！")
-    print("=" * 60)
-    print()
-    print("📊 本次提交信息：")
-    print(f"   Commit: {local_hash[:7]}")
-    print(f"   Message: {commit_msg}")
-    print()
-    print("🔗 GitHub 链接：")
-    print(f"   https://github.com/{GITHUB_REPO}/commit/{local_hash}")
-    print()
-    print("📁 查看 Knowledge Base：")
-    print(f"   https://github.com/{GITHUB_REPO}/tree/{GITHUB_BRANCH}/knowledge")
-    print()
+# 不能单独当标题用的主标题：年份、日期
+TITLE_DATE_RE = re.compile(r"^\d{4}(?:[-/.年]\d{1,2}(?:[-/.月]\d{1,2}日?)?)?年?$")
 
-    return 0
 
+def split_title(title: str) -> Tuple[str, str]:
+    """
+    '主标题：副标题' / '主标题 - 副标题' → (主标题, 副标题)
 
-def build_only(doc_files: List[Path]) -> int:
+    主标题撑不起整个标题时不拆，返回 (完整标题, "")：
+    主标题是年份或日期（'2025：干了些什么'），
+    或者冒号只是引出后半句的问题（'我花了一周时间才搞懂：……有什么区别？'）
     """
-    仅生成图片（不提交推送）
-    返回退出码：0=成功，1=失败
+    title = title.strip()
+    parts = TITLE_SEPARATOR_RE.split(title, maxsplit=1)
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return title, ""
+    main, sub = parts
+    if TITLE_DATE_RE.match(main) or sub.endswith(("？", "?")):
+        return title, ""
+    return main, sub
+
+
+def table_cell(text: str) -> str:
+    return text.replace("|", "\\|").strip() or "-"
+
+
+def markdown_link(path: str) -> str:
+    """仓库里现有链接的写法：中文保持原样，只转义空格"""
+    return path.replace(" ", "%20")
+
+
+def previous_rows(lines: List[str]) -> dict:
+    """从旧表格中取回手写的链接文字和第二列：{文档路径: (文字, 第二列)}"""
+    rows = {}
+    for line in lines:
+        m = TABLE_LINK_ROW_RE.match(line)
+        if m:
+            rows[unquote(m.group(2))] = (m.group(1), m.group(3))
+    return rows
+
+
+def knowledge_table(entries: dict, previous: dict) -> List[str]:
+    """README 的 Knowledge Base 表格：已有的行保持原顺序和手写列，新文档排在后面"""
+    order = [key for key in previous if key in entries]
+    order += sorted(key for key in entries if key not in previous)
+    lines = [
+        "| 知识文档 | 主题 | 流程图 | 状态 |",
+        "|---------|------|--------|------|",
+    ]
+    for key in order:
+        entry = entries[key]
+        main, sub = split_title(entry["title"])
+        text, topic = previous.get(key, (main, sub))
+        diagrams = f"{len(entry['diagrams'])} 张" if entry["diagrams"] else "-"
+        # ⏳ 表示还有没渲染成图片的 Mermaid
+        status = "⏳" if entry["unpublished"] else "✅"
+        lines.append(
+            f"| [{table_cell(text)}]({markdown_link(key)}) | {table_cell(topic)} "
+            f"| {diagrams} | {status} |"
+        )
+    return lines
+
+
+def command_index_tables(entries: dict, commands: dict) -> List[str]:
+    """命令索引里的两张表：全部命令、全部知识文档"""
+    lines = ["### 命令", "", "| 命令 | 说明 |", "|------|------|"]
+    for key, entry in sorted(commands.items()):
+        description = entry["description"] or split_title(entry["title"])[0]
+        lines.append(f"| `/{Path(key).stem}` | {table_cell(description)} |")
+    lines += [
+        "",
+        "### 知识文档",
+        "",
+        "| 文档 | 章节 | 流程图 |",
+        "|------|------|--------|",
+    ]
+    for key, entry in sorted(entries.items()):
+        sections = sum(1 for level, _ in entry["headings"] if level == 2)
+        diagrams = len(entry["diagrams"]) or "-"
+        link = markdown_link(os.path.relpath(key, COMMANDS_DIR))
+        title = split_title(entry["title"])[0]
+        lines.append(f"| [{table_cell(title)}]({link}) | {sections} | {diagrams} |")
+    return lines
+
+
+def replace_catalog(
+    content: str,
+    name: str,
+    lines: List[str],
+    heading: str,
+    insert_before: Optional[str] = None,
+) -> str:
     """
-    # 检查工具
-    if not check_mmdc():
-        return 1
+    替换 content 中名为 name 的生成区域；还没有标记时：
+    heading 下已有表格就把表格换成生成区域，否则在 insert_before 之前插入新的一节
+    """
+    block = "\n".join(
+        [CATALOG_START.format(name=name), *lines, CATALOG_END.format(name=name)]
+    )
+    pattern = re.compile(CATALOG_BLOCK_RE.format(name=re.escape(name)), re.S)
+    if pattern.search(content):
+        return pattern.sub(lambda _: block, content, count=1)
+
+    source = content.split("\n")
+    if heading in source:
+        start = source.index(heading) + 1
+        while start < len(source) and not source[start].strip():
+            start += 1
+        end = start
+        while end < len(source) and source[end].startswith("|"):
+            end += 1
+        if end > start:
+            return "\n".join(source[:start] + [block] + source[end:])
+    if insert_before and insert_before in source:
+        at = source.index(insert_before)
+        section = [heading, "", block, "", "---", ""]
+        return "\n".join(source[:at] + section + source[at:])
+    return content.rstrip("\n") + "\n\n" + heading + "\n\n" + block + "\n"
+
+
+def catalog_region(content: str, name: str, heading: str) -> List[str]:
+    """生成区域（或 heading 下的表格）现有的行，用于保留手写列"""
+    pattern = re.compile(CATALOG_BLOCK_RE.format(name=re.escape(name)), re.S)
+    m = pattern.search(content)
+    if m:
+        return m.group(0).split("\n")
+    source = content.split("\n")
+    if heading not in source:
+        return []
+    rows = []
+    for line in source[source.index(heading) + 1 :]:
+        if line.startswith("#"):
+            break
+        rows.append(line)
+    return rows
+
+
+@traced("catalog")
+def update_catalog(roots, manifest: "Manifest", check: bool = False) -> int:
+    """
+    从文档清单重新生成 README 的 Knowledge Base 表格和命令索引里的目录
+    没变化的文档不会被重新读取；check=True 时只检查是否过期（过期返回 1）
+    """
+    docs = [p for root in roots for p in iter_root_documents(root)]
+    entries = manifest.refresh(list(dict.fromkeys(docs)))
+    commands = {}
+    for path in sorted(COMMANDS_DIR.glob("*.md")):
+        if path == COMMAND_INDEX_FILE:
+            continue
+        entry = manifest.get(path)
+        if entry is not None:
+            commands[manifest.key(path)] = entry
+    manifest.save()
+    print(f"🗂️  文档清单: {len(entries)} 个文档，重新读取 {manifest.reads} 个\n")
+
+    readme_heading = "## 📚 Knowledge Base"
+    index_heading = "## 📋 全部命令与文档"
+    targets = [
+        (
+            README_FILE,
+            lambda content: replace_catalog(
+                content,
+                "knowledge",
+                knowledge_table(
+                    entries,
+                    previous_rows(catalog_region(content, "knowledge", readme_heading)),
+                ),
+                readme_heading,
+            ),
+        ),
+        (
+            COMMAND_INDEX_FILE,
+            lambda content: replace_catalog(
+                content,
+                "commands",
+                command_index_tables(entries, commands),
+                index_heading,
+                insert_before="## 🔄 典型工作流",
+            ),
+        ),
+    ]
+
+    stale = 0
+    for path, render in targets:
+        if not path.exists():
+            continue
+        content = path.read_text(encoding="utf-8")
+        new_content = render(content)
+        if new_content == content:
+            print(f"  ✅ {path} 已是最新")
+            continue
+        stale += 1
+        if check:
+            print(f"  ⚠️  {path} 已过期")
+        else:
+            write_text_atomic(path, new_content)
+            print(f"  📝 已更新 {path}")
 
-    if not doc_files:
-        print("❌ 没有找到要处理的文件\n")
+    if check and stale:
+        print("\n运行 --catalog 重新生成")
         return 1
+    print()
+    return 0
 
-    print(f"\n🚀 准备处理 {len(doc_files)} 个文档\n")
 
-    # 处理所有文档
-    success_count = 0
-    for doc_file in doc_files:
-        if process_document(doc_file):
-            success_count += 1
+def mmdc_option_args() -> List[str]:
+    """渲染参数对应的 mmdc 命令行参数"""
+    return [
+        "-w",
+        str(RENDER_OPTIONS["width"]),  # 宽度 2000px
+        "-s",
+        str(RENDER_OPTIONS["scale"]),  # 3倍缩放
+        "-b",
+        RENDER_OPTIONS["background"],  # 透明背景
+    ]
 
-    # 总结
-    print(f"\n{'='*60}")
-    print(f"🎉 完成！成功处理 {success_count}/{len(doc_files)} 个文档")
-    print(f"📁 图片根目录: {IMAGES_ROOT.absolute()}")
-    print(f"\n✅ 已更新原文档：")
-    print(f"  - Mermaid 代码块 → 图片链接 + 折叠源码")
-    print(f"  - 可直接复制到飞书，图片自动加载")
-    print(f"\n后续步骤：")
-    print(f"  1. git add knowledge/")
-    print(f"  2. git commit -m 'docs: 更新流程图'")
-    print(f"  3. git push")
-    print(f"{'='*60}\n")
 
-    return 0 if success_count == len(doc_files) else 1
+# 单个图表的默认渲染超时（秒）
+DEFAULT_TIMEOUT = 30
+
+# 批量渲染检查产出进度的间隔（秒）
+PROGRESS_POLL_INTERVAL = 0.5
+
+
+def run_command(cmd: List[str], timeout: float, progress=None) -> Tuple[int, str]:
+    """
+    运行外部命令，超时后杀掉整个进程组
+    mmdc 会再拉起 Chromium 子进程，只杀 mmdc 本身会留下孤儿浏览器
+
+    给了 progress 时，timeout 从 progress() 的返回值最后一次变化算起：
+    进程还在持续产出就不杀，停滞 timeout 秒才杀
+    """
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+    )
+    try:
+        if progress is None:
+            _, stderr = proc.communicate(timeout=timeout)
+            return proc.returncode, stderr
+
+        last = progress()
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = min(PROGRESS_POLL_INTERVAL, max(0, deadline - time.monotonic()))
+            try:
+                _, stderr = proc.communicate(timeout=wait)
+                return proc.returncode, stderr
+            except subprocess.TimeoutExpired:
+                current = progress()
+                if current != last:
+                    last = current
+                    deadline = time.monotonic() + timeout
+                elif time.monotonic() >= deadline:
+                    raise
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.communicate()
+        raise
+
+
+def install_output(src: Path, dest: Path) -> None:
+    """把渲染产物放到最终位置（同目录临时文件 + rename，不会留下半个文件）"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    partial = dest.with_name(f".{dest.name}.partial")
+    shutil.copyfile(src, partial)
+    os.replace(partial, dest)
+
+
+def render_one(
+    mermaid_code: str, output_path: Path, timeout: float = DEFAULT_TIMEOUT
+) -> Tuple[bool, str]:
+    """
+    调用一次 mmdc 渲染单个图表，不打印日志（方便并发时按序输出）
+    返回 (是否成功, 结果描述)
+    """
+    with tempfile.TemporaryDirectory(prefix="mmdc-") as tmp:
+        temp_mmd = Path(tmp) / "diagram.mmd"
+        temp_mmd.write_text(mermaid_code, encoding="utf-8")
+        # 先渲染到临时目录，成功后再放到最终位置
+        temp_out = Path(tmp) / f"diagram{output_path.suffix}"
+
+        cmd = ["mmdc", "-i", str(temp_mmd), "-o", str(temp_out)]
+        cmd += mmdc_option_args()
+
+        try:
+            with span("render.diagram", output=output_path):
+                returncode, stderr = run_command(cmd, timeout)
+        except subprocess.TimeoutExpired:
+            return False, f"超时（{timeout:g}s）"
+        except Exception as e:
+            return False, f"错误: {e}"
+
+        if returncode == 0 and temp_out.exists():
+            install_output(temp_out, output_path)
+            return True, f"成功 ({output_path.stat().st_size:,} bytes)"
+        return False, f"失败: {stderr.strip()}"
+
+
+def generate_diagram(mermaid_code: str, output_path: Path) -> bool:
+    """使用 mmdc 生成高质量图片"""
+    ok, message = render_one(mermaid_code, output_path)
+    print(f"    {'✅' if ok else '❌'} {message}")
+    return ok
+
+
+# ==================== 渲染后端 ====================
+
+
+class MmdcRenderer:
+    """
+    渲染后端基类：render() 接收一组任务并返回逐个的成功标记
+    check() / version() 用于启动前检查工具和计算渲染缓存的 key
+    """
+
+    name = ""
+
+    def __init__(self, jobs: int = 1, timeout: float = DEFAULT_TIMEOUT):
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+
+    def check(self) -> bool:
+        return check_mmdc()
+
+    def version(self) -> str:
+        return f"mmdc {get_mmdc_version()}"
+
+    def render(self, tasks: List[dict]) -> List[bool]:
+        raise NotImplementedError
+
+
+class SpawnRenderer(MmdcRenderer):
+    """
+    每个图表启动一次 mmdc（Node + Chromium 冷启动），最稳妥的回退方案
+    jobs > 1 时用线程池并发启动多个 mmdc，日志仍按提交顺序输出
+    """
+
+    name = "spawn"
+
+    def render(self, tasks: List[dict]) -> List[bool]:
+        """
+        渲染一组任务，task 形如 {"code": ..., "output": Path, "label": ...}
+        返回与 tasks 一一对应的成功标记
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [
+                pool.submit(
+                    render_one,
+                    task["code"],
+                    task["output"],
+                    task.get("timeout", self.timeout),
+                )
+                for task in tasks
+            ]
+            # 按提交顺序等待结果，保证日志顺序确定
+            for n, (task, future) in enumerate(zip(tasks, futures), 1):
+                try:
+                    ok, message = future.result()
+                except Exception as e:
+                    ok, message = False, f"错误: {e}"
+                print(f"  [{n}/{len(tasks)}] {task['label']}")
+                print(f"    {'✅' if ok else '❌'} {message}")
+                results.append(ok)
+        return results
+
+
+class BatchRenderer(MmdcRenderer):
+    """
+    整批图表只启动一次 mmdc
+
+    把所有待渲染图表写进一个临时 Markdown，利用 mmdc 的 Markdown 模式
+    在同一个无头浏览器里依次渲染（输出 out-1.png、out-2.png ...）。
+    jobs > 1 时把任务切成 jobs 份，并发运行 jobs 个 mmdc。
+    超过一个单图超时没有新图片产出时杀掉批量进程；
+    批量进程失败、超时或漏掉的图表，自动回退到 SpawnRenderer 单独渲染。
+    """
+
+    name = "batch"
+
+    def __init__(self, jobs: int = 1, timeout: float = DEFAULT_TIMEOUT):
+        super().__init__(jobs, timeout)
+        self.fallback = SpawnRenderer(jobs, timeout)
+
+    def render_chunk(self, tasks: List[dict]) -> Tuple[List[bool], str]:
+        """用一个 mmdc 进程渲染一组任务，返回 (成功标记, 错误信息)"""
+        results = [False] * len(tasks)
+        fmt = tasks[0]["output"].suffix.lstrip(".")
+        with tempfile.TemporaryDirectory(prefix="mmdc-batch-") as tmp:
+            batch_md = Path(tmp) / "batch.md"
+            batch_md.write_text(
+                "".join(f"```mermaid\n{t['code']}\n```\n\n" for t in tasks),
+                encoding="utf-8",
+            )
+            cmd = [
+                "mmdc",
+                "-i",
+                str(batch_md),
+                "-o",
+                str(Path(tmp) / "out.md"),
+                "-e",
+                fmt,
+            ] + mmdc_option_args()
+            # 不按图表数累加超时：只要 out-N 还在增加就继续等，
+            # 连续一个单图超时没有新产出就杀掉，剩下的图表回退单独渲染
+            timeout = max(t.get("timeout", self.timeout) for t in tasks)
+
+            def progress():
+                return sorted(
+                    (p.name, p.stat().st_size) for p in Path(tmp).glob(f"out-*.{fmt}")
+                )
+
+            error = ""
+            try:
+                with span("render.batch", diagrams=len(tasks)):
+                    _, error = run_command(cmd, timeout, progress)
+            except subprocess.TimeoutExpired:
+                error = f"批量渲染停滞超时（{timeout:g}s 没有新的图片产出）"
+            except Exception as e:
+                error = f"错误: {e}"
+
+            # 无论进程是否成功，都收集已经产出的图片
+            for n, task in enumerate(tasks, 1):
+                produced = Path(tmp) / f"out-{n}.{fmt}"
+                if produced.exists() and produced.stat().st_size > 0:
+                    install_output(produced, task["output"])
+                    results[n - 1] = True
+
+        return results, error.strip()
+
+    def render(self, tasks: List[dict]) -> List[bool]:
+        if not tasks:
+            return []
+
+        # 连续切分，每份交给一个 mmdc 进程
+        size = -(-len(tasks) // self.jobs)
+        chunks = [tasks[i : i + size] for i in range(0, len(tasks), size)]
+
+        results: List[bool] = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            for chunk_results, error in pool.map(self.render_chunk, chunks):
+                results.extend(chunk_results)
+                if error:
+                    errors.append(error)
+
+        for n, (task, ok) in enumerate(zip(tasks, results), 1):
+            if ok:
+                size = task["output"].stat().st_size
+                print(f"  [{n}/{len(tasks)}] {task['label']}")
+                print(f"    ✅ 成功 ({size:,} bytes)")
+
+        missing = [i for i, ok in enumerate(results) if not ok]
+        if missing:
+            print(f"\n⚠️  批量渲染有 {len(missing)} 个图表未产出，回退单独渲染")
+            for error in errors:
+                print(f"    {error.splitlines()[-1]}")
+            retried = self.fallback.render([tasks[i] for i in missing])
+            for i, ok in zip(missing, retried):
+                results[i] = ok
+
+        return results
+
+
+RENDERERS = {"batch": BatchRenderer, "spawn": SpawnRenderer}
+
+
+# ==================== 图片后处理 ====================
+
+# 归一化时丢弃的 PNG 辅助块：文本、时间戳、EXIF 都会让同一张图每次字节不同
+VOLATILE_PNG_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"tIME", b"eXIf"}
+
+# 归一化时 IDAT 的固定压缩级别
+PNG_COMPRESS_LEVEL = 9
+
+
+def iter_png_chunks(data: bytes):
+    """依次产出 (类型, 数据)，不校验 CRC"""
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos : pos + 8])
+        yield chunk_type, data[pos + 8 : pos + 8 + length]
+        pos += 12 + length
+        if chunk_type == b"IEND":
+            break
+
+
+def make_png_chunk(chunk_type: bytes, payload: bytes) -> bytes:
+    crc = zlib.crc32(chunk_type + payload) & 0xFFFFFFFF
+    return (
+        struct.pack(">I", len(payload)) + chunk_type + payload + struct.pack(">I", crc)
+    )
+
+
+def normalize_png(data: bytes) -> bytes:
+    """
+    把 PNG 归一化为字节稳定的形式
+      - 去掉文本 / 时间戳 / EXIF 块
+      - 所有 IDAT 合并后用固定参数重新压缩成一个块
+    像素不变；同样的像素总是得到同样的字节
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+
+    chunks = []
+    idat = []
+    for chunk_type, payload in iter_png_chunks(data):
+        if chunk_type in VOLATILE_PNG_CHUNKS:
+            continue
+        if chunk_type == b"IDAT":
+            # 第一个 IDAT 的位置放合并后的数据
+            if not idat:
+                chunks.append((b"IDAT", None))
+            idat.append(payload)
+            continue
+        chunks.append((chunk_type, payload))
+
+    raw = zlib.decompress(b"".join(idat))
+    compressed = zlib.compress(raw, PNG_COMPRESS_LEVEL)
+    return PNG_SIGNATURE + b"".join(
+        make_png_chunk(t, compressed if payload is None else payload)
+        for t, payload in chunks
+    )
+
+
+def png_pixel_signature(data: bytes) -> Optional[bytes]:
+    """不依赖 Pillow 的像素比较依据：头信息、调色板、透明度 + 解压后的扫描线"""
+    try:
+        parts = []
+        idat = []
+        for chunk_type, payload in iter_png_chunks(data):
+            if chunk_type in (b"IHDR", b"PLTE", b"tRNS"):
+                parts.append(chunk_type + payload)
+            elif chunk_type == b"IDAT":
+                idat.append(payload)
+        return b"".join(parts) + zlib.decompress(b"".join(idat))
+    except (zlib.error, struct.error):
+        return None
+
+
+def same_pixels(new_data: bytes, old_data: bytes) -> bool:
+    """逐像素比较两张图（有 Pillow 时解码比较，否则比较 PNG 扫描线）"""
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(new_data)) as a, Image.open(
+                io.BytesIO(old_data)
+            ) as b:
+                if a.size != b.size:
+                    return False
+                return a.convert("RGBA").tobytes() == b.convert("RGBA").tobytes()
+        except Exception:
+            return False
+    if new_data.startswith(PNG_SIGNATURE) and old_data.startswith(PNG_SIGNATURE):
+        new_sig = png_pixel_signature(new_data)
+        return new_sig is not None and new_sig == png_pixel_signature(old_data)
+    return False
+
+
+def commit_image(data: bytes, dest: Path) -> bool:
+    """
+    写入最终图片；已有文件字节相同，或像素相同且新文件并不更小时，保持旧文件不动
+    返回是否真正写入了新内容
+    """
+    if dest.exists():
+        old_data = dest.read_bytes()
+        if old_data == data:
+            return False
+        if len(data) >= len(old_data) and same_pixels(data, old_data):
+            return False
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    partial = dest.with_name(f".{dest.name}.partial")
+    partial.write_bytes(data)
+    os.replace(partial, dest)
+    record_touched(dest)
+    return True
+
+
+def render_target(output_path: Path) -> Path:
+    """
+    渲染后端实际写入的暂存路径（同目录隐藏文件）
+    后处理完成后才会和最终文件比较并落盘；webp 先渲染成 PNG 再转换
+    """
+    suffix = ".png" if output_path.suffix == ".webp" else output_path.suffix
+    return output_path.with_name(f".{output_path.stem}.render{suffix}")
+
+
+def encode_image(img, fmt: str) -> bytes:
+    """用固定参数编码图片（不写入任何元数据）"""
+    buf = io.BytesIO()
+    if fmt == "webp":
+        img.save(buf, "WEBP", lossless=True, method=6)
+    else:
+        img.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def optimize_image(data: bytes, fmt: str) -> bytes:
+    """
+    优化阶段（需要 Pillow）
+      - png : 无损重压缩 + 256 色调色板量化，取最小的结果
+      - webp: 由渲染出的 PNG 转为无损 WebP
+    不保留任何元数据块；PNG 结果不比原图小时返回原图
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        candidates = [encode_image(img, fmt)]
+        if RENDER_OPTIONS["optimize"]:
+            # 流程图颜色很少，调色板量化基本看不出差别
+            palette = img.convert("RGBA").quantize(
+                colors=256,
+                method=Image.Quantize.FASTOCTREE,
+                dither=Image.Dither.NONE,
+            )
+            candidates.append(encode_image(palette, fmt))
+
+    best = min(candidates, key=len)
+    if fmt == "png" and len(best) >= len(data):
+        return data
+    return best
+
+
+@traced("postprocess")
+def finalize_image(staged: Path, dest: Path) -> Tuple[int, int, bool]:
+    """
+    暂存图片 → （优化 / 转换）→ 归一化 → 与已有文件比较后落盘
+    返回 (渲染原始字节数, 最终字节数, 是否写入了新内容)
+    """
+    data = staged.read_bytes()
+    before = len(data)
+    fmt = dest.suffix.lstrip(".")
+
+    if fmt == "webp" or (fmt == "png" and RENDER_OPTIONS["optimize"]):
+        data = optimize_image(data, fmt)
+    if fmt == "png":
+        data = normalize_png(data)
+
+    changed = commit_image(data, dest)
+    staged.unlink(missing_ok=True)
+    return before, len(data), changed
+
+
+def finalize_outputs(blocks: List[dict]) -> None:
+    """对本次渲染成功的图片做后处理，输出优化效果与未变化的数量"""
+    optimizing = RENDER_OPTIONS["format"] == "webp" or RENDER_OPTIONS["optimize"]
+    if optimizing:
+        print(f"\n🗜️  图片优化（格式: {RENDER_OPTIONS['format']}）\n")
+
+    total_before = total_after = unchanged = 0
+    for block in blocks:
+        if not block["ok"]:
+            continue
+        try:
+            before, after, changed = finalize_image(
+                render_target(block["abs_path"]), block["abs_path"]
+            )
+        except Exception as e:
+            print(f"  ❌ {block['rel_path']}: {e}")
+            block["ok"] = False
+            continue
+        total_before += before
+        total_after += after
+        unchanged += not changed
+        if optimizing:
+            change = (after - before) * 100 / max(before, 1)
+            print(
+                f"  {block['rel_path']}: {before:,} → {after:,} bytes ({change:+.0f}%)"
+            )
+
+    if optimizing and total_before:
+        ratio = total_before / max(total_after, 1)
+        print(f"\n  合计: {total_before:,} → {total_after:,} bytes（{ratio:.1f}x）")
+    if unchanged:
+        print(f"\n🔁 {unchanged} 张图片与已有文件一致，保持不变")
+
+
+def image_url(img_rel_path: str, images_root: Path = IMAGES_ROOT) -> str:
+    """
+    图片的 GitHub Raw URL（img_rel_path 相对图片目录 images_root）
+    启用资源分支时指向资源分支，路径不变
+    """
+    branch = ASSETS_BRANCH or GITHUB_BRANCH
+    return f"https://raw.githubusercontent.com/{GITHUB_REPO}/{branch}/{images_root.as_posix()}/{img_rel_path}"
+
+
+def render_published_block(block: dict, url: str, newline: str = "\n") -> str:
+    """已发布图表的标准格式：图片 + 折叠的源码"""
+    lines = [
+        f"![流程图 {block['index']}]({url})",
+        "",
+        "<details>",
+        "<summary>📝 查看/编辑 Mermaid 源码</summary>",
+        "",
+        "```mermaid",
+        *block["code"].split("\n"),
+        "```",
+        "",
+        "</details>",
+    ]
+    indent = block.get("indent", "")
+    return newline.join(indent + l if l else l for l in lines)
+
+
+def replace_mermaid_with_images(
+    blocks: List[dict], original_content: str, doc_name: str
+) -> str:
+    """
+    将 Mermaid 代码块替换为图片链接 + 折叠的源码
+    直接修改原文档，不生成副本
+
+    按扫描得到的偏移一次拼接出新文档；已发布的图表（包括被重复包裹的）
+    会被规范成单层外壳，因此重复运行结果不变。渲染失败的图表保持原样。
+    """
+    newline = "\r\n" if "\r\n" in original_content else "\n"
+    segments = []
+    pos = 0
+
+    for block in blocks:
+        if not block.get("ok", True):
+            continue
+        images_root = block.get("images_root", IMAGES_ROOT)
+        img_rel_path, _ = get_image_path(doc_name, block, images_root)
+
+        segments.append(original_content[pos : block["start"]])
+        url = image_url(img_rel_path, images_root)
+        segments.append(render_published_block(block, url, newline))
+        pos = block["end"]
+
+    segments.append(original_content[pos:])
+    return "".join(segments)
+
+
+# ==================== Git 操作函数 ====================
+
+# 本次运行中流水线写入的文件（图片、改写后的文档），发布时与 roots 下的修改一起暂存
+_touched_paths = set()
+
+
+def record_touched(path: Path) -> None:
+    """记录流水线写入的文件（相对仓库根目录）"""
+    _touched_paths.add(Path(os.path.relpath(path)))
+
+
+def run_git_command(
+    cmd: List[str],
+    check: bool = True,
+    input: Optional[str] = None,
+    env: Optional[dict] = None,
+) -> Tuple[bool, str, str]:
+    """运行 Git 命令并返回结果"""
+    try:
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=30,
+            check=check,
+            input=input,
+            env=env,
+        )
+        return result.returncode == 0, result.stdout, result.stderr
+    except subprocess.TimeoutExpired:
+        return False, "", "命令超时"
+    except subprocess.CalledProcessError as e:
+        return False, e.stdout or "", e.stderr or ""
+    except Exception as e:
+        return False, "", str(e)
+
+
+def parse_porcelain_status(output: str) -> dict:
+    """
+    解析 `git status --porcelain=v2 -z --branch` 的输出
+    返回 {"head", "upstream", "ahead", "behind", "entries": [{"xy", "path", "orig"}]}
+    xy 是两位状态码（暂存区、工作区），未跟踪文件为 "??"；-z 下路径不会被转义加引号
+    """
+    status = {"head": None, "upstream": None, "ahead": 0, "behind": 0, "entries": []}
+    records = output.split("\0")
+    i = 0
+    while i < len(records):
+        record = records[i]
+        i += 1
+        if not record:
+            continue
+        kind = record[0]
+        orig = None
+        if kind == "#":
+            key, _, value = record[2:].partition(" ")
+            if key == "branch.head":
+                status["head"] = value
+            elif key == "branch.upstream":
+                status["upstream"] = value
+            elif key == "branch.ab":
+                ahead, behind = value.split()
+                status["ahead"], status["behind"] = int(ahead), -int(behind)
+            continue
+        if kind == "1":
+            fields = record.split(" ", 8)
+        elif kind == "2":
+            # 重命名 / 复制：原路径是下一个 NUL 分隔的记录
+            fields = record.split(" ", 9)
+            orig = records[i]
+            i += 1
+        elif kind == "u":
+            fields = record.split(" ", 10)
+        elif kind in "?!":
+            fields = [kind, kind * 2, record[2:]]
+        else:
+            continue
+        status["entries"].append({"xy": fields[1], "path": fields[-1], "orig": orig})
+    return status
+
+
+@traced("git.status")
+def check_git_status() -> Optional[dict]:
+    """
+    一次 `git status --porcelain=v2` 拿到全部状态：修改列表、当前分支和上游
+    返回解析后的状态（见 parse_porcelain_status），Git 调用失败返回 None
+    """
+    print("📋 步骤 1/5: 检查 Git 状态\n")
+
+    success, stdout, stderr = run_git_command(
+        ["git", "status", "--porcelain=v2", "-z", "--branch", "--untracked-files=all"]
+    )
+    if not success:
+        print(f"❌ 无法获取 Git 状态: {stderr.strip()}\n")
+        return None
+
+    status = parse_porcelain_status(stdout)
+    status["entries"] = [e for e in status["entries"] if e["xy"] != "!!"]
+    if status["entries"]:
+        print("✅ 检测到文件修改\n")
+        for entry in status["entries"]:
+            print(f"{entry['xy'].replace('.', ' ')} {entry['path']}")
+        print()
+    else:
+        print("ℹ️  没有检测到修改\n")
+    return status
+
+
+def status_paths(status: dict) -> List[Path]:
+    """状态中仍存在于工作区的文件（相当于对比 HEAD 的变更集合）"""
+    return [Path(e["path"]) for e in status["entries"] if Path(e["path"]).exists()]
+
+
+@traced("git.diff")
+def git_changed_files(base_ref: Optional[str] = None) -> Optional[List[Path]]:
+    """
+    从 Git 推导变更文件集合（仍存在于工作区的文件）
+    base_ref 为空时对比 HEAD（工作区 + 暂存区），否则对比指定的基准 ref
+    未跟踪的新文件同样算作变更；Git 调用失败返回 None
+    """
+    # -z 输出原始路径，中文文件名不会被转义加引号
+    success, diff_out, _ = run_git_command(
+        ["git", "diff", "--name-only", "-z", base_ref or "HEAD", "--"]
+    )
+    if not success:
+        return None
+
+    success, untracked_out, _ = run_git_command(
+        ["git", "ls-files", "--others", "--exclude-standard", "-z"]
+    )
+    if not success:
+        return None
+
+    names = [n for n in (diff_out + untracked_out).split("\0") if n]
+    return [Path(n) for n in dict.fromkeys(names) if Path(n).exists()]
+
+
+@traced("detect")
+def detect_mermaid_in_knowledge(
+    candidates: Optional[List[Path]] = None,
+    roots=None,
+    index: Optional["Manifest"] = None,
+) -> List[Path]:
+    """
+    检测各文档根目录（默认 KNOWLEDGE_ROOTS）中包含 Mermaid 的文档
+    传入 candidates 时只检查其中属于某个根目录的文件（增量模式）
+    传入 index（文档清单）时复用其中的检测结果，只重读有变化的文档
+    """
+    print("📋 步骤 2/5: 检测 Mermaid 代码块\n")
+
+    roots = roots or KNOWLEDGE_ROOTS
+    if candidates is None:
+        doc_paths = [p for root in roots for p in iter_root_documents(root)]
+    else:
+        doc_paths = [p for p in candidates if any(root_matches(r, p) for r in roots)]
+        print(f"🔍 增量模式：{len(doc_paths)} 个文档有变更")
+    doc_paths = list(dict.fromkeys(doc_paths))  # 嵌套的根目录可能重复列出
+
+    if index is None:
+        index = Manifest()
+
+    mermaid_docs = []
+    for doc_path in doc_paths:
+        if index.has_mermaid(doc_path):
+            print(f"✅ 发现 Mermaid: {doc_path}")
+            mermaid_docs.append(doc_path)
+    index.save()
+
+    print()
+    return mermaid_docs
+
+
+def is_under(path: Path, roots) -> bool:
+    return any(path == root or root in path.parents for root in roots)
+
+
+def publish_changes(status: dict, roots) -> dict:
+    """
+    本次发布要提交的文件 → 两位状态码
+    包括各根目录（及其图片目录）下的修改（含删除、未跟踪的新文档）和流水线写入的文件，
+    根目录以外的修改（工具代码、草稿等）不会被带进发布提交
+    """
+    scope = [r["path"] for r in roots] + [r["images"] for r in roots]
+    changes = {}
+    for entry in status["entries"]:
+        path = Path(entry["path"])
+        if is_under(path, scope):
+            changes[path] = entry["xy"]
+    for path in sorted(_touched_paths):
+        changes.setdefault(path, ".M")
+    return changes
+
+
+def push_target(status: dict) -> Tuple[str, str]:
+    """推送目标：当前分支的上游（origin/main → origin, main），没有上游时推到 origin/GITHUB_BRANCH"""
+    upstream = status.get("upstream")
+    if upstream and "/" in upstream:
+        remote, branch = upstream.split("/", 1)
+        return remote, branch
+    return "origin", GITHUB_BRANCH
+
+
+@traced("git.message")
+def generate_commit_message(changes: dict, images_roots=(IMAGES_ROOT,)) -> str:
+    """根据本次要提交的文件（见 publish_changes）生成智能 commit message"""
+    docs = {p: xy for p, xy in changes.items() if p.suffix == ".md"}
+
+    # 分析修改类型
+    doc_added = [p for p, xy in docs.items() if xy == "??" or "A" in xy]
+    doc_modified = sum(1 for xy in docs.values() if "M" in xy)
+    img_modified = sum(1 for p in changes if is_under(p, images_roots))
+
+    # 生成消息
+    if doc_added:
+        return f"docs: 添加知识 {doc_added[0].stem}"
+
+    if doc_modified > 0 and img_modified > 0:
+        return "docs: 更新知识及流程图"
+    elif doc_modified > 0:
+        return "docs: 更新知识内容"
+    elif img_modified > 0:
+        return "docs: 更新流程图"
+
+    return "docs: 更新知识库"
+
+
+@traced("git.commit_push")
+def push_commit(remote: str, branch: str, rev: str = "HEAD") -> Tuple[bool, str]:
+    """
+    把 rev 推送到 remote 的 branch（--porcelain 逐个 ref 报告结果，用于验证）
+    返回 (是否成功, git push --porcelain 的输出或错误信息)
+    """
+    print(f"正在推送到 {remote}/{branch}...")
+    with span("git.push"):
+        success, stdout, stderr = run_git_command(
+            ["git", "push", "--porcelain", remote, f"{rev}:refs/heads/{branch}"],
+            check=False,
+        )
+    if not success and "\t" not in stdout:
+        return False, f"推送失败: {stderr.strip()}"
+
+    print("✅ 推送命令执行完成\n")
+    return True, stdout
+
+
+def commit_and_push(
+    commit_msg: str,
+    changes: dict,
+    remote: str,
+    branch: str,
+    journal: Optional["Journal"] = None,
+) -> Tuple[bool, str, str]:
+    """
+    只暂存并提交 changes 中的文件（不带上用户已暂存的其他改动），推送到 remote 的 branch
+    提交后先记入 journal，推送失败时下次运行可以只重试推送
+    返回 (是否成功, 本地 commit hash 或错误信息, git push --porcelain 的输出)
+    """
+    print("📋 步骤 4/5: 提交并推送\n")
+
+    # 暂存本次发布涉及的文件（已暂存的删除不需要再 add）
+    paths = [p for p, xy in changes.items() if p.exists() or xy[1] == "D"]
+    print(f"📝 暂存 {len(paths)} 个文件...")
+    if paths:
+        with span("git.add", files=len(paths)):
+            success, _, stderr = run_git_command(
+                ["git", "add", "-A", "--pathspec-from-file=-", "--pathspec-file-nul"],
+                input="\0".join(p.as_posix() for p in paths),
+            )
+        if not success:
+            return False, f"暂存失败: {stderr}", ""
+
+    if not paths:
+        return False, "没有需要提交的文件", ""
+
+    # 提交：--only 只提交这些路径，用户自己暂存的其他改动留在暂存区
+    print(f"📝 Commit Message: {commit_msg}")
+    with span("git.commit"):
+        success, _, stderr = run_git_command(
+            [
+                "git",
+                "commit",
+                "--only",
+                "-q",
+                "-m",
+                commit_msg,
+                "--pathspec-from-file=-",
+                "--pathspec-file-nul",
+            ],
+            input="\0".join(p.as_posix() for p in paths),
+        )
+    if not success:
+        return False, f"提交失败: {stderr}", ""
+
+    print("✅ 提交成功\n")
+
+    # 获取本地 commit hash
+    success, local_hash, _ = run_git_command(["git", "rev-parse", "HEAD"])
+    if not success:
+        return False, "无法获取 commit hash", ""
+
+    local_hash = local_hash.strip()
+    print(f"本地 Commit: {local_hash[:7]}")
+    if journal is not None:
+        journal.committed(local_hash, remote, branch)
+
+    success, push_output = push_commit(remote, branch)
+    if not success:
+        return False, push_output, ""
+
+    return True, local_hash, push_output
+
+
+@traced("git.verify")
+def verify_push(push_output: str, local_hash: str, branch: str) -> bool:
+    """
+    根据 `git push --porcelain` 的输出验证推送（不再 sleep + fetch）
+    每个 ref 一行：<标记>\\t<本地>:<远程>\\t<摘要>
+    """
+    target = f"refs/heads/{branch}"
+    for line in push_output.splitlines():
+        fields = line.split("\t")
+        if len(fields) != 3 or fields[1].rpartition(":")[2] != target:
+            continue
+        flag, _, summary = fields
+        if flag == "!":
+            print(f"❌ 推送被拒绝: {summary}\n")
+            return False
+        if flag in "*=":
+            # 新建分支 / 远程已经是这个 commit
+            pushed = local_hash
+        else:
+            # " " 快进（old..new），"+" 强制更新（old...new）
+            pushed = summary.split(" ")[0].rpartition(".")[2]
+        if pushed and local_hash.startswith(pushed):
+            print(f"✅ 验证成功！远程 {branch} 已更新到 {local_hash[:7]}\n")
+            return True
+        print(f"⚠️  推送可能未完全同步")
+        print(f"   本地: {local_hash[:7]}")
+        print(f"   远程: {pushed or summary}\n")
+        return False
+
+    print(f"⚠️  推送输出中没有 {target}，无法验证推送状态\n")
+    return False
+
+
+# ==================== 发布日志（断点续传） ====================
+
+JOURNAL_FILE = CACHE_DIR / "journal.json"
+JOURNAL_VERSION = 1
+
+# 有发布日志时分批渲染，每批结束把渲染缓存和日志落盘，中断最多损失一批
+CHECKPOINT_DIAGRAMS = 32
+
+
+class Journal:
+    """
+    一次 --publish 的工作日志，持久化在 JOURNAL_FILE（每次更新都原子写入）
+
+      docs     计划处理的文档 → "planned" / "rewritten"
+      renders  已渲染完成的图表（源码摘要前 16 位）
+      commit   已在本地提交、尚未确认推送成功的 commit（连同 remote / branch）
+
+    发布被中断（超时、Ctrl-C、推送失败）后重新运行 --publish：
+    已渲染的图表直接命中渲染缓存，已回写的文档内容不变不会再写，
+    已提交未推送的只重试推送。发布成功后删除日志。
+    """
+
+    def __init__(self, journal_file: Path = JOURNAL_FILE):
+        self.journal_file = journal_file
+        try:
+            data = json.loads(journal_file.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            data = {}
+        self.data = data if data.get("version") == JOURNAL_VERSION else {}
+
+    @property
+    def active(self) -> bool:
+        return bool(self.data)
+
+    def docs(self) -> List[Path]:
+        return [Path(key) for key in self.data.get("docs", {})]
+
+    def summary(self) -> str:
+        docs = self.data.get("docs", {})
+        rewritten = sum(1 for state in docs.values() if state == "rewritten")
+        return (
+            f"已渲染 {len(self.data.get('renders', []))} 张图表，"
+            f"已回写 {rewritten}/{len(docs)} 个文档"
+        )
+
+    def begin(self, doc_paths: List[Path]) -> None:
+        """记录计划处理的文档；已有日志时在其基础上继续"""
+        if not self.data:
+            self.data = {
+                "version": JOURNAL_VERSION,
+                "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "docs": {},
+                "renders": [],
+                "commit": None,
+                "remote": None,
+                "branch": None,
+            }
+        for doc_path in doc_paths:
+            self.data["docs"].setdefault(Manifest.key(doc_path), "planned")
+        self.save()
+
+    def rendered(self, blocks: List[dict]) -> None:
+        digests = [block["digest"][:16] for block in blocks if block["ok"]]
+        if digests:
+            known = set(self.data["renders"])
+            self.data["renders"] += [d for d in digests if d not in known]
+            self.save()
+
+    def rewritten(self, doc_path: Path) -> None:
+        self.data["docs"][Manifest.key(doc_path)] = "rewritten"
+        self.save()
+
+    def committed(self, commit: str, remote: str, branch: str) -> None:
+        if not self.data:
+            self.begin([])
+        self.data.update(commit=commit, remote=remote, branch=branch)
+        self.save()
+
+    def pending_push(self) -> Optional[dict]:
+        """已提交但没有确认推送成功的 commit：{"commit", "remote", "branch"}"""
+        if self.data.get("commit"):
+            return {key: self.data[key] for key in ("commit", "remote", "branch")}
+        return None
+
+    def clear(self) -> None:
+        self.data = {}
+        self.journal_file.unlink(missing_ok=True)
+
+    def save(self) -> None:
+        write_json_atomic(self.journal_file, self.data)
+
+
+def retry_push(journal: Journal) -> Optional[bool]:
+    """
+    重试上次没有推送成功的 commit（不重新渲染、不重新提交）
+    返回 None=没有待推送的 commit，True/False=推送并验证是否成功
+    """
+    pending = journal.pending_push()
+    if pending is None:
+        return None
+
+    commit = pending["commit"]
+    # commit 已经不在当前分支上（被 reset / rebase 掉了），日志作废
+    in_history, _, _ = run_git_command(
+        ["git", "merge-base", "--is-ancestor", commit, "HEAD"], check=False
+    )
+    if not in_history:
+        print(f"ℹ️  上次发布的提交 {commit[:7]} 已不在当前分支，丢弃发布日志\n")
+        journal.clear()
+        return None
+
+    print(f"♻️  上次发布已提交 {commit[:7]} 但未推送成功，直接重试推送\n")
+    success, push_output = push_commit(pending["remote"], pending["branch"], commit)
+    if not success:
+        print(f"❌ {push_output}")
+        return False
+    if not verify_push(push_output, commit, pending["branch"]):
+        return False
+    journal.clear()
+    return True
+
+
+# ==================== 资源分支 ====================
+
+# 资源分支提交信息的前缀
+ASSETS_COMMIT_PREFIX = "assets:"
+
+
+def default_remote() -> str:
+    """当前分支上游所在的远程，没有上游时为 origin"""
+    success, stdout, _ = run_git_command(
+        ["git", "rev-parse", "--abbrev-ref", "--symbolic-full-name", "@{u}"],
+        check=False,
+    )
+    return stdout.strip().split("/", 1)[0] if success and "/" in stdout else "origin"
+
+
+def iter_image_files(images_roots) -> List[Path]:
+    """各图片目录下的图片（跳过渲染暂存的隐藏文件）"""
+    return sorted(
+        path
+        for images_root in images_roots
+        if images_root.is_dir()
+        for path in images_root.rglob("*")
+        if path.suffix in IMAGE_SUFFIXES
+        and not any(part.startswith(".") for part in path.parts)
+    )
+
+
+def ls_tree(rev: str) -> dict:
+    """rev 的完整文件树：{路径: (mode, blob id, 大小)}"""
+    success, stdout, _ = run_git_command(
+        ["git", "ls-tree", "-r", "-l", "-z", rev], check=False
+    )
+    entries = {}
+    if success:
+        for record in stdout.split("\0"):
+            meta, _, path = record.partition("\t")
+            if path:
+                mode, _, blob, size = meta.split()
+                entries[path] = (mode, blob, int(size) if size.isdigit() else 0)
+    return entries
+
+
+def write_tree(entries: dict) -> Optional[str]:
+    """
+    用临时索引把 {路径: (mode, blob id, ...)} 写成树对象，返回树的 id
+    mktree 只能写单层目录，嵌套目录交给 update-index --index-info + write-tree
+    """
+    with tempfile.TemporaryDirectory(prefix="assets-index-") as tmp:
+        env = dict(os.environ, GIT_INDEX_FILE=str(Path(tmp) / "index"))
+        lines = "".join(
+            f"{mode} {blob}\t{path}\0"
+            for path, (mode, blob, *_) in sorted(entries.items())
+        )
+        success, _, stderr = run_git_command(
+            ["git", "update-index", "-z", "--index-info"], input=lines, env=env
+        )
+        if not success:
+            print(f"❌ 写入资源索引失败: {stderr.strip()}")
+            return None
+        success, tree, stderr = run_git_command(["git", "write-tree"], env=env)
+    if not success:
+        print(f"❌ 写入资源树失败: {stderr.strip()}")
+        return None
+    return tree.strip()
+
+
+def fetch_assets_tip(remote: str, branch: str) -> Optional[str]:
+    """
+    资源分支的最新提交：先取一次远程（别的机器可能也发布过），
+    本地分支包含远程时用本地（上次推送失败的提交也算），否则用远程；都没有返回 None
+    """
+    tracking = f"refs/remotes/{remote}/{branch}"
+    run_git_command(
+        ["git", "fetch", "-q", remote, f"+refs/heads/{branch}:{tracking}"],
+        check=False,
+    )
+    tips = {}
+    for ref in (f"refs/heads/{branch}", tracking):
+        success, stdout, _ = run_git_command(
+            ["git", "rev-parse", "-q", "--verify", f"{ref}^{{commit}}"], check=False
+        )
+        if success:
+            tips[ref] = stdout.strip()
+    local, upstream = tips.get(f"refs/heads/{branch}"), tips.get(tracking)
+    if local and upstream and local != upstream:
+        contains, _, _ = run_git_command(
+            ["git", "merge-base", "--is-ancestor", upstream, local], check=False
+        )
+        return local if contains else upstream
+    return local or upstream
+
+
+def update_assets_ref(branch: str, tree: str, parent: Optional[str], message: str):
+    """commit-tree + update-ref：不检出、不碰工作区和当前索引，返回新提交 id"""
+    cmd = ["git", "commit-tree", tree, "-m", message]
+    if parent:
+        cmd += ["-p", parent]
+    success, commit, stderr = run_git_command(cmd)
+    if not success:
+        print(f"❌ 资源分支提交失败: {stderr.strip()}")
+        return None
+    commit = commit.strip()
+    success, _, stderr = run_git_command(
+        ["git", "update-ref", f"refs/heads/{branch}", commit]
+    )
+    if not success:
+        print(f"❌ 更新资源分支失败: {stderr.strip()}")
+        return None
+    return commit
+
+
+def push_assets(remote: str, branch: str, commit: str, force: bool = False) -> bool:
+    """推送资源分支并用 --porcelain 的输出验证"""
+    ref = f"refs/heads/{branch}"
+    success, push_output = push_commit(remote, branch, ("+" if force else "") + ref)
+    if not success:
+        print(f"❌ {push_output}")
+        return False
+    return verify_push(push_output, commit, branch)
+
+
+@traced("git.assets")
+def publish_assets(images_roots, remote: str, branch: str) -> bool:
+    """
+    把图片目录里新增 / 重新渲染的图片写进资源分支并推送
+    路径与主分支上的图片路径相同，只是所在分支不同；旧图片保留在分支上，直到 prune_assets
+    """
+    print(f"🖼️  同步图片到资源分支 {branch}\n")
+    parent = fetch_assets_tip(remote, branch)
+    entries = ls_tree(parent) if parent else {}
+
+    files = [
+        path
+        for path in iter_image_files(images_roots)
+        if path.as_posix() not in entries or path in _touched_paths
+    ]
+    commit = parent
+    if files:
+        success, stdout, stderr = run_git_command(
+            ["git", "hash-object", "-w", "--no-filters", "--stdin-paths"],
+            input="".join(f"{path.as_posix()}\n" for path in files),
+        )
+        if not success:
+            print(f"❌ 写入图片对象失败: {stderr.strip()}")
+            return False
+        changed = 0
+        for path, blob in zip(files, stdout.split()):
+            old = entries.get(path.as_posix())
+            if old is None or old[1] != blob:
+                entries[path.as_posix()] = ("100644", blob, path.stat().st_size)
+                changed += 1
+        if changed:
+            tree = write_tree(entries)
+            if tree is None:
+                return False
+            commit = update_assets_ref(
+                branch, tree, parent, f"{ASSETS_COMMIT_PREFIX} 更新 {changed} 张图片"
+            )
+            if commit is None:
+                return False
+            print(f"✅ 资源分支新增 / 更新 {changed} 张图片: {commit[:7]}\n")
+
+    if commit is None:
+        print("ℹ️  资源分支为空，无需推送\n")
+        return True
+    success, upstream, _ = run_git_command(
+        ["git", "rev-parse", "-q", "--verify", f"refs/remotes/{remote}/{branch}"],
+        check=False,
+    )
+    if success and upstream.strip() == commit:
+        print(f"✅ 远程 {branch} 已是最新 ({commit[:7]})\n")
+        return True
+    return push_assets(remote, branch, commit)
+
+
+def prune_assets(images_roots, remote: str, branch: str, manifest=None) -> int:
+    """
+    重写资源分支：只保留当前文档还在引用的图片，生成一个没有父提交的新提交并强制推送
+    只改写资源分支的历史，主分支不受影响；远程的旧对象由远程仓库自己回收
+    返回退出码：0=成功
+    """
+    tip = fetch_assets_tip(remote, branch)
+    if tip is None:
+        print(f"ℹ️  资源分支 {branch} 不存在，无需清理\n")
+        return 0
+
+    entries = ls_tree(tip)
+    doc_paths = iter_markdown_files()
+    referenced = set()
+    for images_root in images_roots:
+        for rel in build_image_references(doc_paths, images_root, manifest):
+            referenced.add((images_root / rel).as_posix())
+    if manifest is not None:
+        manifest.save()
+
+    keep = {path: entry for path, entry in entries.items() if path in referenced}
+    removed = len(entries) - len(keep)
+    freed = sum(entry[2] for path, entry in entries.items() if path not in keep)
+    print(
+        f"🧹 资源分支 {branch}: 保留 {len(keep)} 张，移除 {removed} 张（{freed:,} bytes）\n"
+    )
+    if not removed:
+        return 0
+
+    tree = write_tree(keep)
+    if tree is None:
+        return 1
+    commit = update_assets_ref(
+        branch, tree, None, f"{ASSETS_COMMIT_PREFIX} 只保留被引用的 {len(keep)} 张图片"
+    )
+    if commit is None or not push_assets(remote, branch, commit, force=True):
+        return 1
+    print(f"✅ 资源分支已重写为 {commit[:7]}（旧提交不再可达）\n")
+    return 0
+
+
+# ==================== 文档处理函数 ====================
+
+
+@traced("plan")
+def plan_document(doc_path: Path, images_root: Path = IMAGES_ROOT) -> Optional[dict]:
+    """
+    提取文档中的 Mermaid 代码块并计算图片路径（位于 images_root 下）
+    返回 None 表示读取失败
+    """
+    print(f"\n{'='*60}")
+    print(f"📄 处理文档: {doc_path}")
+    print(f"{'='*60}\n")
+
+    # 检查文件是否存在
+    if not doc_path.exists():
+        print(f"❌ 文件不存在: {doc_path}\n")
+        return None
+
+    # 提取 Mermaid 代码块
+    blocks, original_content = extract_mermaid_blocks(doc_path)
+    doc_name = doc_key(doc_path)
+
+    if not blocks:
+        print(f"ℹ️  未找到 Mermaid 代码块，跳过\n")
+    else:
+        print(f"📊 找到 {len(blocks)} 个 Mermaid 图表\n")
+
+    for block in blocks:
+        block["images_root"] = images_root
+        block["rel_path"], block["abs_path"] = get_image_path(
+            doc_name, block, images_root
+        )
+        block["ok"] = False
+
+    return {
+        "path": doc_path,
+        "name": doc_name,
+        "blocks": blocks,
+        "content": original_content,
+    }
+
+
+@traced("precheck")
+def precheck_blocks(docs: List[dict], blocks: List[dict]) -> List[dict]:
+    """
+    渲染前对待渲染的图表做语法预检查，一次列出全部问题
+    有问题的图表标记为失败（不交给渲染器），返回通过检查的图表
+    """
+    doc_of = {id(b): doc for doc in docs for b in doc["blocks"]}
+    passed = []
+    failed = 0
+    for block in blocks:
+        problems = lint_mermaid(block["code"])
+        if not problems:
+            passed.append(block)
+            continue
+        if not failed:
+            print("\n🔍 Mermaid 预检查发现问题（这些图表不会被渲染）：\n")
+        failed += 1
+        block["ok"] = False
+        doc_path = doc_of[id(block)]["path"]
+        for line, message in problems:
+            print(
+                f"  ❌ {doc_path}:{block['line'] + line}: 流程图 {block['index']}: {message}"
+            )
+    if failed:
+        print(f"\n⚠️  {failed} 个图表未通过预检查（--no-precheck 可跳过）")
+    return passed
+
+
+@traced("render")
+def render_documents(
+    docs: List[dict],
+    cache: Optional[RenderCache],
+    renderer,
+    precheck: bool = True,
+    journal: Optional[Journal] = None,
+) -> None:
+    """
+    汇总所有文档中缓存未命中的图表，一次性交给渲染后端
+    precheck=True 时先做语法预检查，有问题的图表直接判为失败
+    传入 journal 时每 CHECKPOINT_DIAGRAMS 张落盘一次，中断后从断点继续
+    渲染结果写回各 block 的 "ok" 字段
+    """
+    pending = []
+    # 同一份源码只渲染一次（不论出现在哪个文档、哪个根目录），其他位置复制渲染结果
+    by_code = {}
+    with span("cache.lookup"):
+        for doc in docs:
+            for block in doc["blocks"]:
+                if block["code"] in by_code:
+                    by_code[block["code"]].append(block)
+                elif cache is not None and cache.lookup(
+                    block["code"], block["abs_path"]
+                ):
+                    block["ok"] = True
+                else:
+                    by_code[block["code"]] = [block]
+                    pending.append(block)
+
+    if precheck and pending:
+        pending = precheck_blocks(docs, pending)
+
+    if not pending:
+        return
+
+    print(
+        f"\n🎨 生成高质量图片（2000px 宽，3x scale，{RENDER_OPTIONS['format']}），"
+        f"共 {len(pending)} 个，后端: {renderer.name}\n"
+    )
+    size = CHECKPOINT_DIAGRAMS if journal is not None else len(pending)
+    for start in range(0, len(pending), size):
+        group = pending[start : start + size]
+        tasks = [
+            {
+                "code": block["code"],
+                "output": render_target(block["abs_path"]),
+                "label": block["rel_path"],
+                "timeout": diagram_timeout(block["code"], renderer.timeout),
+            }
+            for block in group
+        ]
+        for block, ok in zip(group, renderer.render(tasks)):
+            block["ok"] = ok
+
+        finalize_outputs(group)
+
+        for block in group:
+            for duplicate in by_code[block["code"]][1:]:
+                if block["ok"] and duplicate["abs_path"] != block["abs_path"]:
+                    commit_image(block["abs_path"].read_bytes(), duplicate["abs_path"])
+                duplicate["ok"] = block["ok"]
+            if block["ok"] and cache is not None:
+                cache.store(block["code"], block["abs_path"])
+
+        if cache is not None:
+            with span("cache.save"):
+                cache.save()
+        if journal is not None:
+            journal.rendered(group)
+
+
+@traced("rewrite")
+def finish_document(doc: dict, journal: Optional[Journal] = None) -> bool:
+    """把渲染成功的图表写回原文档（原子替换），返回是否全部成功"""
+    blocks = doc["blocks"]
+    if not blocks:
+        return True
+
+    success_count = sum(1 for block in blocks if block["ok"])
+
+    # 替换原文档中的 Mermaid 代码块（内容没变就不写，避免无意义的修改）
+    if success_count > 0:
+        new_content = replace_mermaid_with_images(blocks, doc["content"], doc["name"])
+        if new_content != doc["content"]:
+            print(f"\n📝 更新原文档: {doc['path']}")
+            write_text_atomic(doc["path"], new_content)
+            doc["content"] = new_content
+            record_touched(doc["path"])
+            print(f"   ✅ 已将 Mermaid 代码块替换为图片链接")
+        if journal is not None:
+            journal.rewritten(doc["path"])
+
+    # 总结
+    print(f"   ✅ 成功生成 {success_count}/{len(blocks)} 个图表")
+
+    return success_count == len(blocks)
+
+
+def process_documents(
+    doc_paths: List[Path],
+    cache: Optional[RenderCache] = None,
+    renderer=None,
+    precheck: bool = True,
+    roots=None,
+    manifest: Optional[Manifest] = None,
+    journal: Optional[Journal] = None,
+) -> int:
+    """
+    批量处理文档：先提取全部图表，再统一渲染，最后逐个回写
+    所有根目录的文档共用一个渲染队列，图片写到各自根目录的图片目录
+    传入 manifest 时用回写后的内容顺带刷新文档清单
+    传入 journal 时记录渲染和回写进度（见 Journal）
+    返回全部图表都成功的文档数
+    """
+    roots = roots or KNOWLEDGE_ROOTS
+    if renderer is None:
+        renderer = BatchRenderer()
+
+    docs = []
+    for doc_path in doc_paths:
+        doc = plan_document(doc_path, images_root_for(doc_path, roots))
+        if doc is not None:
+            docs.append(doc)
+
+    render_documents(docs, cache, renderer, precheck, journal)
+
+    success_count = sum(1 for doc in docs if finish_document(doc, journal))
+    if manifest is not None:
+        for doc in docs:
+            manifest.update(doc["path"], doc["content"])
+    return success_count
+
+
+def migrate_images(
+    doc_paths: List[Path], cache: Optional[RenderCache] = None, roots=None
+) -> int:
+    """
+    一次性迁移：把已发布图表的图片移动到当前布局下的路径，并批量改写链接
+    （例如旧的 {文档名}/ 目录 → 带路径哈希的命名空间，或 → 共享存储）
+    每个文档的图片留在它所在根目录的图片目录里（见 images_root_for）
+
+    旧图片仍被其他未迁移的 Markdown 引用时只复制不删除。
+    返回退出码：0=成功，1=有图表缺少图片
+    """
+    roots = roots or KNOWLEDGE_ROOTS
+    print(f"🚚 迁移图片到 {IMAGE_LAYOUT} 布局\n")
+
+    docs = []
+    moves = {}  # 旧图片 → {新图片, ...}
+    owners = {}  # 旧图片 → 所在的图片目录
+    missing = 0
+    for doc_path in doc_paths:
+        blocks, content = extract_mermaid_blocks(doc_path)
+        doc_name = doc_key(doc_path)
+        images_root = images_root_for(doc_path, roots)
+        for block in blocks:
+            block["ok"] = False
+            block["images_root"] = images_root
+            if not block["published"]:
+                continue
+            old_rel = resolve_image_ref(doc_path, block["image_url"], images_root)
+            block["rel_path"], block["abs_path"] = get_image_path(
+                doc_name, block, images_root
+            )
+            old_path = images_root / old_rel if old_rel else None
+            if old_path is None or not (
+                old_path.exists() or block["abs_path"].exists()
+            ):
+                print(
+                    f"  ⚠️  {doc_path.name} 图表 {block['index']}: 找不到原图片，跳过"
+                )
+                missing += 1
+                continue
+            block["ok"] = True
+            if old_path != block["abs_path"]:
+                moves.setdefault(old_path, set()).add(block["abs_path"])
+                owners[old_path] = images_root
+        docs.append(
+            {"path": doc_path, "name": doc_name, "blocks": blocks, "content": content}
+        )
+
+    migrated = {doc["path"] for doc in docs}
+    markdown_files = iter_markdown_files()
+    references = {}  # 图片目录 → 引用索引
+
+    for old_path, new_paths in sorted(moves.items()):
+        images_root = owners[old_path]
+        for new_path in sorted(new_paths):
+            if not new_path.exists():
+                commit_image(old_path.read_bytes(), new_path)
+                if cache is not None:
+                    cache.relocate(old_path, new_path)
+            print(
+                f"  {old_path.relative_to(images_root)} → {new_path.relative_to(images_root)}"
+            )
+        # 只有迁移范围内的文档引用旧图片时才删除
+        if images_root not in references:
+            references[images_root] = build_image_references(
+                markdown_files, images_root
+            )
+        referrers = references[images_root].get(
+            old_path.relative_to(images_root).as_posix(), []
+        )
+        if old_path.exists() and all(Path(r) in migrated for r in referrers):
+            old_path.unlink()
+
+    rewritten = 0
+    for doc in docs:
+        new_content = replace_mermaid_with_images(
+            doc["blocks"], doc["content"], doc["name"]
+        )
+        if new_content != doc["content"]:
+            write_text_atomic(doc["path"], new_content)
+            rewritten += 1
+
+    for images_root in dict.fromkeys(images_root_for(p, roots) for p in doc_paths):
+        for directory in sorted(images_root.rglob("*"), reverse=True):
+            if directory.is_dir() and not any(directory.iterdir()):
+                directory.rmdir()
+
+    if cache is not None:
+        cache.save()
+
+    print(f"\n✅ 迁移 {len(moves)} 张图片，改写 {rewritten} 个文档")
+    if missing:
+        print(f"⚠️  {missing} 个图表缺少图片，需要重新渲染（--all）")
+    print()
+    return 1 if missing else 0
+
+
+def process_document(doc_path: Path, cache: Optional[RenderCache] = None) -> bool:
+    """处理单个文档，传入 cache 时跳过已渲染过的图表"""
+    return process_documents([doc_path], cache) == 1
+
+
+@traced("validate")
+def validate_documents(doc_paths: List[Path], roots=None) -> bool:
+    """
+    发布前校验（knowledge_validator 的规则），存在 error 时返回 False
+    roots 为发布的根目录，图片链接按各自根目录的图片目录检查
+    """
+    import knowledge_validator
+
+    report = knowledge_validator.validate(
+        doc_paths, roots=roots or knowledge_validator.DOCUMENT_ROOTS
+    )
+    knowledge_validator.print_report(report)
+    print()
+    return report["errors"] == 0
+
+
+# ==================== Publisher ====================
+
+
+class Publisher:
+    """
+    可导入的发布器：CLI、Skill、编辑器插件和常驻服务共用
+
+    实例持有渲染后端（mmdc 只检查一次）、渲染缓存和文档清单，
+    在同一个实例上重复调用 publish() / build() 时不再重复这些启动开销。
+    roots 可以是路径或 make_root() 的结果，所有根目录的图表共用一次渲染。
+    assets_branch 不为空时图片推送到该资源分支（见 publish_assets），不进主分支。
+
+    用法：
+        publisher = Publisher(renderer="batch", jobs=4)
+        publisher.build([Path("knowledge/xxx.md")])
+        publisher.publish(incremental=True)
+
+        Publisher(roots=["knowledge", make_root(Path("agent-client"))]).publish()
+    """
+
+    def __init__(
+        self,
+        roots=None,
+        repo: str = GITHUB_REPO,
+        branch: str = GITHUB_BRANCH,
+        renderer: str = "batch",
+        jobs: int = 1,
+        timeout: float = DEFAULT_TIMEOUT,
+        precheck: bool = True,
+        assets_branch: Optional[str] = None,
+    ):
+        self.roots = (
+            tuple(r if isinstance(r, dict) else make_root(Path(r)) for r in roots)
+            if roots
+            else KNOWLEDGE_ROOTS
+        )
+        self.repo = repo
+        self.branch = branch
+        self.renderer_name = renderer
+        self.jobs = jobs
+        self.timeout = timeout
+        self.precheck = precheck
+        self.assets_branch = assets_branch
+        self.manifest = Manifest()
+        self._renderer = None
+        self._cache = None
+
+    def documents(self) -> List[Path]:
+        """各根目录下匹配 include / exclude 的全部 Markdown 文档"""
+        return sorted({p for root in self.roots for p in iter_root_documents(root)})
+
+    def images_roots(self) -> List[Path]:
+        return list(dict.fromkeys(root["images"] for root in self.roots))
+
+    def config(self) -> dict:
+        """影响产出的配置（可 JSON 序列化），--socket 转发前用来对比客户端和服务"""
+        return {
+            "roots": [
+                [
+                    root["path"].as_posix(),
+                    root["include"].pattern,
+                    root["exclude"].pattern,
+                    root["images"].as_posix(),
+                ]
+                for root in self.roots
+            ],
+            "repo": self.repo,
+            "branch": self.branch,
+            "assets_branch": self.assets_branch,
+            "renderer": self.renderer_name,
+            "jobs": self.jobs,
+            "timeout": self.timeout,
+            "precheck": self.precheck,
+            "format": RENDER_OPTIONS["format"],
+            "optimize": RENDER_OPTIONS["optimize"],
+            "layout": IMAGE_LAYOUT,
+        }
+
+    def renderer(self):
+        """按需创建渲染后端，工具检查只在第一次成功前执行"""
+        if self._renderer is None:
+            renderer = RENDERERS[self.renderer_name](self.jobs, self.timeout)
+            if not renderer.check():
+                return None
+            self._renderer = renderer
+        return self._renderer
+
+    def cache(self) -> RenderCache:
+        """复用内存中的渲染缓存（其他进程改写过缓存文件时重新加载）"""
+        if self._cache is None:
+            self._cache = RenderCache(self._renderer.version())
+        else:
+            self._cache.refresh()
+        return self._cache
+
+    @traced("publish")
+    def publish(
+        self,
+        incremental: bool = False,
+        base_ref: Optional[str] = None,
+        validate: bool = False,
+        resume: bool = True,
+    ) -> int:
+        """
+        完整的发布流程：检查 → 生成图片 → 提交 → 推送 → 验证
+        incremental=True 时只处理 Git 检测到变更的文档（对比 HEAD 或 base_ref）
+        validate=True 时先校验待发布文档，有 error 则不发布
+        resume=True 时从上次中断的地方继续（见 Journal），False 丢弃发布日志重新开始
+        返回退出码：0=成功，1=失败
+        """
+        configure_repo(self.repo, self.branch, self.assets_branch)
+
+        print("=" * 60)
+        print("📦 自动化知识发布流程")
+        print("=" * 60)
+        print()
+
+        _touched_paths.clear()
+
+        # 步骤 1: 检查 Git 状态（指定基准 ref 时，已提交的变更也需要处理）
+        status = check_git_status()
+        if status is None:
+            return 1
+        if self.assets_branch:
+            # 图片只进资源分支，图片目录下的改动（包括未跟踪的新图片）不算主分支的修改
+            images_roots = self.images_roots()
+            status["entries"] = [
+                e
+                for e in status["entries"]
+                if not is_under(Path(e["path"]), images_roots)
+            ]
+
+        # 上次发布中断：已提交未推送的只重试推送，渲染 / 回写到一半的接着做
+        journal = Journal()
+        if not resume:
+            journal.clear()
+        retried = retry_push(journal)
+        if retried is False:
+            print("❌ 推送仍未成功，修复后重新运行 --publish 即可重试推送")
+            return 1
+        if journal.active:
+            print(f"♻️  继续上次中断的发布（{journal.summary()}）\n")
+
+        if not status["entries"] and not base_ref:
+            journal.clear()
+            if retried:
+                print("🎉 上次的提交已推送成功，没有新的修改需要发布")
+            else:
+                print("ℹ️  没有修改需要发布，退出")
+            return 0
+
+        # 步骤 2: 检测 Mermaid（对比 HEAD 的变更集合直接来自上面的状态）
+        candidates = None
+        if base_ref:
+            candidates = git_changed_files(base_ref)
+            if candidates is None:
+                print("❌ 无法获取 Git 变更列表")
+                return 1
+        elif incremental:
+            candidates = status_paths(status)
+        if candidates is not None and journal.active:
+            candidates = list(dict.fromkeys(candidates + journal.docs()))
+
+        if validate:
+            print("🔎 发布前校验文档\n")
+            if candidates is None:
+                targets = self.documents()
+            else:
+                targets = [p for p in candidates if p.suffix == ".md"]
+            if not validate_documents(targets, self.roots):
+                print("❌ 文档校验未通过，已取消发布")
+                return 1
+
+        mermaid_docs = detect_mermaid_in_knowledge(
+            candidates, self.roots, self.manifest
+        )
+
+        # 步骤 3: 生成图片（如果需要）
+        if mermaid_docs:
+            print("📋 步骤 3/5: 生成高质量流程图\n")
+
+            renderer = self.renderer()
+            if renderer is None:
+                return 1
+
+            cache = self.cache()
+            journal.begin(mermaid_docs)
+            success_count = process_documents(
+                mermaid_docs,
+                cache,
+                renderer,
+                self.precheck,
+                self.roots,
+                self.manifest,
+                journal,
+            )
+            self.manifest.save()
+
+            print()
+            cache.report()
+
+            if success_count == 0:
+                print("\n❌ 图片生成失败")
+                return 1
+
+            print(f"\n✅ 成功生成 {success_count}/{len(mermaid_docs)} 个文档的流程图\n")
+        else:
+            print("ℹ️  无需生成图片\n")
+            print("📋 步骤 3/5: 跳过图片生成\n")
+
+        # 步骤 4: 生成 commit message 并提交推送（只暂存发布范围内的文件）
+        changes = scoped = publish_changes(status, self.roots)
+        remote, branch = push_target(status)
+        if self.assets_branch:
+            # 图片先推到资源分支，主分支的提交落地时链接已经可用
+            if not publish_assets(images_roots, remote, self.assets_branch):
+                print("❌ 图片推送到资源分支失败，主分支未提交")
+                return 1
+            changes = {
+                p: xy for p, xy in changes.items() if not is_under(p, images_roots)
+            }
+        if not changes:
+            journal.clear()
+            print("ℹ️  发布范围内没有需要提交的修改，退出")
+            return 0
+        skipped = len(status["entries"]) - sum(
+            1 for e in status["entries"] if Path(e["path"]) in scoped
+        )
+        if skipped:
+            print(f"ℹ️  {skipped} 个发布范围以外的修改不会被提交\n")
+
+        commit_msg = generate_commit_message(changes, self.images_roots())
+        success, result, push_output = commit_and_push(
+            commit_msg, changes, remote, branch, journal
+        )
+
+        if not success:
+            print(f"❌ {result}")
+            if journal.pending_push():
+                print("   已在本地提交，重新运行 --publish 只会重试推送")
+            return 1
+
+        local_hash = result
+
+        # 步骤 5: 验证推送（结果来自推送输出本身，失败即发布失败）
+        print("📋 步骤 5/5: 验证推送\n")
+        if not verify_push(push_output, local_hash, branch):
+            print(f"❌ 已在本地提交 {local_hash[:7]}，但推送未成功")
+            print("   重新运行 --publish 只会重试推送，不会重新渲染或提交")
+            return 1
+        journal.clear()
+
+        # 最终总结
+        print("=" * 60)
+        print("🎉 发布成功！")
+        print("=" * 60)
+        print()
+        print("📊 本次提交信息：")
+        print(f"   Commit: {local_hash[:7]}")
+        print(f"   Message: {commit_msg}")
+        print()
+        print("🔗 GitHub 链接：")
+        print(f"   https://github.com/{self.repo}/commit/{local_hash}")
+        print()
+        print("📁 查看 Knowledge Base：")
+        print(f"   https://github.com/{self.repo}/tree/{self.branch}/knowledge")
+        print()
+
+        return 0
+
+    @traced("build")
+    def build(self, doc_files: List[Path]) -> int:
+        """
+        仅生成图片（不提交推送）
+        返回退出码：0=成功，1=失败
+        """
+        configure_repo(self.repo, self.branch, self.assets_branch)
+
+        # 检查工具
+        renderer = self.renderer()
+        if renderer is None:
+            return 1
+
+        if not doc_files:
+            print("❌ 没有找到要处理的文件\n")
+            return 1
+
+        print(f"\n🚀 准备处理 {len(doc_files)} 个文档\n")
+
+        # 处理所有文档
+        cache = self.cache()
+        success_count = process_documents(
+            doc_files, cache, renderer, self.precheck, self.roots, self.manifest
+        )
+        self.manifest.save()
+
+        # 总结
+        print(f"\n{'='*60}")
+        print(f"🎉 完成！成功处理 {success_count}/{len(doc_files)} 个文档")
+        cache.report()
+        for images_root in self.images_roots():
+            print(f"📁 图片目录: {images_root.absolute()}")
+        print(f"\n✅ 已更新原文档：")
+        print(f"  - Mermaid 代码块 → 图片链接 + 折叠源码")
+        print(f"  - 可直接复制到飞书，图片自动加载")
+        print(f"\n后续步骤：")
+        print(f"  1. git add knowledge/")
+        print(f"  2. git commit -m 'docs: 更新流程图'")
+        print(f"  3. git push")
+        print(f"{'='*60}\n")
+
+        return 0 if success_count == len(doc_files) else 1
+
+    @traced("preview")
+    def preview(self, doc_path: Path) -> int:
+        """
+        预览：只渲染源码有变化的图表，原文档保持不动
+        图片写到 PREVIEW_DIR/images/{源码哈希}（内容寻址，没变的图表直接复用），
+        替换成图片后的 Markdown 写到 PREVIEW_DIR/{文档命名空间}.md
+        返回退出码：0=全部图表就绪，1=有图表失败
+        """
+        renderer = self.renderer()
+        if renderer is None:
+            return 1
+
+        start = time.perf_counter()
+        blocks, content = extract_mermaid_blocks(doc_path)
+        fmt = RENDER_OPTIONS["format"]
+        for block in blocks:
+            name = f"{block['digest'][:16]}.{fmt}"
+            block["rel_path"] = f"{PREVIEW_IMAGES.name}/{name}"
+            block["abs_path"] = PREVIEW_IMAGES / name
+            block["ok"] = block["abs_path"].exists() and has_image_signature(
+                block["abs_path"]
+            )
+
+        pending = [block for block in blocks if not block["ok"]]
+        print(f"🔄 {doc_path}: {len(blocks)} 个图表，{len(pending)} 个有变化")
+        if pending:
+            doc = {"path": doc_path, "blocks": pending}
+            render_documents([doc], self.cache(), renderer, self.precheck)
+
+        preview_path = PREVIEW_DIR / f"{doc_namespace(doc_key(doc_path))}.md"
+        preview_path.parent.mkdir(parents=True, exist_ok=True)
+        new_content = preview_markdown(blocks, content)
+        if (
+            not preview_path.exists()
+            or preview_path.read_text(encoding="utf-8") != new_content
+        ):
+            write_text_atomic(preview_path, new_content)
+
+        failed = sum(1 for block in blocks if not block["ok"])
+        elapsed = time.perf_counter() - start
+        if failed:
+            print(
+                f"⚠️  {failed} 个图表失败，预览中保留源码（{elapsed:.2f}s）: {preview_path}"
+            )
+        else:
+            print(f"✅ 预览已更新（{elapsed:.2f}s）: {preview_path}")
+        return 1 if failed else 0
+
+    def export(
+        self, doc_paths: List[Path], mode: str = "dir", out_dir: Path = EXPORT_DIR
+    ) -> int:
+        """
+        离线导出：每个文档一个自包含的包（见 Bundle），导入飞书时不依赖推送
+        已发布的图表直接用文档引用的本地图片，其余走渲染缓存 / 预览图片，
+        都没有时才渲染（写到 PREVIEW_IMAGES，不改原文档）
+        返回退出码：0=全部导出，1=有文档失败
+        """
+        commit, blobs = None, {}
+        if mode == "pinned":
+            # 图片在资源分支时固定到资源分支的最新提交
+            rev = f"refs/heads/{self.assets_branch}" if self.assets_branch else "HEAD"
+            success, commit, _ = run_git_command(["git", "rev-parse", rev])
+            if not success:
+                print(f"❌ 无法获取 {rev} 的提交")
+                return 1
+            commit = commit.strip()
+            blobs = committed_blobs([str(root) for root in self.images_roots()], commit)
+            _, remotes, _ = run_git_command(
+                ["git", "branch", "-r", "--contains", commit], check=False
+            )
+            if not remotes.strip():
+                print(f"⚠️  {commit[:7]} 还没有推送到远程，推送前固定链接无法访问\n")
+
+        print(f"📦 导出 {len(doc_paths)} 个文档（{mode}）→ {out_dir}\n")
+        fmt = RENDER_OPTIONS["format"]
+        names = set()
+        failed = 0
+        for doc_path in doc_paths:
+            blocks, content = extract_mermaid_blocks(doc_path)
+            if not content:
+                failed += 1
+                continue
+            images_root = images_root_for(doc_path, self.roots)
+
+            pending = []
+            for block in blocks:
+                source = None
+                if block["published"] and block["image_url"]:
+                    rel = resolve_image_ref(doc_path, block["image_url"], images_root)
+                    if rel is not None:
+                        source = images_root / rel
+                if source is None or not source.is_file():
+                    name = f"{block['digest'][:16]}.{fmt}"
+                    source = PREVIEW_IMAGES / name
+                    block["rel_path"] = f"{PREVIEW_IMAGES.name}/{name}"
+                    block["abs_path"] = source
+                block["source"] = source
+                block["ok"] = source.exists() and has_image_signature(source)
+                if not block["ok"]:
+                    pending.append(block)
+
+            if pending:
+                renderer = self.renderer()
+                if renderer is None:
+                    return 1
+                doc = {"path": doc_path, "blocks": pending}
+                render_documents([doc], self.cache(), renderer, self.precheck)
+
+            bundle = Bundle(mode, commit, blobs)
+            new_content = export_markdown(
+                blocks, content, doc_path, images_root, bundle
+            )
+            # 包名用文档文件名，方便导入后识别；不同根目录下重名时加命名空间
+            name = doc_path.stem
+            if name in names:
+                name = doc_namespace(doc_key(doc_path))
+            names.add(name)
+            target = write_bundle(name, new_content, bundle, out_dir)
+
+            broken = sum(1 for block in blocks if not block["ok"])
+            notes = []
+            if bundle.assets:
+                notes.append(f"{len(bundle.assets)} 张图片")
+            if bundle.pinned:
+                notes.append(f"{bundle.pinned} 张固定链接")
+            if bundle.inlined:
+                notes.append(f"{bundle.inlined} 张内联")
+            if broken:
+                notes.append(f"{broken} 个图表失败，保留源码")
+                failed += 1
+            print(
+                f"  {'⚠️ ' if broken else '✅'} {target}（{'，'.join(notes) or '无图片'}）"
+            )
+
+        print()
+        return 1 if failed else 0
+
+
+def publish(
+    renderer_name: str = "batch",
+    jobs: int = 1,
+    timeout: float = DEFAULT_TIMEOUT,
+    incremental: bool = False,
+    base_ref: Optional[str] = None,
+    validate: bool = False,
+    precheck: bool = True,
+) -> int:
+    """一次性的完整发布流程，见 Publisher.publish()"""
+    publisher = Publisher(
+        renderer=renderer_name, jobs=jobs, timeout=timeout, precheck=precheck
+    )
+    return publisher.publish(incremental, base_ref, validate)
+
+
+def build_only(
+    doc_files: List[Path],
+    renderer_name: str = "batch",
+    jobs: int = 1,
+    timeout: float = DEFAULT_TIMEOUT,
+    precheck: bool = True,
+) -> int:
+    """一次性的仅生成图片，见 Publisher.build()"""
+    publisher = Publisher(
+        renderer=renderer_name, jobs=jobs, timeout=timeout, precheck=precheck
+    )
+    return publisher.build(doc_files)
+
+
+# ==================== 常驻服务（JSON-RPC） ====================
+
+# 默认的 Unix socket 路径（位于本地缓存目录，不提交）
+DEFAULT_SOCKET = CACHE_DIR / "publisher.sock"
+
+# JSON-RPC 2.0 错误码
+RPC_PARSE_ERROR = -32700
+RPC_INVALID_REQUEST = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_INVALID_PARAMS = -32602
+RPC_INTERNAL_ERROR = -32603
+
+# 方法 → 允许的参数
+RPC_METHODS = {
+    "ping": set(),
+    "publish": {"incremental", "since", "validate", "resume"},
+    "build": {"files", "all"},
+    "preview": {"files"},
+    "shutdown": set(),
+}
+
+
+class PublisherService:
+    """
+    把 Publisher 包装成 JSON-RPC 2.0 服务：每行一个请求，每行一个响应
+
+    请求串行执行（渲染器、缓存和 Git 工作区都不是并发安全的），
+    工具原本打印到终端的日志收集到结果的 "log" 字段中返回。
+    """
+
+    def __init__(self, publisher: Publisher):
+        self.publisher = publisher
+        self.lock = threading.Lock()
+        self.running = True
+        self.requests = 0
+        self.started = time.time()
+
+    def call(self, method: str, params: dict):
+        if method == "ping":
+            return {
+                "pid": os.getpid(),
+                "uptime": round(time.time() - self.started, 1),
+                "requests": self.requests,
+                "cwd": os.getcwd(),
+                "config": self.publisher.config(),
+            }
+        if method == "shutdown":
+            self.running = False
+            return {"stopping": True}
+
+        log = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            if method == "publish":
+                code = self.publisher.publish(
+                    incremental=bool(params.get("incremental")),
+                    base_ref=params.get("since"),
+                    validate=bool(params.get("validate")),
+                    resume=bool(params.get("resume", True)),
+                )
+            elif method == "preview":
+                code = max(
+                    [self.publisher.preview(Path(f)) for f in params.get("files", [])],
+                    default=0,
+                )
+            elif params.get("all"):
+                code = self.publisher.build(self.publisher.documents())
+            else:
+                code = self.publisher.build([Path(f) for f in params.get("files", [])])
+        return {
+            "code": code,
+            "log": log.getvalue(),
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def handle(self, request) -> Optional[dict]:
+        """处理一个已解析的请求，通知（没有 id）不返回响应"""
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return rpc_error(None, RPC_INVALID_REQUEST, "Invalid Request")
+
+        request_id = request.get("id")
+        method = request["method"]
+        params = request.get("params") or {}
+        if method not in RPC_METHODS:
+            if "id" not in request:
+                return None
+            return rpc_error(request_id, RPC_METHOD_NOT_FOUND, f"未知方法: {method}")
+        if not isinstance(params, dict) or set(params) - RPC_METHODS[method]:
+            if "id" not in request:
+                return None
+            allowed = ", ".join(sorted(RPC_METHODS[method])) or "无"
+            return rpc_error(
+                request_id, RPC_INVALID_PARAMS, f"{method} 的参数只能是: {allowed}"
+            )
+
+        with self.lock:
+            self.requests += 1
+            try:
+                response = {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "result": self.call(method, params),
+                }
+            except Exception as e:
+                response = rpc_error(
+                    request_id, RPC_INTERNAL_ERROR, f"{type(e).__name__}: {e}"
+                )
+
+        return response if "id" in request else None
+
+    def handle_line(self, line: str) -> Optional[str]:
+        """处理一行 JSON，返回要写回的一行响应（空行和通知返回 None）"""
+        if not line.strip():
+            return None
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = rpc_error(None, RPC_PARSE_ERROR, f"Parse error: {e}")
+        else:
+            response = self.handle(request)
+        if response is None:
+            return None
+        return json.dumps(response, ensure_ascii=False)
+
+
+def rpc_error(request_id, code: int, message: str) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": code, "message": message},
+    }
+
+
+class RpcHandler(socketserver.StreamRequestHandler):
+    """Unix socket 连接：一个连接上可以连续发送多个请求"""
+
+    def handle(self):
+        service = self.server.service
+        for raw in self.rfile:
+            response = service.handle_line(raw.decode("utf-8"))
+            if response is not None:
+                self.wfile.write((response + "\n").encode("utf-8"))
+                self.wfile.flush()
+            if not service.running:
+                # shutdown() 会等待 serve_forever() 退出，不能在其所在线程调用
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+def serve_stdio(service: PublisherService) -> int:
+    """stdin 读请求、stdout 写响应，由编辑器插件作为子进程启动"""
+    out = sys.stdout
+    print("🟢 Publisher 服务已启动（stdio）", file=sys.stderr)
+    for line in sys.stdin:
+        response = service.handle_line(line)
+        if response is not None:
+            out.write(response + "\n")
+            out.flush()
+        if not service.running:
+            break
+    return 0
+
+
+def serve_socket(service: PublisherService, socket_path: Path) -> int:
+    """在 Unix socket 上提供服务，直到收到 shutdown 请求或 Ctrl-C"""
+    if socket_path.exists():
+        try:
+            rpc_call(socket_path, "ping")
+        except OSError:
+            socket_path.unlink()  # 上次异常退出留下的 socket 文件
+        else:
+            print(f"❌ 已有服务在 {socket_path} 上运行")
+            return 1
+
+    class RpcServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    server = RpcServer(str(socket_path), RpcHandler)
+    server.service = service
+    print(f"🟢 Publisher 服务已启动: {socket_path}（pid {os.getpid()}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            socket_path.unlink()
+    print(f"🔴 Publisher 服务已停止（共处理 {service.requests} 个请求）")
+    return 0
+
+
+def rpc_call(socket_path: Path, method: str, params: Optional[dict] = None):
+    """向常驻服务发送一个请求并返回 result，服务返回错误时抛出 RuntimeError"""
+    request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("服务未返回响应")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(response["error"]["message"])
+    return response["result"]
+
+
+# Publisher.config() 的键对应的命令行选项（配置不一致时提示用）
+CONFIG_OPTIONS = {
+    "roots": "--root/--include/--exclude",
+    "repo": "仓库",
+    "branch": "分支",
+    "assets_branch": "--assets-branch",
+    "renderer": "--renderer",
+    "jobs": "--jobs",
+    "timeout": "--timeout",
+    "precheck": "--no-precheck",
+    "format": "--format",
+    "optimize": "--optimize",
+    "layout": "--layout",
+}
+
+
+def forward_to_service(
+    socket_path: Path, method: str, params: dict, config: dict
+) -> Optional[int]:
+    """
+    把本次调用转发给已经运行的服务，返回退出码
+    服务没有运行，或服务的配置（config，见 Publisher.config）与本次调用不同时返回 None，
+    由调用方在本进程内执行，不会悄悄用服务的配置产出
+    """
+    try:
+        service_config = rpc_call(socket_path, "ping").get("config") or {}
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"ℹ️  服务未运行（{socket_path}），在本进程内执行\n")
+        return None
+    differs = [key for key in config if service_config.get(key) != config[key]]
+    if differs:
+        options = "、".join(CONFIG_OPTIONS.get(key, key) for key in differs)
+        print(f"ℹ️  服务的配置与本次调用不同（{options}），在本进程内执行\n")
+        return None
+
+    result = rpc_call(socket_path, method, params)
+    print(result["log"], end="")
+    print(f"⚡ 由常驻服务执行，耗时 {result['seconds']:.2f}s")
+    return result["code"]
+
+
+# ==================== 离线导出 ====================
+
+# dir=目录（Markdown + images/），zip=单个压缩包，inline=图片内联为 data URI，
+# pinned=图片链接固定到 HEAD commit 的 Raw URL
+BUNDLE_MODES = ("dir", "zip", "inline", "pinned")
+
+IMAGE_MIME = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".svg": "image/svg+xml",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+}
+
+# zip 条目的固定时间戳：同样的内容总是得到同样的压缩包
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
+def git_blob_id(data: bytes) -> str:
+    """与 `git hash-object` 相同的 blob id"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def committed_blobs(paths: List[str], rev: str = "HEAD") -> dict:
+    """rev 中 paths 下的文件：{仓库相对路径: blob id}"""
+    success, stdout, _ = run_git_command(
+        ["git", "ls-tree", "-r", "-z", rev, "--", *paths], check=False
+    )
+    blobs = {}
+    if success:
+        for record in stdout.split("\0"):
+            meta, _, path = record.partition("\t")
+            if path:
+                blobs[path] = meta.split()[2]
+    return blobs
+
+
+def data_uri(path: Path) -> str:
+    mime = IMAGE_MIME.get(path.suffix.lower(), "application/octet-stream")
+    return f"data:{mime};base64,{base64.b64encode(path.read_bytes()).decode('ascii')}"
+
+
+class Bundle:
+    """
+    一个文档的导出包：收集用到的本地图片，决定 Markdown 里的链接写法
+
+      dir / zip  图片复制进包内 images/（按内容哈希命名），链接写相对路径
+      inline     图片以 data URI 内联，整个文档就是一个文件
+      pinned     链接指向 HEAD（或资源分支）提交的 Raw URL，不随分支移动；
+                 图片不在该提交里（未提交或已修改）时退回内联
+    """
+
+    def __init__(self, mode: str, commit: Optional[str] = None, blobs=None):
+        self.mode = mode
+        self.commit = commit
+        self.blobs = blobs or {}
+        self.assets = {}  # 包内路径 → 源文件
+        self.inlined = 0
+        self.pinned = 0
+
+    def link(self, path: Path) -> str:
+        if self.mode == "pinned":
+            key = doc_key(path)
+            if self.blobs.get(key) == git_blob_id(path.read_bytes()):
+                self.pinned += 1
+                return f"https://raw.githubusercontent.com/{GITHUB_REPO}/{self.commit}/{key}"
+            self.inlined += 1
+            return data_uri(path)
+        if self.mode == "inline":
+            self.inlined += 1
+            return data_uri(path)
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        name = f"images/{digest[:16]}{path.suffix}"
+        self.assets[name] = path
+        return name
+
+
+def export_markdown(
+    blocks: List[dict], content: str, doc_path: Path, images_root: Path, bundle
+) -> str:
+    """
+    导出版文档：图表换成 block["source"] 指向的本地图片 + 折叠源码，
+    其余指向本地图片的链接（Raw URL 或相对路径）也改用 bundle 的写法
+    """
+
+    def relink(text: str) -> str:
+        def replace(m: re.Match) -> str:
+            target = m.group(1) or m.group(2)
+            rel = resolve_image_ref(doc_path, target, images_root)
+            if rel is not None:
+                source = images_root / rel
+            elif "://" in target or target.startswith("data:"):
+                return m.group(0)
+            else:
+                source = doc_path.parent / unquote(target.split("#")[0].split("?")[0])
+            if not source.is_file():
+                return m.group(0)
+            return m.group(0).replace(target, bundle.link(source), 1)
+
+        return IMAGE_LINK_RE.sub(replace, text)
+
+    newline = "\r\n" if "\r\n" in content else "\n"
+    segments = []
+    pos = 0
+    for block in blocks:
+        if not block["ok"]:
+            continue
+        segments.append(relink(content[pos : block["start"]]))
+        segments.append(
+            render_published_block(block, bundle.link(block["source"]), newline)
+        )
+        pos = block["end"]
+    segments.append(relink(content[pos:]))
+    return "".join(segments)
+
+
+def write_bundle(name: str, content: str, bundle: Bundle, out_dir: Path) -> Path:
+    """按导出方式写出文档，返回写出的路径"""
+    if bundle.mode == "dir":
+        target = out_dir / name
+        shutil.rmtree(target / "images", ignore_errors=True)
+        for asset, source in bundle.assets.items():
+            (target / asset).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target / asset)
+        write_text_atomic(target / f"{name}.md", content)
+        return target
+
+    if bundle.mode == "zip":
+        target = out_dir / f"{name}.zip"
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.tmp")
+        with zipfile.ZipFile(tmp_path, "w") as zf:
+            info = zipfile.ZipInfo(f"{name}.md", ZIP_TIMESTAMP)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, content.encode("utf-8"))
+            # 图片本身已经压缩过，直接存储
+            for asset, source in sorted(bundle.assets.items()):
+                zf.writestr(zipfile.ZipInfo(asset, ZIP_TIMESTAMP), source.read_bytes())
+        os.replace(tmp_path, target)
+        return target
+
+    target = out_dir / f"{name}.md"
+    write_text_atomic(target, content)
+    return target
+
+
+# ==================== 监听预览 ====================
+
+# 一次保存常伴随多个事件（写临时文件、rename、格式化插件再写一次），
+# 最后一个事件之后安静这么久才开始处理
+DEBOUNCE_SECONDS = 0.3
+POLL_INTERVAL = 0.5
+
+# inotify 事件：写完关闭、移入（编辑器原子保存）、新建
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def preview_markdown(blocks: List[dict], content: str) -> str:
+    """预览版文档：渲染成功的图表换成本地图片 + 折叠源码，失败的保持原样"""
+    newline = "\r\n" if "\r\n" in content else "\n"
+    segments = []
+    pos = 0
+    for block in blocks:
+        if not block["ok"]:
+            continue
+        segments.append(content[pos : block["start"]])
+        segments.append(render_published_block(block, block["rel_path"], newline))
+        pos = block["end"]
+    segments.append(content[pos:])
+    return "".join(segments)
+
+
+class InotifyWatcher:
+    """
+    Linux inotify（通过 ctypes 调用 libc），没有事件时不占 CPU
+    inotify 不递归，根目录下的每个子目录各占一个 watch，新建的子目录会自动加入
+    """
+
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.dirs = {}  # watch 描述符 → (根目录, 目录)
+        try:
+            for root in roots:
+                for directory, _ in walk_root(root):
+                    self.add_watch(root, directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, root: dict, directory: Path) -> None:
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监听 {directory}")
+        self.dirs[wd] = (root, directory)
+
+    def read_events(self) -> set:
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                pos += INOTIFY_EVENT.size
+                name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+                pos += length
+                if wd not in self.dirs:
+                    continue
+                root, directory = self.dirs[wd]
+                path = directory / name
+                if mask & IN_ISDIR:
+                    rel = root_relpath(root, path)
+                    if not name.startswith(".") and not root["exclude"].match(
+                        rel + "/"
+                    ):
+                        with contextlib.suppress(OSError):
+                            self.add_watch(root, path)
+                elif root_matches(root, path):
+                    changed.add(path)
+
+    def wait(self, timeout: Optional[float]) -> set:
+        """等待最多 timeout 秒（None 表示一直等），返回有变化的文档"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        return self.read_events() if ready else set()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """轮询 (mtime_ns, size)，用于非 Linux 平台或 inotify 不可用时"""
+
+    def __init__(self, roots, interval: float = POLL_INTERVAL):
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict:
+        snapshot = {}
+        for root in self.roots:
+            for path in iter_root_documents(root):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout: Optional[float]) -> set:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+            snapshot = self.scan()
+            changed = {p for p, key in snapshot.items() if self.snapshot.get(p) != key}
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(roots, polling: bool = False):
+    """Linux 上优先用 inotify，失败时回退到轮询"""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️  inotify 不可用（{e}），改用轮询")
+    return PollingWatcher(roots)
+
+
+def watch(
+    publisher: Publisher,
+    debounce: float = DEBOUNCE_SECONDS,
+    polling: bool = False,
+) -> int:
+    """
+    监听 publisher.roots 下（递归，按 include / exclude 过滤）的 Markdown，保存后只重新提取该文档、
+    只渲染源码有变化的图表，预览写到 PREVIEW_DIR，原文档不改动
+    """
+    watcher = make_watcher(publisher.roots, polling)
+    kind = "inotify" if isinstance(watcher, InotifyWatcher) else "轮询"
+    roots = ", ".join(str(root["path"]) for root in publisher.roots)
+    print(f"👀 监听 {roots}（{kind}），预览输出到 {PREVIEW_DIR}，Ctrl-C 退出\n")
+
+    try:
+        while True:
+            changed = watcher.wait(None)
+            # 去抖：等到连续 debounce 秒没有新事件再处理这一批
+            while True:
+                more = watcher.wait(debounce)
+                if not more:
+                    break
+                changed |= more
+            for doc_path in sorted(changed):
+                if doc_path.exists():
+                    publisher.preview(doc_path)
+                    print()
+    except KeyboardInterrupt:
+        print("\n👋 已停止监听")
+    finally:
+        watcher.close()
+    return 0
 
 
 def main():
@@ -542,28 +4248,335 @@ def main():
   # 仅生成图片（不提交推送）
   python tools/knowledge_publisher.py --all
   python tools/knowledge_publisher.py knowledge/xxx.md
+
+  # 重新生成 README / 命令索引里的文档目录
+  python tools/knowledge_publisher.py --catalog
         """,
     )
 
     parser.add_argument("files", nargs="*", help="要处理的 Markdown 文件")
     parser.add_argument(
-        "--all", action="store_true", help="处理 knowledge/ 目录下所有 .md 文件"
+        "--all",
+        action="store_true",
+        help="处理根目录（默认 knowledge/）下所有 .md 文件",
     )
     parser.add_argument(
         "--publish",
         action="store_true",
         help="完整发布流程（检测 → 生成 → 提交 → 推送）",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="增量发布：只处理 Git 检测到变更的文档",
+    )
+    parser.add_argument(
+        "--since",
+        metavar="REF",
+        help="增量发布的基准 ref（默认对比 HEAD），隐含 --incremental",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="发布前先用 knowledge_validator 校验文档，有 error 时不发布",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="丢弃上次中断留下的发布日志，从头开始（默认从断点继续，已提交未推送的只重试推送）",
+    )
+    parser.add_argument(
+        "--root",
+        action="append",
+        metavar="DIR[=IMAGES]",
+        help="文档根目录（可重复，递归处理），图片写到 IMAGES（默认 DIR/images）；默认只处理 knowledge",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help=f"根目录下要处理的文档（可重复，相对根目录，支持 **，默认 {' '.join(DEFAULT_INCLUDE)}）",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="GLOB",
+        help=f"根目录下要跳过的路径（可重复，总是跳过 {' '.join(DEFAULT_EXCLUDE)} 和隐藏目录）",
+    )
+    parser.add_argument(
+        "--renderer",
+        choices=sorted(RENDERERS),
+        default="batch",
+        help="渲染后端：batch=整批共用一个 mmdc 进程（默认），spawn=每个图表单独启动",
+    )
+    parser.add_argument(
+        "--format",
+        choices=IMAGE_FORMATS,
+        default="png",
+        help="图片格式：png（默认）、webp（需要 Pillow）、svg（mmdc 原生输出）",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="渲染后优化图片：调色板量化 + 无损重压缩 + 去除元数据（需要 Pillow）",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=IMAGE_LAYOUTS,
+        default="shared",
+        help="图片布局：shared=内容寻址共享存储（默认），doc=按文档分目录（旧布局）",
+    )
+    parser.add_argument(
+        "--migrate-images",
+        action="store_true",
+        help="一次性迁移：把已发布图片移动到 --layout 对应的路径并改写链接",
+    )
+    parser.add_argument(
+        "--gc",
+        action="store_true",
+        help="列出 knowledge/images/ 下未被任何 Markdown 引用的图片",
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="与 --gc 一起使用：删除未引用的图片",
+    )
+    parser.add_argument(
+        "--export",
+        action="store_true",
+        help="离线导出指定文档（或 --all）：每个文档一个自包含的包，供飞书导入，不依赖推送",
+    )
+    parser.add_argument(
+        "--bundle",
+        choices=BUNDLE_MODES,
+        default="dir",
+        help=(
+            "与 --export 一起使用：dir=Markdown + images/ 目录（默认），zip=单个压缩包，"
+            "inline=图片内联为 data URI，pinned=图片链接固定到 HEAD commit"
+        ),
+    )
+    parser.add_argument(
+        "--export-dir",
+        default=str(EXPORT_DIR),
+        metavar="DIR",
+        help=f"与 --export 一起使用：输出目录（默认 {EXPORT_DIR}）",
+    )
+    parser.add_argument(
+        "--assets-branch",
+        metavar="BRANCH",
+        help="图片写进资源分支 BRANCH（孤儿分支，用 git 底层命令写入，不检出），链接指向该分支，主分支只提交文档",
+    )
+    parser.add_argument(
+        "--prune-assets",
+        action="store_true",
+        help="与 --assets-branch 一起使用：重写资源分支，只保留仍被引用的图片并强制推送",
+    )
+    parser.add_argument(
+        "--catalog",
+        action="store_true",
+        help="从文档清单重新生成 README 的 Knowledge Base 表格和 .cursor/commands/index.md 的目录",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="与 --catalog 一起使用：只检查目录是否过期（过期时返回 1，不写文件）",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="并发渲染的 mmdc 进程数（默认 1）",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help=(
+            f"单个图表的渲染超时下限（默认 {DEFAULT_TIMEOUT}s），"
+            f"大图按行数放宽到 {TIMEOUT_BASE}s + 每行 {TIMEOUT_PER_LINE}s"
+        ),
+    )
+    parser.add_argument(
+        "--no-precheck",
+        action="store_true",
+        help="跳过渲染前的 Mermaid 语法预检查",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="监听 knowledge/，保存后只渲染有变化的图表，预览写到 .cache/knowledge_publisher/preview/（不改原文档）",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="与 --watch 一起使用：强制轮询（默认 Linux 用 inotify，其他平台轮询）",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEBOUNCE_SECONDS,
+        help=f"与 --watch 一起使用：最后一次保存后等待多久再渲染（默认 {DEBOUNCE_SECONDS}s）",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="作为常驻服务运行（JSON-RPC 2.0，每行一个请求），默认走 stdio，配合 --socket 监听 Unix socket",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        nargs="?",
+        const=str(DEFAULT_SOCKET),
+        help=(
+            f"Unix socket 路径（默认 {DEFAULT_SOCKET}）；与 --serve 一起使用时在此监听，"
+            "否则把 --publish / --all / <files> 转发给该服务，服务未运行时在本进程执行"
+        ),
+    )
+
+    parser.add_argument(
+        "--trace-json",
+        metavar="PATH",
+        help="记录各阶段耗时，输出 JSON 汇总（按 span 路径聚合）",
+    )
+    parser.add_argument(
+        "--trace-chrome",
+        metavar="PATH",
+        help="记录各阶段耗时，输出 Chrome trace-event 文件（chrome://tracing / Perfetto）",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="用 cProfile 运行，把统计写入 PATH 并打印累计耗时前 20 的函数",
+    )
 
     args = parser.parse_args()
 
+    tracer = enable_tracing() if args.trace_json or args.trace_chrome else None
+
+    if args.profile:
+        # 只在需要时导入：转发给常驻服务的调用要尽量少付启动开销
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        code = profiler.runcall(run, args, parser)
+        profiler.dump_stats(args.profile)
+        print(f"\n🔬 cProfile 统计已写入 {args.profile}（累计耗时前 20）")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    else:
+        code = run(args, parser)
+
+    if tracer is not None:
+        tracer.report()
+        if args.trace_json:
+            write_json_atomic(Path(args.trace_json), tracer.summary())
+            print(f"📈 阶段耗时汇总: {args.trace_json}")
+        if args.trace_chrome:
+            write_json_atomic(Path(args.trace_chrome), tracer.chrome_trace())
+            print(f"📈 Chrome trace: {args.trace_chrome}")
+
+    sys.exit(code)
+
+
+def run(args: argparse.Namespace, parser: argparse.ArgumentParser) -> int:
+    """按命令行参数执行对应模式，返回退出码"""
+    if not configure_output(args.format, args.optimize, args.layout):
+        return 1
+
+    roots = None
+    if args.root or args.include or args.exclude:
+        roots = [
+            parse_root_spec(spec, args.include, args.exclude)
+            for spec in args.root or ["knowledge"]
+        ]
+
+    publisher = Publisher(
+        roots=roots,
+        renderer=args.renderer,
+        jobs=args.jobs,
+        timeout=args.timeout,
+        precheck=not args.no_precheck,
+        assets_branch=args.assets_branch,
+    )
+
+    # 迁移已有图片到当前布局（各根目录的图片留在各自的图片目录）
+    if args.migrate_images:
+        return migrate_images(publisher.documents(), RenderCache(), publisher.roots)
+
+    # 常驻服务：渲染后端、渲染缓存和文档清单在请求之间保持
+    if args.serve:
+        service = PublisherService(publisher)
+        if args.socket:
+            return serve_socket(service, Path(args.socket))
+        return serve_stdio(service)
+
+    # 回收未引用的图片（各根目录的图片目录）
+    if args.gc:
+        return collect_garbage(
+            args.delete, publisher.images_roots(), publisher.manifest
+        )
+
+    # 重写资源分支，回收不再被引用的图片
+    if args.prune_assets:
+        if not args.assets_branch:
+            print("❌ --prune-assets 需要同时指定 --assets-branch\n")
+            return 1
+        return prune_assets(
+            publisher.images_roots(),
+            default_remote(),
+            args.assets_branch,
+            publisher.manifest,
+        )
+
+    # 重新生成目录
+    if args.catalog:
+        return update_catalog(publisher.roots, publisher.manifest, args.check)
+
+    # 监听模式：保存即预览
+    if args.watch:
+        return watch(publisher, args.debounce, args.poll)
+
+    # 已有服务在运行时，把本次调用转发过去（省掉启动和检查开销）
+    if args.socket and (args.publish or args.all or args.files):
+        if args.publish:
+            method, params = "publish", {
+                "incremental": args.incremental,
+                "since": args.since,
+                "validate": args.validate,
+                "resume": not args.no_resume,
+            }
+        else:
+            method, params = "build", {"all": args.all, "files": args.files}
+        code = forward_to_service(Path(args.socket), method, params, publisher.config())
+        if code is not None:
+            return code
+
+    # 离线导出：每个文档一个自包含的包，导入时不依赖推送
+    if args.export:
+        if not (args.all or args.files):
+            print("❌ --export 需要指定文档或 --all\n")
+            return 1
+        doc_files = publisher.documents() if args.all else [Path(f) for f in args.files]
+        return publisher.export(doc_files, args.bundle, Path(args.export_dir))
+
     # 模式 1: 完整发布流程
     if args.publish:
-        sys.exit(publish())
+        try:
+            return publisher.publish(
+                incremental=args.incremental,
+                base_ref=args.since,
+                validate=args.validate,
+                resume=not args.no_resume,
+            )
+        except KeyboardInterrupt:
+            print("\n⏹️  发布已中断，重新运行 --publish 从断点继续")
+            return 130
 
     # 模式 2: 仅生成图片
     if args.all:
-        doc_files = list(Path("knowledge").glob("*.md"))
+        doc_files = publisher.documents()
     elif args.files:
         doc_files = [Path(f) for f in args.files]
     else:
@@ -572,9 +4585,9 @@ def main():
         print("  --all            处理所有文档")
         print("  <files>          处理指定文档\n")
         parser.print_help()
-        sys.exit(1)
+        return 1
 
-    sys.exit(build_only(doc_files))
+    return publisher.build(doc_files)
 
 
 if __name__ == "__main__":
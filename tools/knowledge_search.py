@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+Knowledge Search - 知识库全文检索
+
+这是一个 Tool，被 Cursor Skills（search-knowledge）调用：
+按问题检索最相关的章节，只把这些章节放进上下文，而不是整篇文档。
+
+索引设计：
+  - 分词：中文按相邻两字（bigram），单字成词；英文/数字按单词（小写）
+  - 以章节为检索单位：按标题切分（跳过代码块里的 #），标题词加权
+  - 排序：BM25（k1=1.2, b=0.75）
+  - 增量更新：按 (mtime, size) → 内容哈希判断文件是否变化，只重新分词变化的文档；
+    也可以用 --since REF 只检查 Git 变更的文件
+  - 紧凑存储：倒排表用 varint 差值编码写成一个二进制文件，词表排序后二分查找，
+    查询时只解码命中词的倒排表；文档没变时查询只需要一次 stat 检查
+
+存储位置（不提交）：
+  .cache/knowledge_search/index.bin   倒排索引（查询只读这个文件）
+  .cache/knowledge_search/docs.json   每个文档的章节与词频（增量更新用）
+
+使用示例：
+  # 建立/增量更新索引（默认 knowledge/ 和 agent-client/）
+  python tools/knowledge_search.py index
+  python tools/knowledge_search.py index --rebuild
+  python tools/knowledge_search.py index --since origin/main
+
+  # 检索（查询前自动增量更新）
+  python tools/knowledge_search.py query "WebSocket 心跳"
+  python tools/knowledge_search.py query "状态机 重试" -k 3 --json --content
+"""
+
+import argparse
+import array
+import bisect
+import hashlib
+import json
+import math
+import re
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import knowledge_publisher as kp
+import knowledge_validator as kv
+
+# ==================== 配置 ====================
+
+SEARCH_ROOTS = kv.VALIDATE_ROOTS
+
+INDEX_DIR = Path(".cache/knowledge_search")
+INDEX_FILE = INDEX_DIR / "index.bin"
+DOCS_FILE = INDEX_DIR / "docs.json"
+
+INDEX_MAGIC = b"KSIDX\x01"
+
+# 分词规则有变化时递增，旧索引自动重建
+TOKENIZER_VERSION = 1
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 标题中的词按这个倍数计入词频
+HEADING_WEIGHT = 3
+
+# --content 时每个章节最多返回的字符数
+MAX_SECTION_CHARS = 4000
+
+# ==================== 分词 ====================
+
+CJK_RANGES = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+TOKEN_RE = re.compile(rf"[{CJK_RANGES}]+|[a-z0-9]+")
+CJK_RE = re.compile(rf"[{CJK_RANGES}]")
+
+# 不参与分词的噪声：URL、HTML 标签、图片链接
+NOISE_RE = re.compile(r"https?://\S+|<[^>\n]+>|!\[[^\]\n]*\]\([^)\n]*\)")
+
+
+def tokenize(text: str) -> List[str]:
+    """中文 bigram（单字成词）+ 英文单词，全部小写"""
+    tokens = []
+    for run in TOKEN_RE.findall(NOISE_RE.sub(" ", text).lower()):
+        if not CJK_RE.match(run):
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+# ==================== 章节切分 ====================
+
+
+def split_sections(content: str, title: str) -> List[dict]:
+    """
+    按标题把文档切成章节，代码块中的 # 不算标题
+    每个章节: heading（含上级标题的路径）、anchor、line/end_line、terms（词频）
+    """
+    lines = content.split("\n")
+    in_fence = [False] * (len(lines) + 1)
+    for fence in kp.scan_fences(content):
+        last = fence["line"] + content.count("\n", fence["start"], fence["end"])
+        for n in range(fence["line"], min(last, len(lines)) + 1):
+            in_fence[n] = True
+
+    sections = []
+    parents = []
+    seen = {}
+    current = {"heading": title, "anchor": "", "line": 1, "text": []}
+
+    def flush(end_line: int) -> None:
+        body = "\n".join(current.pop("text"))
+        terms = {}
+        for token in tokenize(body):
+            terms[token] = terms.get(token, 0) + 1
+        for token in tokenize(current["heading"]):
+            terms[token] = terms.get(token, 0) + HEADING_WEIGHT
+        if terms:
+            current["end_line"] = end_line
+            current["length"] = sum(terms.values())
+            current["terms"] = terms
+            sections.append(current)
+
+    for n, line in enumerate(lines, 1):
+        m = None if in_fence[n] else kv.HEADING_RE.match(line)
+        if not m:
+            current["text"].append(line)
+            continue
+
+        flush(n - 1)
+        level, text = len(m.group(1)), m.group(2).strip()
+        slug = kv.heading_slug(text)
+        count = seen.get(slug, 0)
+        seen[slug] = count + 1
+
+        parents = [p for p in parents if p[0] < level] + [(level, text)]
+        current = {
+            "heading": " > ".join(p[1] for p in parents),
+            "anchor": f"{slug}-{count}" if count else slug,
+            "line": n,
+            "text": [],
+        }
+
+    flush(len(lines))
+    return sections
+
+
+# ==================== 倒排表编码 ====================
+
+
+def encode_varints(values: List[int]) -> bytes:
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data: bytes) -> List[int]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+# ==================== 索引构建 ====================
+
+
+def load_docs(rebuild: bool = False) -> dict:
+    """增量更新用的文档缓存：{path: {sha256, mtime_ns, size, sections}}"""
+    if rebuild:
+        return {}
+    try:
+        data = json.loads(DOCS_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != TOKENIZER_VERSION:
+        return {}
+    return data.get("docs", {})
+
+
+def iter_sources(roots) -> List[Path]:
+    return kv.iter_documents([root for root in roots if root.exists()])
+
+
+def refresh_docs(docs: dict, paths: List[Path], all_paths: set) -> int:
+    """
+    重新分词 paths 中内容有变化的文档，删除已不存在的文档
+    返回变化的文档数
+    """
+    changed = 0
+    for key in [k for k in docs if k not in all_paths]:
+        del docs[key]
+        changed += 1
+
+    for path in paths:
+        key = path.as_posix()
+        entry = docs.get(key)
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if entry and (entry["mtime_ns"], entry["size"]) == (
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            continue
+
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if not entry or entry["sha256"] != digest:
+            sections = split_sections(data.decode("utf-8", "replace"), path.stem)
+            entry = {"sha256": digest, "sections": sections}
+            changed += 1
+        entry["mtime_ns"] = stat.st_mtime_ns
+        entry["size"] = stat.st_size
+        docs[key] = entry
+    return changed
+
+
+def write_index(docs: dict, roots=SEARCH_ROOTS) -> None:
+    """
+    由文档缓存生成倒排索引文件（所有整数为小端 u32）：
+      magic | 头部长度 | 头部 JSON（索引范围、章节表、文件 stat）
+            | 词表长度 | 词表（排序后以 \\n 连接）| 词数 | 倒排表偏移数组（词数 + 1 项）
+            | 倒排表（varint: 章节号差值, 词频, ...）
+    查询时词表用二分查找，不需要构建字典
+    """
+    sections = []
+    postings: Dict[str, List[int]] = {}
+    for path in sorted(docs):
+        for section in docs[path]["sections"]:
+            sid = len(sections)
+            sections.append(
+                [
+                    path,
+                    section["heading"],
+                    section["anchor"],
+                    section["line"],
+                    section["end_line"],
+                    section["length"],
+                ]
+            )
+            for term, tf in section["terms"].items():
+                postings.setdefault(term, []).extend((sid, tf))
+
+    terms = sorted(postings)
+    offsets = array.array("I", [0])
+    blob = bytearray()
+    for term in terms:
+        pairs = postings[term]
+        values = []
+        prev = 0
+        for i in range(0, len(pairs), 2):
+            values += (pairs[i] - prev, pairs[i + 1])
+            prev = pairs[i]
+        blob += encode_varints(values)
+        offsets.append(len(blob))
+    if sys.byteorder != "little":
+        offsets.byteswap()
+
+    total = sum(s[5] for s in sections)
+    header = json.dumps(
+        {
+            "version": TOKENIZER_VERSION,
+            "roots": [Path(root).as_posix() for root in roots],
+            "avgdl": total / len(sections) if sections else 0,
+            "sections": sections,
+            "files": {p: [d["mtime_ns"], d["size"]] for p, d in docs.items()},
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    vocabulary = "\n".join(terms).encode("utf-8")
+
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = INDEX_FILE.with_name(f".{INDEX_FILE.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack("<I", len(header)) + header)
+        f.write(struct.pack("<I", len(vocabulary)) + vocabulary)
+        f.write(struct.pack("<I", len(terms)) + offsets.tobytes())
+        f.write(blob)
+    tmp_path.replace(INDEX_FILE)
+
+
+def update_index(
+    roots=SEARCH_ROOTS,
+    rebuild: bool = False,
+    since: Optional[str] = None,
+) -> dict:
+    """
+    增量更新索引，返回 {"docs", "changed", "seconds"}
+    since 为 Git ref 时只检查相对它有变更的文件（新增/删除仍会处理）
+    """
+    start = time.perf_counter()
+    docs = load_docs(rebuild)
+    all_paths = iter_sources(roots)
+    keys = {p.as_posix() for p in all_paths}
+
+    paths = all_paths
+    if since is not None and docs:
+        changed_files = kp.git_changed_files(since)
+        if changed_files is not None:
+            candidates = {p.as_posix() for p in changed_files} | (keys - set(docs))
+            paths = [p for p in all_paths if p.as_posix() in candidates]
+
+    before = {k: (d["mtime_ns"], d["size"]) for k, d in docs.items()}
+    changed = refresh_docs(docs, paths, keys)
+    after = {k: (d["mtime_ns"], d["size"]) for k, d in docs.items()}
+
+    # 内容变化才重建倒排表；只有 stat 变化或索引范围变化时也重写，让查询端的新鲜度检查保持准确
+    if (
+        changed
+        or rebuild
+        or before != after
+        or not INDEX_FILE.exists()
+        or indexed_roots() != [Path(root) for root in roots]
+    ):
+        write_index(docs, roots)
+        kp.write_json_atomic(DOCS_FILE, {"version": TOKENIZER_VERSION, "docs": docs})
+
+    return {
+        "docs": len(docs),
+        "changed": changed,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def indexed_roots() -> Optional[List[Path]]:
+    """已有索引记录的索引范围，索引不存在或无法读取时返回 None"""
+    try:
+        return SearchIndex().roots
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+# ==================== 查询 ====================
+
+
+class SearchIndex:
+    """只读打开倒排索引：头部一次解析，词表二分查找，倒排表按需解码"""
+
+    def __init__(self, path: Path = INDEX_FILE):
+        data = path.read_bytes()
+        if not data.startswith(INDEX_MAGIC):
+            raise ValueError(f"不是有效的索引文件: {path}")
+        pos = len(INDEX_MAGIC)
+
+        (size,) = struct.unpack_from("<I", data, pos)
+        header = json.loads(data[pos + 4 : pos + 4 + size])
+        pos += 4 + size
+        if header["version"] != TOKENIZER_VERSION:
+            raise ValueError("索引版本不匹配，请重建索引")
+
+        (size,) = struct.unpack_from("<I", data, pos)
+        vocabulary = data[pos + 4 : pos + 4 + size].decode("utf-8")
+        self.terms = vocabulary.split("\n") if vocabulary else []
+        pos += 4 + size
+
+        (count,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        self.offsets = array.array("I")
+        self.offsets.frombytes(data[pos : pos + 4 * (count + 1)])
+        if sys.byteorder != "little":
+            self.offsets.byteswap()
+        pos += 4 * (count + 1)
+
+        self.blob = memoryview(data)[pos:]
+        self.sections = header["sections"]
+        self.files = header["files"]
+        # 旧索引没有记录范围，按默认范围处理
+        self.roots = [Path(root) for root in header.get("roots", SEARCH_ROOTS)]
+        self.avgdl = header["avgdl"] or 1
+
+    def is_fresh(self) -> bool:
+        """索引范围内的文件 stat 与索引中记录的一致（只做 stat，不读文件）"""
+        current = {}
+        for path in iter_sources(self.roots):
+            try:
+                stat = path.stat()
+            except OSError:
+                return False
+            current[path.as_posix()] = [stat.st_mtime_ns, stat.st_size]
+        return current == self.files
+
+    def postings(self, term: str) -> List[tuple]:
+        """[(章节号, 词频), ...]"""
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return []
+        values = decode_varints(self.blob[self.offsets[i] : self.offsets[i + 1]])
+        result = []
+        sid = 0
+        for j in range(0, len(values), 2):
+            sid += values[j]
+            result.append((sid, values[j + 1]))
+        return result
+
+    def search(self, query: str, limit: int = 5) -> List[dict]:
+        """BM25 排序，返回前 limit 个章节"""
+        n = len(self.sections)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for sid, tf in postings:
+                norm = BM25_K1 * (
+                    1 - BM25_B + BM25_B * self.sections[sid][5] / self.avgdl
+                )
+                scores[sid] = scores.get(sid, 0.0) + idf * tf * (BM25_K1 + 1) / (
+                    tf + norm
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        results = []
+        for sid, score in ranked[:limit]:
+            path, heading, anchor, line, end_line, _ = self.sections[sid]
+            results.append(
+                {
+                    "path": path,
+                    "heading": heading,
+                    "anchor": anchor,
+                    "line": line,
+                    "end_line": end_line,
+                    "score": round(score, 4),
+                }
+            )
+        return results
+
+
+def section_text(result: dict, max_chars: int = MAX_SECTION_CHARS) -> str:
+    """读取章节原文（按行号截取），超过 max_chars 时截断"""
+    try:
+        lines = Path(result["path"]).read_text(encoding="utf-8").split("\n")
+    except OSError:
+        return ""
+    text = "\n".join(lines[result["line"] - 1 : result["end_line"]]).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + "\n…"
+    return text
+
+
+def snippet(text: str, query: str, width: int = 80) -> str:
+    """章节中第一处包含查询词的行（去掉 Markdown 标记）"""
+    terms = set(tokenize(query))
+    for line in text.split("\n")[1:]:
+        if terms & set(tokenize(line)):
+            line = re.sub(r"[#>*`|]+", " ", line)
+            line = " ".join(line.split())
+            return line if len(line) <= width else line[:width] + "…"
+    return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Knowledge Search - 知识库全文检索",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  python tools/knowledge_search.py index
+  python tools/knowledge_search.py query "WebSocket 心跳" -k 3 --json --content
+        """,
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_index = sub.add_parser("index", help="建立/增量更新索引")
+    p_index.add_argument(
+        "roots",
+        nargs="*",
+        type=Path,
+        help="索引范围（默认 knowledge/ 和 agent-client/）",
+    )
+    p_index.add_argument("--rebuild", action="store_true", help="丢弃旧索引全量重建")
+    p_index.add_argument(
+        "--since", metavar="REF", help="只检查相对 REF 有 Git 变更的文件"
+    )
+
+    p_query = sub.add_parser("query", help="检索章节")
+    p_query.add_argument("query", help="查询内容（中英文均可）")
+    p_query.add_argument("-k", type=int, default=5, help="返回章节数（默认 5）")
+    p_query.add_argument("--json", action="store_true", help="输出 JSON")
+    p_query.add_argument(
+        "--content", action="store_true", help="同时返回章节原文（供 Skill 放入上下文）"
+    )
+    p_query.add_argument(
+        "--max-chars",
+        type=int,
+        default=MAX_SECTION_CHARS,
+        help=f"--content 时每个章节的最大字符数（默认 {MAX_SECTION_CHARS}）",
+    )
+    p_query.add_argument(
+        "--no-update", action="store_true", help="查询前不检查文档变化"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "index":
+        stats = update_index(args.roots or SEARCH_ROOTS, args.rebuild, args.since)
+        print(
+            f"✅ 索引 {stats['docs']} 个文档，更新 {stats['changed']} 个，"
+            f"耗时 {stats['seconds']}s"
+        )
+        print(f"📁 {INDEX_FILE}（{INDEX_FILE.stat().st_size:,} bytes）")
+        sys.exit(0)
+
+    start = time.perf_counter()
+    index = SearchIndex() if INDEX_FILE.exists() else None
+    if index is None or (not args.no_update and not index.is_fresh()):
+        # 沿用上次 index 命令指定的范围，避免查询时把索引改回默认范围
+        update_index(index.roots if index else SEARCH_ROOTS)
+        index = SearchIndex()
+    results = index.search(args.query, args.k)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        text = section_text(result, args.max_chars)
+        result["snippet"] = snippet(text, args.query)
+        if args.content:
+            result["content"] = text
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "query": args.query,
+                    "ms": round(elapsed * 1000, 2),
+                    "results": results,
+                },
+                ensure_ascii=False,
+                indent=1,
+            )
+        )
+        sys.exit(0)
+
+    if not results:
+        print(f"ℹ️  没有找到与「{args.query}」相关的章节")
+        sys.exit(1)
+
+    print(f"🔍 「{args.query}」共 {len(results)} 个结果（{elapsed * 1000:.1f} ms）\n")
+    for n, result in enumerate(results, 1):
+        anchor = f"#{result['anchor']}" if result["anchor"] else ""
+        print(f"{n}. {result['heading']}  ({result['score']:.2f})")
+        print(f"   {result['path']}:{result['line']}{anchor and '  ' + anchor}")
+        if result["snippet"]:
+            print(f"   {result['snippet']}")
+        if args.content:
+            print()
+            print(result["content"])
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Knowledge Validator - 知识文档校验工具
+
+这是一个 Tool，被 Cursor Skills（validate-knowledge）调用，
+也可以作为发布前的检查关卡（knowledge_publisher.py --publish --validate）。
+
+校验规则来自 generate-learning-doc / technical-writing-quality：
+  - 代码块：长度 ≤25 行、必须有语言标签、伪代码标注 (Pseudocode)、围栏必须闭合
+  - 必要章节（仅 knowledge/ 下的学习文档）：TL;DR、反模式/误区、checklist
+  - Mermaid：复用 knowledge_publisher.lint_mermaid 预检查（图表类型、括号/引号、
+    subgraph/块与 end 配对、箭头写法）
+  - 链接：本地文件/图片必须存在、文内锚点必须对应标题、空链接、http 明文链接
+
+性能设计：
+  - Markdown 扫描复用 knowledge_publisher.scan_fences（单遍围栏扫描）
+  - 按文件内容哈希缓存诊断结果（.cache/knowledge_validator/），
+    未变化的文件只需要一次 stat；跨文件的链接存在性每次重新检查（只是 stat）
+  - 需要重新校验的文件多时用进程池并行
+
+使用示例：
+  # 校验 knowledge/ 和 agent-client/ 下的所有文档
+  python tools/knowledge_validator.py
+
+  # 只校验指定文档，输出 JSON（供 Skill 解析）
+  python tools/knowledge_validator.py knowledge/xxx.md --json
+
+  # 警告也视为失败；忽略缓存
+  python tools/knowledge_validator.py --strict --no-cache
+
+  # 列出所有规则
+  python tools/knowledge_validator.py --list-rules
+
+退出码：0=通过，1=存在 error（--strict 时 warning 也算）
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import unquote
+
+import knowledge_publisher as kp
+
+# ==================== 配置 ====================
+
+# 默认校验范围
+VALIDATE_ROOTS = (Path("knowledge"), Path("agent-client"))
+
+# 校验图片链接用的根目录：和发布器一样，每个根目录的图片在 {根目录}/images
+DOCUMENT_ROOTS = tuple(kp.make_root(root) for root in VALIDATE_ROOTS)
+
+# 只有这些目录下的文档要求 TL;DR / 反模式 / checklist 章节
+LEARNING_DOC_ROOTS = (Path("knowledge"),)
+
+CACHE_FILE = Path(".cache/knowledge_validator/cache.json")
+
+
+MAX_CODE_LINES = 25
+
+# 需要重新校验的文件数不少于这个值时才启用进程池（进程启动本身有开销）
+PARALLEL_THRESHOLD = 8
+
+# 规则编号 → (级别, 说明)
+RULES = {
+    "code-too-long": ("warning", f"代码块超过 {MAX_CODE_LINES} 行"),
+    "code-no-lang": ("warning", "代码块缺少语言标签"),
+    "pseudocode-label": ("warning", "伪代码未标注 (Pseudocode)"),
+    "fence-unclosed": ("error", "代码块围栏未闭合"),
+    "missing-tldr": ("warning", "缺少 TL;DR"),
+    "missing-antipatterns": ("warning", "缺少反模式/误区章节"),
+    "missing-checklist": ("warning", "缺少可验证的 checklist"),
+    "mermaid-syntax": ("error", "Mermaid 语法错误"),
+    "link-empty": ("error", "链接目标为空"),
+    "link-missing": ("error", "链接指向的本地文件不存在"),
+    "image-missing": ("error", "图片文件不存在"),
+    "anchor-missing": ("warning", "文内锚点没有对应的标题"),
+    "link-insecure": ("warning", "使用了 http:// 明文链接"),
+}
+
+# ==================== 文本工具 ====================
+
+HEADING_RE = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.+?)[ \t#]*$")
+
+# [文本](目标) 和 ![alt](目标)，目标可用 <> 包裹，后面可带 "title"
+LINK_RE = re.compile(r"(!?)\[([^\]\n]*)\]\(\s*(<[^>\n]*>|[^)\s]*)[^)\n]*\)")
+HTML_IMG_RE = re.compile(r"<img\s[^>]*?src=[\"']([^\"']*)[\"']", re.IGNORECASE)
+INLINE_CODE_RE = re.compile(r"(`+)(?:(?!\1).)+?\1")
+
+PSEUDOCODE_HINT_RE = re.compile(r"伪代码|pseudo-?code", re.IGNORECASE)
+ELLIPSIS_LINE_RE = re.compile(r"^\s*(\.\.\.|…+)\s*$", re.MULTILINE)
+
+TLDR_RE = re.compile(r"TL;?DR", re.IGNORECASE)
+ANTIPATTERN_RE = re.compile(r"反模式|误区|反例|踩坑|anti-?patterns?", re.IGNORECASE)
+CHECKLIST_RE = re.compile(
+    r"checklist|检查清单|自检清单|清单|验收标准|^\s*[-*] \[[ xX]\]",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# TL;DR 必须出现在文档开头这么多行以内
+TLDR_WINDOW = 40
+
+
+def heading_slug(text: str) -> str:
+    """GitHub 风格的标题锚点：小写、去标点、空格转 -（保留中文）"""
+    text = re.sub(r"<[^>]+>", "", text)
+    text = re.sub(r"[`*_~]|\[([^\]]*)\]\([^)]*\)", r"\1", text)
+    slug = re.sub(r"[^\w\- ]", "", text.strip().lower())
+    return slug.replace(" ", "-")
+
+
+class LineIndex:
+    """偏移量 → 行号（二分查找换行符位置）"""
+
+    def __init__(self, content: str):
+        self.newlines = [m.start() for m in re.finditer("\n", content)]
+
+    def line(self, offset: int) -> int:
+        return bisect.bisect_left(self.newlines, offset) + 1
+
+
+def prose_segments(content: str, fences: List[dict]) -> List[Tuple[int, str]]:
+    """围栏之外的正文片段：[(起始偏移, 文本), ...]"""
+    segments = []
+    pos = 0
+    for fence in fences:
+        segments.append((pos, content[pos : fence["start"]]))
+        pos = fence["end"]
+    segments.append((pos, content[pos:]))
+    return segments
+
+
+def mask_inline_code(text: str) -> str:
+    """把行内代码替换为等长空格，避免其中的 [x](y) 被当作链接"""
+    return INLINE_CODE_RE.sub(lambda m: " " * len(m.group(0)), text)
+
+
+# ==================== 单文件规则 ====================
+
+
+def diagnostic(rule: str, line: int, message: str = "") -> dict:
+    severity, description = RULES[rule]
+    return {
+        "rule": rule,
+        "severity": severity,
+        "line": line,
+        "message": f"{description}: {message}" if message else description,
+    }
+
+
+def check_fences(fences: List[dict]) -> List[dict]:
+    diagnostics = []
+    for fence in fences:
+        line = fence["line"]
+        if not fence["closed"]:
+            diagnostics.append(diagnostic("fence-unclosed", line))
+
+        if fence["lang"] == "mermaid":
+            # 与发布器渲染前的预检查是同一套规则
+            for offset, message in kp.lint_mermaid(fence["code"]):
+                diagnostics.append(diagnostic("mermaid-syntax", line + offset, message))
+            continue
+
+        if not fence["info"]:
+            diagnostics.append(diagnostic("code-no-lang", line))
+
+        code_lines = fence["code"].rstrip("\n").count("\n") + 1
+        if code_lines > MAX_CODE_LINES:
+            diagnostics.append(diagnostic("code-too-long", line, f"{code_lines} 行"))
+
+        # 标注可以写在 info string（```python (Pseudocode)）或第一行注释里
+        first_line = fence["code"].lstrip().split("\n", 1)[0]
+        if (
+            fence["lang"] == "python"
+            and "(pseudocode)" not in (fence["info"] + first_line).lower()
+            and (
+                PSEUDOCODE_HINT_RE.search(fence["code"])
+                or ELLIPSIS_LINE_RE.search(fence["code"])
+            )
+        ):
+            diagnostics.append(diagnostic("pseudocode-label", line))
+
+    return diagnostics
+
+
+def check_sections(prose: str) -> List[dict]:
+    """学习文档的必要章节（在围栏之外的正文中查找）"""
+    diagnostics = []
+    head = "\n".join(prose.split("\n", TLDR_WINDOW)[:TLDR_WINDOW])
+    if not TLDR_RE.search(head):
+        diagnostics.append(diagnostic("missing-tldr", 1))
+    if not ANTIPATTERN_RE.search(prose):
+        diagnostics.append(diagnostic("missing-antipatterns", 1))
+    if not CHECKLIST_RE.search(prose):
+        diagnostics.append(diagnostic("missing-checklist", 1))
+    return diagnostics
+
+
+def collect_links(segments: List[Tuple[int, str]], index: LineIndex) -> List[dict]:
+    """正文中的所有链接和图片：[{line, target, image}]"""
+    links = []
+    for offset, text in segments:
+        text = mask_inline_code(text)
+        for m in LINK_RE.finditer(text):
+            links.append(
+                {
+                    "line": index.line(offset + m.start()),
+                    "target": m.group(3).strip("<>"),
+                    "image": m.group(1) == "!",
+                }
+            )
+        for m in HTML_IMG_RE.finditer(text):
+            links.append(
+                {
+                    "line": index.line(offset + m.start()),
+                    "target": m.group(1),
+                    "image": True,
+                }
+            )
+    return links
+
+
+def check_anchors(links: List[dict], anchors: set) -> List[dict]:
+    diagnostics = []
+    for link in links:
+        target = link["target"]
+        if target.startswith("#") and unquote(target[1:]).lower() not in anchors:
+            diagnostics.append(diagnostic("anchor-missing", link["line"], target))
+    return diagnostics
+
+
+def heading_anchors(segments: List[Tuple[int, str]]) -> set:
+    """文档中所有标题生成的锚点（重复标题依次追加 -1、-2）"""
+    anchors = set()
+    seen = {}
+    for _, text in segments:
+        for line in text.split("\n"):
+            m = HEADING_RE.match(line)
+            if not m:
+                continue
+            slug = heading_slug(m.group(2))
+            count = seen.get(slug, 0)
+            seen[slug] = count + 1
+            anchors.add(f"{slug}-{count}" if count else slug)
+    return anchors
+
+
+def lint_content(content: str, learning_doc: bool) -> dict:
+    """
+    只依赖文件内容的检查（结果可按内容哈希缓存）
+    返回 {"diagnostics": [...], "links": [...]}，links 留给跨文件检查
+    """
+    fences = kp.scan_fences(content)
+    segments = prose_segments(content, fences)
+    index = LineIndex(content)
+
+    diagnostics = check_fences(fences)
+    if learning_doc:
+        diagnostics += check_sections("".join(text for _, text in segments))
+
+    links = collect_links(segments, index)
+    diagnostics += check_anchors(links, heading_anchors(segments))
+
+    external = [l for l in links if not l["target"].startswith("#")]
+    return {"diagnostics": diagnostics, "links": external}
+
+
+# ==================== 跨文件规则 ====================
+
+
+def check_links(doc_path: Path, links: List[dict], roots=DOCUMENT_ROOTS) -> List[dict]:
+    """
+    链接目标的存在性（每次运行都重新检查，不进缓存）
+    图片链接按文档所属根目录的图片目录解析（见 kp.images_root_for）
+    """
+    images_root = kp.images_root_for(doc_path, roots)
+    diagnostics = []
+    for link in links:
+        target = link["target"]
+        line = link["line"]
+        if not target:
+            diagnostics.append(diagnostic("link-empty", line))
+            continue
+        if target.startswith("http://"):
+            diagnostics.append(diagnostic("link-insecure", line, target))
+
+        if link["image"]:
+            rel = kp.resolve_image_ref(doc_path, target, images_root)
+            if rel is not None and not (images_root / rel).exists():
+                diagnostics.append(diagnostic("image-missing", line, target))
+                continue
+
+        if re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:", target):
+            continue
+        path = unquote(target.split("#")[0].split("?")[0])
+        if not path:
+            continue
+        base = Path(".") if path.startswith("/") else doc_path.parent
+        if not (base / path.lstrip("/")).exists():
+            rule = "image-missing" if link["image"] else "link-missing"
+            diagnostics.append(diagnostic(rule, line, target))
+    return diagnostics
+
+
+# ==================== 缓存与调度 ====================
+
+
+def rules_version() -> str:
+    """规则版本 = 本工具和 knowledge_publisher（扫描器）源码的哈希，改规则后缓存自动失效"""
+    digest = hashlib.sha256()
+    for source in (__file__, kp.__file__):
+        digest.update(Path(source).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def load_cache(version: str) -> dict:
+    try:
+        data = json.loads(CACHE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != version:
+        return {}
+    return data.get("files", {})
+
+
+def is_learning_doc(doc_path: Path) -> bool:
+    return any(doc_path.parent == root for root in LEARNING_DOC_ROOTS)
+
+
+def lint_file(doc_path: str, learning_doc: bool) -> Tuple[str, Optional[dict]]:
+    """读取并检查单个文件（进程池的工作函数）"""
+    try:
+        data = Path(doc_path).read_bytes()
+        content = data.decode("utf-8")
+    except (OSError, UnicodeDecodeError) as e:
+        return doc_path, {"error": str(e)}
+    result = lint_content(content, learning_doc)
+    result["sha256"] = hashlib.sha256(data).hexdigest()
+    return doc_path, result
+
+
+def cached_result(doc_path: Path, entry: Optional[dict]) -> Optional[dict]:
+    """
+    先比较 (mtime, size)，一致时不读文件；
+    否则读文件算哈希，内容没变时更新 stat 后继续复用
+    """
+    if not entry:
+        return None
+    try:
+        stat = doc_path.stat()
+    except OSError:
+        return None
+    if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+        return entry
+    try:
+        digest = hashlib.sha256(doc_path.read_bytes()).hexdigest()
+    except OSError:
+        return None
+    if digest != entry["sha256"]:
+        return None
+    entry["mtime_ns"] = stat.st_mtime_ns
+    entry["size"] = stat.st_size
+    return entry
+
+
+def validate(
+    doc_paths: List[Path],
+    jobs: Optional[int] = None,
+    use_cache: bool = True,
+    roots=DOCUMENT_ROOTS,
+) -> dict:
+    """
+    校验一组文档，roots 决定各文档图片链接对应的图片目录，返回：
+      {"files": N, "cached": N, "errors": N, "warnings": N,
+       "diagnostics": [{path, line, severity, rule, message}, ...]}
+    """
+    version = rules_version()
+    cache = load_cache(version) if use_cache else {}
+    results = {}
+    pending = []
+
+    for doc_path in doc_paths:
+        key = doc_path.as_posix()
+        entry = cached_result(doc_path, cache.get(key))
+        if entry is not None:
+            results[key] = entry
+        else:
+            pending.append(key)
+
+    args = [(key, is_learning_doc(Path(key))) for key in pending]
+    if len(pending) >= PARALLEL_THRESHOLD and jobs != 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            linted = list(pool.map(lint_file, *zip(*args), chunksize=4))
+    else:
+        linted = [lint_file(*a) for a in args]
+
+    for key, result in linted:
+        if "error" not in result:
+            stat = Path(key).stat()
+            result["mtime_ns"] = stat.st_mtime_ns
+            result["size"] = stat.st_size
+        results[key] = result
+
+    if use_cache:
+        # 保留其他文件的缓存（只校验部分文档时不丢失），去掉已删除的文件
+        files = {k: v for k, v in cache.items() if k in results or Path(k).exists()}
+        files.update((k, v) for k, v in results.items() if "error" not in v)
+        kp.write_json_atomic(CACHE_FILE, {"version": version, "files": files})
+
+    diagnostics = []
+    for doc_path in doc_paths:
+        key = doc_path.as_posix()
+        result = results[key]
+        if "error" in result:
+            diagnostics.append(
+                {
+                    "path": key,
+                    "line": 1,
+                    "severity": "error",
+                    "rule": "read-error",
+                    "message": f"读取文件失败: {result['error']}",
+                }
+            )
+            continue
+        found = result["diagnostics"] + check_links(doc_path, result["links"], roots)
+        for d in sorted(found, key=lambda d: (d["line"], d["rule"])):
+            diagnostics.append({"path": key, **d})
+
+    return {
+        "files": len(doc_paths),
+        "cached": len(doc_paths) - len(pending),
+        "errors": sum(d["severity"] == "error" for d in diagnostics),
+        "warnings": sum(d["severity"] == "warning" for d in diagnostics),
+        "diagnostics": diagnostics,
+    }
+
+
+def iter_documents(paths: List[Path]) -> List[Path]:
+    """展开目录参数为其下所有 .md 文件（跳过隐藏目录）"""
+    docs = []
+    for path in paths:
+        if path.is_dir():
+            docs.extend(
+                p
+                for p in sorted(path.rglob("*.md"))
+                if not any(part.startswith(".") for part in p.parts)
+            )
+        elif path.exists():
+            docs.append(path)
+    return list(dict.fromkeys(docs))
+
+
+def print_report(report: dict) -> None:
+    icons = {"error": "❌", "warning": "⚠️ "}
+    for d in report["diagnostics"]:
+        print(
+            f"{icons[d['severity']]} {d['path']}:{d['line']}: "
+            f"[{d['rule']}] {d['message']}"
+        )
+    if report["diagnostics"]:
+        print()
+
+    summary = (
+        f"{report['files']} 个文档（缓存命中 {report['cached']}），"
+        f"{report['errors']} 个错误，{report['warnings']} 个警告"
+    )
+    print(f"{'❌' if report['errors'] else '✅'} {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Knowledge Validator - 知识文档校验工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  python tools/knowledge_validator.py
+  python tools/knowledge_validator.py knowledge/xxx.md --json
+        """,
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        help="要校验的文档或目录（默认 knowledge/ 和 agent-client/）",
+    )
+    parser.add_argument("--json", action="store_true", help="输出 JSON 诊断结果")
+    parser.add_argument(
+        "--strict", action="store_true", help="存在 warning 时也返回非 0"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="忽略并且不写入校验缓存"
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="并行进程数（默认 CPU 核数，1 表示不并行）",
+    )
+    parser.add_argument("--list-rules", action="store_true", help="列出所有规则")
+
+    args = parser.parse_args()
+
+    if args.list_rules:
+        for rule, (severity, description) in RULES.items():
+            print(f"{rule:<22}{severity:<9}{description}")
+        sys.exit(0)
+
+    doc_paths = iter_documents(args.paths or list(VALIDATE_ROOTS))
+    report = validate(doc_paths, args.jobs, use_cache=not args.no_cache)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=1))
+    else:
+        print_report(report)
+
+    failed = report["errors"] or (args.strict and report["warnings"])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
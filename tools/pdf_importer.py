@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+"""
+PDF Importer - PDF 导入工具
+
+这是一个 Tool，把 PDF 资料转换为 knowledge/ 下的 Markdown，
+作为 generate-learning-doc 的原始素材（不再需要手动粘贴）。
+
+核心能力：
+  - 逐页流式处理：主进程只保留有限个在途页面，内存占用与 PDF 页数无关
+  - 提取正文、表格（Markdown 表格）和标题（按字号相对正文的比例判断层级）
+  - 多进程并行：每个工作进程打开一次 PDF，按页领取任务，结果按页序写出
+  - 逐页缓存：按页面内容流 + 字体/XObject 资源计算指纹，
+    重新导入更新过的 PDF 时只处理变化的页面
+
+后端（均为可选依赖，自动选择）：
+  pdfplumber  : 正文 + 表格 + 标题，支持逐页缓存（推荐）
+  pypdfium2   : 只提取纯文本，速度快，不做缓存
+
+依赖：
+  pip install pdfplumber   # 或 pip install pypdfium2
+
+使用示例：
+  # 导入到 knowledge/{文件名}.md
+  python tools/pdf_importer.py 资料.pdf
+
+  # 指定输出、并行进程数
+  python tools/pdf_importer.py 资料.pdf -o knowledge/资料.md --jobs 8
+
+  # 只导入部分页（从 1 开始，含两端）
+  python tools/pdf_importer.py 资料.pdf --pages 10-50
+
+注意：
+  - 输出文件已存在且不是本工具生成的，需要 --force 才会覆盖
+  - 页缓存位于 .cache/pdf_importer/（不提交），删除即可强制全量重新提取
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+try:
+    import pdfplumber
+    from pdfminer.pdftypes import resolve1
+except ImportError:
+    pdfplumber = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ==================== 配置 ====================
+
+KNOWLEDGE_DIR = Path("knowledge")
+PAGE_CACHE_DIR = Path(".cache/pdf_importer/pages")
+
+# 提取逻辑有变化时递增，旧的页缓存自动失效
+IMPORTER_VERSION = 1
+
+BACKENDS = ("pdfplumber", "pypdfium2")
+
+# 生成文件的标记（用于判断能否覆盖）
+IMPORT_MARKER = "<!-- imported-by: pdf_importer -->"
+
+# 标题判断：行字号 / 正文字号 ≥ 阈值时的 Markdown 级别（# 留给文档标题）
+HEADING_RATIOS = ((1.6, "##"), (1.3, "###"), (1.15, "####"))
+
+# 行间距超过行高的这个倍数时视为新段落
+PARAGRAPH_GAP = 0.8
+
+# 每个工作进程最多排队的页数：限制主进程缓存的在途结果
+WINDOW_PER_JOB = 4
+
+BULLET_RE = re.compile(r"^[•·●▪■◦‣∙-]\s*")
+NUMBERED_RE = re.compile(r"^(\d+[.)、]|[（(]\d+[)）])\s*")
+CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def available_backend(preferred: Optional[str] = None) -> Optional[str]:
+    """返回可用的后端名，preferred 不可用时返回 None"""
+    installed = {"pdfplumber": pdfplumber is not None, "pypdfium2": pdfium is not None}
+    if preferred:
+        return preferred if installed[preferred] else None
+    for name in BACKENDS:
+        if installed[name]:
+            return name
+    return None
+
+
+# ==================== 页面 → Markdown ====================
+
+
+def join_lines(prev: str, line: str) -> str:
+    """同一段落内的换行：中文直接相连，英文加空格，行尾连字符合并单词"""
+    if not prev:
+        return line
+    if prev.endswith("-") and line[:1].islower():
+        return prev[:-1] + line
+    if CJK_RE.match(prev[-1]) or CJK_RE.match(line[0]):
+        return prev + line
+    return f"{prev} {line}"
+
+
+def table_markdown(rows: List[List[Optional[str]]]) -> str:
+    """pdfplumber 表格 → Markdown 表格（第一行作为表头）"""
+    rows = [r for r in rows if r and any(cell for cell in r)]
+    if not rows:
+        return ""
+    width = max(len(r) for r in rows)
+
+    def cell(value: Optional[str]) -> str:
+        text = " ".join((value or "").split())
+        return text.replace("|", "\\|")
+
+    lines = []
+    for n, row in enumerate(rows):
+        cells = [cell(v) for v in row] + [""] * (width - len(row))
+        lines.append("| " + " | ".join(cells) + " |")
+        if n == 0:
+            lines.append("|" + "---|" * width)
+    return "\n".join(lines)
+
+
+def heading_prefix(size: float, body_size: float) -> str:
+    for ratio, prefix in HEADING_RATIOS:
+        if size >= body_size * ratio:
+            return prefix
+    return ""
+
+
+def line_size(line: dict) -> float:
+    sizes = sorted(c["size"] for c in line["chars"] if c["text"].strip())
+    return sizes[len(sizes) // 2] if sizes else 0.0
+
+
+def inside(obj: dict, bboxes: List[tuple]) -> bool:
+    x = (obj["x0"] + obj["x1"]) / 2
+    y = (obj["top"] + obj["bottom"]) / 2
+    return any(x0 <= x <= x1 and top <= y <= bottom for x0, top, x1, bottom in bboxes)
+
+
+def plumber_page_markdown(page) -> str:
+    """
+    pdfplumber 页面 → Markdown
+    表格区域内的文字只出现在表格里；正文按行距合并成段落，大字号行作为标题
+    """
+    tables = page.find_tables()
+    bboxes = [t.bbox for t in tables]
+    text_page = page
+    if bboxes:
+        text_page = page.filter(
+            lambda obj: obj.get("object_type") != "char" or not inside(obj, bboxes)
+        )
+
+    lines = text_page.extract_text_lines(return_chars=True)
+    weights = Counter()
+    for line in lines:
+        for c in line["chars"]:
+            weights[round(c["size"], 1)] += 1
+    body_size = weights.most_common(1)[0][0] if weights else 0.0
+
+    # (位置, Markdown 片段)：正文段落、标题、表格按纵向位置排序
+    items = [(t.bbox[1], table_markdown(t.extract())) for t in tables]
+
+    paragraph = ""
+    para_top = 0.0
+    prev_bottom = None
+    for line in lines:
+        text = line["text"].strip()
+        if not text:
+            continue
+        height = line["bottom"] - line["top"]
+        prefix = heading_prefix(line_size(line), body_size)
+        new_block = (
+            prefix
+            or prev_bottom is None
+            or line["top"] - prev_bottom > height * PARAGRAPH_GAP
+            or BULLET_RE.match(text)
+            or NUMBERED_RE.match(text)
+        )
+        if new_block and paragraph:
+            items.append((para_top, paragraph))
+            paragraph = ""
+
+        if prefix:
+            items.append((line["top"], f"{prefix} {text}"))
+            prev_bottom = None
+            continue
+
+        if not paragraph:
+            para_top = line["top"]
+            text = BULLET_RE.sub("- ", text, count=1)
+        paragraph = join_lines(paragraph, text)
+        prev_bottom = line["bottom"]
+
+    if paragraph:
+        items.append((para_top, paragraph))
+
+    items.sort(key=lambda item: item[0])
+    return "\n\n".join(text for _, text in items if text)
+
+
+def pdfium_page_markdown(page) -> str:
+    """pypdfium2 页面 → 纯文本段落（没有表格/标题信息）"""
+    textpage = page.get_textpage()
+    try:
+        text = textpage.get_text_range()
+    finally:
+        textpage.close()
+
+    paragraphs = []
+    paragraph = ""
+    for raw in text.replace("\r\n", "\n").split("\n"):
+        line = raw.strip()
+        if not line:
+            if paragraph:
+                paragraphs.append(paragraph)
+            paragraph = ""
+            continue
+        if BULLET_RE.match(line) or NUMBERED_RE.match(line):
+            if paragraph:
+                paragraphs.append(paragraph)
+            paragraph = BULLET_RE.sub("- ", line, count=1)
+            continue
+        paragraph = join_lines(paragraph, line)
+    if paragraph:
+        paragraphs.append(paragraph)
+    return "\n\n".join(paragraphs)
+
+
+# ==================== 页缓存 ====================
+
+
+def page_fingerprint(page) -> Optional[str]:
+    """
+    页面指纹：内容流 + 页面尺寸/旋转 + 字体（含 ToUnicode、嵌入字体大小）和 XObject 资源
+    内容没变的页面（即使 PDF 其他页变了、重新导出过）指纹不变
+    无法解析时返回 None（该页不缓存）
+    """
+    try:
+        obj = page.page_obj
+        digest = hashlib.sha256(
+            f"v{IMPORTER_VERSION}|{obj.mediabox}|{obj.rotate}".encode()
+        )
+        for stream in obj.contents:
+            digest.update(resolve1(stream).get_data())
+
+        resources = resolve1(obj.resources) or {}
+        fonts = resolve1(resources.get("Font")) or {}
+        for name in sorted(fonts, key=str):
+            font = resolve1(fonts[name]) or {}
+            digest.update(f"F|{name}|{resolve1(font.get('BaseFont'))}".encode())
+            # ToUnicode 决定提取出的文字，内容要算进指纹；嵌入的字体文件只算大小
+            to_unicode = resolve1(font.get("ToUnicode"))
+            if hasattr(to_unicode, "get_data"):
+                digest.update(to_unicode.get_data())
+            descendants = resolve1(font.get("DescendantFonts")) or []
+            for descriptor_font in [font, *map(resolve1, descendants)]:
+                descriptor = resolve1(descriptor_font.get("FontDescriptor")) or {}
+                for key in ("FontFile", "FontFile2", "FontFile3"):
+                    fontfile = resolve1(descriptor.get(key))
+                    if fontfile is not None:
+                        digest.update(f"{key}|{fontfile.get('Length')}".encode())
+
+        xobjects = resolve1(resources.get("XObject")) or {}
+        for name in sorted(xobjects, key=str):
+            xobject = resolve1(xobjects[name])
+            subtype = getattr(xobject.get("Subtype"), "name", "")
+            digest.update(f"X|{name}|{subtype}".encode())
+            # 表单 XObject 里可能有文字，内容要算进指纹；图片只算大小
+            if subtype == "Form":
+                digest.update(xobject.get_data())
+            else:
+                digest.update(str(xobject.get("Length")).encode())
+        return digest.hexdigest()
+    except Exception:
+        return None
+
+
+def cache_path(fingerprint: str) -> Path:
+    return PAGE_CACHE_DIR / fingerprint[:2] / f"{fingerprint}.md"
+
+
+def write_cache(fingerprint: str, markdown: str) -> None:
+    path = cache_path(fingerprint)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(markdown, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+# ==================== 工作进程 ====================
+
+# 每个工作进程各自打开一次 PDF
+_worker = {}
+
+
+def open_worker(pdf_path: str, backend: str, use_cache: bool) -> None:
+    if backend == "pdfplumber":
+        _worker["pdf"] = pdfplumber.open(pdf_path)
+    else:
+        _worker["pdf"] = pdfium.PdfDocument(pdf_path)
+    _worker["backend"] = backend
+    _worker["use_cache"] = use_cache
+
+
+def close_worker() -> None:
+    pdf = _worker.pop("pdf", None)
+    if pdf is not None:
+        pdf.close()
+
+
+def import_page(index: int) -> Tuple[int, str, bool]:
+    """提取第 index 页（从 0 开始），返回 (页号, Markdown, 是否命中缓存)"""
+    pdf = _worker["pdf"]
+
+    if _worker["backend"] == "pypdfium2":
+        page = pdf[index]
+        try:
+            return index, pdfium_page_markdown(page), False
+        finally:
+            page.close()
+
+    page = pdf.pages[index]
+    try:
+        fingerprint = page_fingerprint(page) if _worker["use_cache"] else None
+        if fingerprint:
+            try:
+                return index, cache_path(fingerprint).read_text(encoding="utf-8"), True
+            except OSError:
+                pass
+        markdown = plumber_page_markdown(page)
+        if fingerprint:
+            write_cache(fingerprint, markdown)
+        return index, markdown, False
+    finally:
+        # 释放该页解析出的对象，保证内存不随页数增长
+        page.close()
+
+
+# ==================== 调度 ====================
+
+
+def bounded_map(pool, func, items: List[int], window: int) -> Iterator:
+    """按顺序产出结果，同时最多 window 个任务在途（限制主进程内存）"""
+    items = iter(items)
+    pending = deque(pool.submit(func, item) for item in islice(items, window))
+    while pending:
+        result = pending.popleft().result()
+        pending.extend(pool.submit(func, item) for item in islice(items, 1))
+        yield result
+
+
+def pdf_info(pdf_path: Path) -> Tuple[int, str]:
+    """(页数, 标题)：标题优先取 PDF 元数据，其次文件名"""
+    if pdfium is not None:
+        doc = pdfium.PdfDocument(str(pdf_path))
+        try:
+            return len(doc), (doc.get_metadata_dict().get("Title") or "").strip()
+        finally:
+            doc.close()
+    with pdfplumber.open(str(pdf_path)) as pdf:
+        return len(pdf.pages), str(pdf.metadata.get("Title") or "").strip()
+
+
+# --pages 的一段：3 或 10-50（从 1 开始，含两端）
+PAGE_RANGE_RE = re.compile(r"^\s*(\d+)\s*(?:-\s*(\d+)\s*)?$")
+
+
+def parse_page_ranges(spec: str) -> List[Tuple[int, int]]:
+    """ "1-20,3,5" → [(1, 20), (3, 3), (5, 5)]，格式不对或起止颠倒时抛 ValueError"""
+    ranges = []
+    for part in spec.split(","):
+        m = PAGE_RANGE_RE.match(part)
+        if not m:
+            raise ValueError(f"无法解析的页码范围: {part.strip() or spec!r}")
+        start = int(m.group(1))
+        end = int(m.group(2) or start)
+        if start < 1 or end < start:
+            raise ValueError(
+                f"页码范围无效: {part.strip()}（页码从 1 开始，起始页不能大于结束页）"
+            )
+        ranges.append((start, end))
+    return ranges
+
+
+def parse_pages(spec: Optional[str], count: int) -> List[int]:
+    """ "10-50" / "3" → 从 0 开始的页号列表（超出页数的部分忽略）"""
+    if not spec:
+        return list(range(count))
+    pages = set()
+    for start, end in parse_page_ranges(spec):
+        pages.update(range(start - 1, min(count, end)))
+    return sorted(pages)
+
+
+def peak_rss_mb() -> dict:
+    """当前进程和已结束子进程的峰值 RSS（MB）"""
+    if resource is None:
+        return {}
+    # Linux 单位是 KB，macOS 是字节
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20, 1
+        ),
+        "children": round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20, 1
+        ),
+    }
+
+
+def import_pdf(
+    pdf_path: Path,
+    output: Path,
+    jobs: int = 1,
+    backend: Optional[str] = None,
+    pages: Optional[str] = None,
+    use_cache: bool = True,
+) -> dict:
+    """
+    逐页导入 PDF，结果按页序流式写入 output（先写临时文件，完成后替换）
+    返回统计信息：pages / cached / seconds / pages_per_second / peak_rss_mb
+    选中的页为空时抛 ValueError，不会覆盖 output
+    """
+    start = time.perf_counter()
+    count, title = pdf_info(pdf_path)
+    indexes = parse_pages(pages, count)
+    if not indexes:
+        raise ValueError(f"--pages {pages} 没有选中任何页（PDF 共 {count} 页）")
+    jobs = max(1, min(jobs, len(indexes)))
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_name(f".{output.name}.partial")
+    cached = 0
+
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            out.write(f"# {title or pdf_path.stem}\n\n")
+            out.write(f"{IMPORT_MARKER}\n")
+            out.write(
+                f"> 来源：`{pdf_path.name}`（共 {count} 页），由 pdf_importer.py 导入\n"
+            )
+
+            if jobs == 1:
+                open_worker(str(pdf_path), backend, use_cache)
+                try:
+                    results = map(import_page, indexes)
+                    for index, markdown, hit in results:
+                        cached += hit
+                        out.write(f"\n<!-- page {index + 1} -->\n\n{markdown}\n")
+                finally:
+                    close_worker()
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=jobs,
+                    initializer=open_worker,
+                    initargs=(str(pdf_path), backend, use_cache),
+                ) as pool:
+                    results = bounded_map(
+                        pool, import_page, indexes, jobs * WINDOW_PER_JOB
+                    )
+                    for index, markdown, hit in results:
+                        cached += hit
+                        out.write(f"\n<!-- page {index + 1} -->\n\n{markdown}\n")
+
+        os.replace(tmp_path, output)
+    finally:
+        # 工作进程出错时不留下半截的临时文件
+        tmp_path.unlink(missing_ok=True)
+    elapsed = time.perf_counter() - start
+    return {
+        "pdf": str(pdf_path),
+        "output": str(output),
+        "backend": backend,
+        "jobs": jobs,
+        "pages": len(indexes),
+        "cached": cached,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(len(indexes) / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="PDF Importer - PDF 导入工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  python tools/pdf_importer.py 资料.pdf
+  python tools/pdf_importer.py 资料.pdf -o knowledge/资料.md --jobs 8
+        """,
+    )
+    parser.add_argument("pdf", type=Path, help="要导入的 PDF 文件")
+    parser.add_argument(
+        "-o", "--output", type=Path, help="输出 Markdown（默认 knowledge/{文件名}.md）"
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="并行进程数（默认 CPU 核数）",
+    )
+    parser.add_argument(
+        "--backend", choices=BACKENDS, help="提取后端（默认优先 pdfplumber）"
+    )
+    parser.add_argument("--pages", help="只导入部分页，例如 1-20 或 3,5,7-9")
+    parser.add_argument("--no-cache", action="store_true", help="不使用页缓存")
+    parser.add_argument(
+        "--force", action="store_true", help="覆盖不是由本工具生成的输出文件"
+    )
+    parser.add_argument("--json", action="store_true", help="输出 JSON 统计信息")
+
+    args = parser.parse_args()
+
+    if args.pages:
+        try:
+            parse_page_ranges(args.pages)
+        except ValueError as e:
+            parser.error(f"--pages: {e}")
+
+    backend = available_backend(args.backend)
+    if backend is None:
+        print("❌ 未安装 PDF 解析库")
+        print("   安装: pip install pdfplumber   # 或 pip install pypdfium2")
+        sys.exit(1)
+
+    if not args.pdf.exists():
+        print(f"❌ 文件不存在: {args.pdf}")
+        sys.exit(1)
+
+    output = args.output or KNOWLEDGE_DIR / f"{args.pdf.stem}.md"
+    if output.exists() and not args.force:
+        with open(output, encoding="utf-8", errors="replace") as f:
+            head = f.read(4096)
+        if IMPORT_MARKER not in head:
+            print(f"❌ {output} 已存在且不是导入生成的文件，使用 --force 覆盖")
+            sys.exit(1)
+
+    if not args.json:
+        print(f"📥 导入 {args.pdf} → {output}（后端: {backend}，{args.jobs} 进程）")
+
+    try:
+        stats = import_pdf(
+            args.pdf, output, args.jobs, backend, args.pages, not args.no_cache
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=1))
+        sys.exit(0)
+
+    rss = stats["peak_rss_mb"]
+    print(
+        f"✅ {stats['pages']} 页（缓存命中 {stats['cached']}），"
+        f"{stats['seconds']}s，{stats['pages_per_second']} 页/秒"
+    )
+    if rss:
+        print(f"📈 峰值 RSS: 主进程 {rss['self']} MB，工作进程 {rss['children']} MB")
+
+
+if __name__ == "__main__":
+    main()
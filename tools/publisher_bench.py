@@ -0,0 +1,746 @@
+#!/usr/bin/env python3
+"""
+Publisher Bench - 知识发布器性能基准
+
+用于衡量 knowledge_publisher.py 热路径的耗时，输出人类可读结果，
+也可以用 --json 输出机器可读结果（方便对比回归）。
+
+子命令：
+  render : 对比渲染后端吞吐量（diagrams/second），需要本机已安装 mmdc
+  scan   : 在合成的大文档上测试围栏扫描 + 单次拼接回写（不需要 mmdc）
+  corpus : 合成知识库 + 桩渲染器 + 本地 bare 仓库作为 remote，
+           测量 build_only() / publish() 各阶段耗时（不需要 mmdc），
+           并检查 --assets-branch 的资源分支发布与重写（检查失败时退出码为 1）
+  pdf    : 合成多页 PDF，测量 pdf_importer.py 的吞吐（页/秒）、
+           页缓存命中和峰值 RSS（需要 pdfplumber 或 pypdfium2）
+
+使用示例：
+  python tools/publisher_bench.py render --count 20
+  python tools/publisher_bench.py render --count 20 --backends batch --json
+  python tools/publisher_bench.py scan --size-mb 10 --fences 5000
+  python tools/publisher_bench.py corpus --docs 20 --diagrams 10 --prose-kb 50
+  python tools/publisher_bench.py corpus --latency 0.2 --jobs 4 --output bench.json
+  python tools/publisher_bench.py pdf --pages 500 --jobs 8
+"""
+
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+import knowledge_publisher as kp
+
+
+def synthetic_diagrams(count: int) -> List[str]:
+    """生成 count 个互不相同的流程图（避免任何缓存干扰）"""
+    diagrams = []
+    for i in range(count):
+        lines = ["flowchart TD"]
+        for j in range(4 + i % 5):
+            lines.append(f"  N{i}_{j}[步骤 {j}] --> N{i}_{j + 1}[步骤 {j + 1}]")
+        diagrams.append("\n".join(lines))
+    return diagrams
+
+
+def bench_render(count: int, backends: List[str], jobs: int = 1) -> dict:
+    """用同一批图表依次测试每个渲染后端"""
+    diagrams = synthetic_diagrams(count)
+    results = {}
+
+    for name in backends:
+        renderer = kp.RENDERERS[name](jobs)
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as tmp:
+            tasks = [
+                {"code": code, "output": Path(tmp) / f"{i}.png", "label": f"{i}.png"}
+                for i, code in enumerate(diagrams, 1)
+            ]
+            start = time.perf_counter()
+            ok = renderer.render(tasks)
+            elapsed = time.perf_counter() - start
+
+        results[name] = {
+            "jobs": jobs,
+            "diagrams": count,
+            "succeeded": sum(ok),
+            "seconds": round(elapsed, 3),
+            "diagrams_per_second": round(count / elapsed, 2) if elapsed else None,
+        }
+
+    return results
+
+
+def print_render_results(results: dict) -> None:
+    print(f"\n{'='*60}")
+    print("📊 渲染后端对比")
+    print(f"{'='*60}")
+    print(f"{'后端':<8}{'成功':>8}{'耗时(s)':>12}{'diagrams/s':>14}")
+    for name, r in results.items():
+        print(
+            f"{name:<8}{r['succeeded']:>5}/{r['diagrams']:<3}"
+            f"{r['seconds']:>11.2f}{r['diagrams_per_second']:>14}"
+        )
+    if "batch" in results and "spawn" in results:
+        speedup = results["spawn"]["seconds"] / max(results["batch"]["seconds"], 1e-9)
+        print(f"\n🚀 batch 相对 spawn 加速: {speedup:.1f}x")
+    print()
+
+
+def synthetic_document(size_mb: float, fences: int) -> str:
+    """
+    生成约 size_mb 大小、包含 fences 个围栏代码块的文档
+    混合 mermaid / 普通代码 / ~~~ 围栏，以及已发布（含多层外壳）的图表
+    """
+    sentence = "这是一段用于基准测试的正文，包含中文和 English words。"
+    bytes_per_char = len(sentence.encode("utf-8")) / len(sentence)
+    target = int(size_mb * 1024 * 1024)
+    prose_len = max(0, int((target // max(fences, 1) - 200) / bytes_per_char))
+    prose = (sentence * (prose_len // len(sentence) + 1))[:prose_len]
+
+    parts = []
+    for i in range(fences):
+        parts.append(f"## 章节 {i}\n\n{prose}\n\n")
+        kind = i % 4
+        code = f"flowchart TD\n  A{i}[开始] --> B{i}[结束]"
+        if kind == 0:
+            parts.append(f"```mermaid\n{code}\n```\n\n")
+        elif kind == 1:
+            parts.append(f"```python\nprint({i})\n```\n\n")
+        elif kind == 2:
+            parts.append(f"~~~mermaid\n{code}\n~~~\n\n")
+        else:
+            block = {"index": 1, "code": code}
+            wrapped = kp.render_published_block(block, f"https://x/{i}.png")
+            # 模拟旧版本重复包裹的文档
+            wrapped = kp.render_published_block(block, f"https://x/{i}.png").replace(
+                f"```mermaid\n{code}\n```", wrapped
+            )
+            parts.append(wrapped + "\n\n")
+    return "".join(parts)
+
+
+def legacy_rewrite(content: str) -> str:
+    """旧实现：正则匹配 + 每个图表一次 str.replace（O(文档大小 × 图表数)）"""
+    new_content = content
+    for match in re.finditer(r"```mermaid\n(.*?)```", content, re.DOTALL):
+        code = match.group(1).strip()
+        code_hash = hashlib.md5(code.encode()).hexdigest()[:8]
+        new_content = new_content.replace(match.group(0), f"![{code_hash}]", 1)
+    return new_content
+
+
+def bench_scan(size_mb: float, fences: int, legacy: bool) -> dict:
+    """扫描、提取、回写各阶段耗时，以及回写的幂等性"""
+    content = synthetic_document(size_mb, fences)
+    result = {"bytes": len(content.encode("utf-8")), "fences": fences}
+
+    start = time.perf_counter()
+    scanned = kp.scan_fences(content)
+    result["scan_seconds"] = round(time.perf_counter() - start, 4)
+
+    start = time.perf_counter()
+    blocks = kp.find_mermaid_blocks(content)
+    result["extract_seconds"] = round(time.perf_counter() - start, 4)
+
+    start = time.perf_counter()
+    rewritten = kp.replace_mermaid_with_images(blocks, content, "bench")
+    result["rewrite_seconds"] = round(time.perf_counter() - start, 4)
+
+    again = kp.replace_mermaid_with_images(
+        kp.find_mermaid_blocks(rewritten), rewritten, "bench"
+    )
+    result["fences_found"] = len(scanned)
+    result["mermaid_blocks"] = len(blocks)
+    result["idempotent"] = again == rewritten
+
+    if legacy:
+        start = time.perf_counter()
+        legacy_rewrite(content)
+        result["legacy_rewrite_seconds"] = round(time.perf_counter() - start, 4)
+
+    return result
+
+
+def print_scan_results(r: dict) -> None:
+    print(f"\n{'='*60}")
+    print(f"📊 围栏扫描（{r['bytes'] / 1024 / 1024:.1f} MB，{r['fences']} 个围栏）")
+    print(f"{'='*60}")
+    print(f"  找到围栏:     {r['fences_found']}（Mermaid {r['mermaid_blocks']}）")
+    print(f"  scan_fences:  {r['scan_seconds'] * 1000:.1f} ms")
+    print(f"  提取图表:     {r['extract_seconds'] * 1000:.1f} ms")
+    print(f"  单次拼接回写: {r['rewrite_seconds'] * 1000:.1f} ms")
+    print(f"  幂等:         {'✅' if r['idempotent'] else '❌'}")
+    if "legacy_rewrite_seconds" in r:
+        print(f"  旧实现回写:   {r['legacy_rewrite_seconds'] * 1000:.1f} ms")
+    print()
+
+
+# ==================== 合成知识库基准 ====================
+
+# 按阶段统计耗时的函数（publish() / build_only() 内部通过模块全局名调用它们）
+TIMED_STAGES = [
+    "check_git_status",
+    "git_changed_files",
+    "detect_mermaid_in_knowledge",
+    "extract_mermaid_blocks",
+    "render_documents",
+    "finalize_outputs",
+    "replace_mermaid_with_images",
+    "finish_document",
+    "generate_commit_message",
+    "commit_and_push",
+    "verify_push",
+    "run_git_command",
+]
+
+
+class StubRenderer(kp.MmdcRenderer):
+    """
+    桩渲染器：不启动 mmdc，按固定延迟"渲染"出一张合法的小 PNG
+    jobs > 1 时用线程池模拟并发渲染
+    """
+
+    name = "stub"
+    latency = 0.0
+    renders = 0
+
+    def check(self) -> bool:
+        return True
+
+    def version(self) -> str:
+        return "stub"
+
+    def render_one(self, task: dict) -> bool:
+        time.sleep(self.latency)
+        digest = hashlib.md5(task["code"].encode("utf-8")).digest()
+        raw = b"".join(b"\x00" + digest[:12] for _ in range(4))
+        ihdr = struct.pack(">IIBBBBB", 4, 4, 8, 2, 0, 0, 0)
+        png = (
+            kp.PNG_SIGNATURE
+            + kp.make_png_chunk(b"IHDR", ihdr)
+            + kp.make_png_chunk(b"IDAT", zlib.compress(raw))
+            + kp.make_png_chunk(b"IEND", b"")
+        )
+        task["output"].parent.mkdir(parents=True, exist_ok=True)
+        task["output"].write_bytes(png)
+        return True
+
+    def render(self, tasks: List[dict]) -> List[bool]:
+        StubRenderer.renders += len(tasks)
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            return list(pool.map(self.render_one, tasks))
+
+
+class StageTimer:
+    """把 knowledge_publisher 中的阶段函数包一层计时，按函数名累计"""
+
+    def __init__(self, names: List[str]):
+        self.stats = {}
+        self.originals = {name: getattr(kp, name) for name in names}
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stat = self.stats.setdefault(name, {"calls": 0, "seconds": 0.0})
+                stat["calls"] += 1
+                stat["seconds"] += time.perf_counter() - start
+
+        return timed
+
+    def __enter__(self):
+        for name, func in self.originals.items():
+            setattr(kp, name, self.wrap(name, func))
+        return self
+
+    def __exit__(self, *exc):
+        for name, func in self.originals.items():
+            setattr(kp, name, func)
+
+
+def git(*args: str) -> str:
+    result = subprocess.run(["git", *args], capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def generate_corpus(root: Path, docs: int, diagrams: int, prose_kb: int) -> List[Path]:
+    """
+    在 root 下生成 knowledge/*.md（中文文件名），初始化 Git 仓库，
+    并用同目录下的 bare 仓库作为 origin
+    """
+    knowledge = root / "work" / "knowledge"
+    knowledge.mkdir(parents=True)
+    sentence = "合成语料用于衡量发布流程的耗时，包含中文与 English。\n"
+    prose = sentence * max(1, prose_kb * 1024 // len(sentence.encode("utf-8")))
+
+    paths = []
+    for d in range(docs):
+        parts = [f"# 合成文档 {d}\n\n"]
+        for m in range(diagrams):
+            parts.append(f"## 小节 {m}\n\n{prose}\n")
+            parts.append(
+                f"```mermaid\nflowchart TD\n  D{d}M{m}[文档 {d}] --> N{m}[图 {m}]\n```\n\n"
+            )
+        path = knowledge / f"合成知识{d:03d}_深度学习指南.md"
+        path.write_text("".join(parts), encoding="utf-8")
+        paths.append(path.relative_to(root / "work"))
+
+    remote = root / "remote.git"
+    subprocess.run(
+        ["git", "init", "-q", "--bare", "-b", "main", str(remote)], check=True
+    )
+    os.chdir(root / "work")
+    git("init", "-q", "-b", "main")
+    git("config", "user.name", "bench")
+    git("config", "user.email", "bench@example.com")
+    git("config", "commit.gpgsign", "false")
+    git("remote", "add", "origin", str(remote))
+    git("add", "-A")
+    git("commit", "-q", "-m", "synthetic corpus")
+    git("push", "-q", "-u", "origin", "main")
+    return paths
+
+
+def touch_prose(path: Path) -> None:
+    """只改正文，不动任何图表"""
+    with path.open("a", encoding="utf-8") as f:
+        f.write("\n补充一句正文。\n")
+
+
+def drop_last_diagram(path: Path) -> None:
+    """删掉文档里最后一个已发布的图表（图片链接 + 折叠源码），让它的图片变成未引用"""
+    content = path.read_text(encoding="utf-8")
+    path.write_text(content[: content.rindex("![流程图")], encoding="utf-8")
+
+
+def remote_tree(remote: Path, ref: str) -> List[str]:
+    result = subprocess.run(
+        ["git", "--git-dir", str(remote), "ls-tree", "-r", "--name-only", ref],
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.split() if result.returncode == 0 else []
+
+
+def remote_rev(remote: Path, ref: str) -> str:
+    result = subprocess.run(
+        ["git", "--git-dir", str(remote), "rev-parse", "-q", "--verify", ref],
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def check_assets(remote: Path, expected: int, doc: Path) -> dict:
+    """资源分支发布后的检查：主分支没有图片、图片都在 assets 分支的共享存储、链接指向 assets"""
+    images = kp.IMAGES_ROOT.as_posix() + "/"
+    assets = remote_tree(remote, "assets")
+    content = subprocess.run(
+        ["git", "--git-dir", str(remote), "show", f"main:{doc.as_posix()}"],
+        capture_output=True,
+        text=True,
+    ).stdout
+    return {
+        "main_has_no_images": not any(
+            p.startswith(images) for p in remote_tree(remote, "main")
+        ),
+        "assets_holds_store": len(assets) == expected
+        and all(p.startswith(images + "store/") for p in assets),
+        "links_point_to_assets": f"/assets/{images}store/" in content,
+    }
+
+
+def run_scenario(name: str, func) -> dict:
+    """运行一个场景（屏蔽工具自身的输出），返回总耗时 / 分阶段耗时 / 渲染次数"""
+    StubRenderer.renders = 0
+    with StageTimer(TIMED_STAGES) as timer:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            exit_code = func()
+        total = time.perf_counter() - start
+
+    return {
+        "exit_code": exit_code,
+        "total_seconds": round(total, 4),
+        "renders": StubRenderer.renders,
+        "stages": {
+            stage: {"calls": v["calls"], "seconds": round(v["seconds"], 4)}
+            for stage, v in timer.stats.items()
+        },
+    }
+
+
+def bench_corpus(
+    docs: int, diagrams: int, prose_kb: int, latency: float, jobs: int
+) -> dict:
+    """
+    在合成知识库上依次运行：
+      build_cold   : build_only() 全量渲染
+      build_warm   : build_only() 缓存全部命中
+      build_service: 同一个 Publisher 实例上的第二次 build()（常驻服务的热路径）
+      publish_prose: 改一篇文档的正文后 publish()
+      publish_incr : 再改一篇后 publish(incremental=True)
+      publish_assets: 另一个全新的知识库上 publish(assets_branch="assets")
+      prune_assets : 删掉一个图表并发布后重写资源分支
+    资源分支的两个场景之后对 bare 仓库做检查，结果放在 "checks"
+    """
+    StubRenderer.latency = latency
+    kp.RENDERERS["stub"] = StubRenderer
+    cwd = os.getcwd()
+    result = {
+        "config": {
+            "docs": docs,
+            "diagrams_per_doc": diagrams,
+            "prose_kb_per_diagram": prose_kb,
+            "render_latency": latency,
+            "jobs": jobs,
+        },
+        "scenarios": {},
+        "checks": {},
+    }
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="publisher-bench-") as tmp:
+            paths = generate_corpus(Path(tmp), docs, diagrams, prose_kb)
+            scenarios = result["scenarios"]
+
+            scenarios["build_cold"] = run_scenario(
+                "build_cold", lambda: kp.build_only(paths, "stub", jobs)
+            )
+            git("add", "-A")
+            git("commit", "-q", "-m", "render")
+            git("push", "-q")
+
+            scenarios["build_warm"] = run_scenario(
+                "build_warm", lambda: kp.build_only(paths, "stub", jobs)
+            )
+
+            publisher = kp.Publisher(renderer="stub", jobs=jobs)
+            with contextlib.redirect_stdout(io.StringIO()):
+                publisher.build(paths)
+            scenarios["build_service"] = run_scenario(
+                "build_service", lambda: publisher.build(paths)
+            )
+
+            touch_prose(paths[0])
+            scenarios["publish_prose"] = run_scenario(
+                "publish_prose", lambda: kp.publish("stub", jobs)
+            )
+
+            touch_prose(paths[-1])
+            scenarios["publish_incr"] = run_scenario(
+                "publish_incr", lambda: kp.publish("stub", jobs, incremental=True)
+            )
+
+            # 资源分支：主分支从来没有提交过图片的全新知识库
+            assets_root = Path(tmp) / "assets"
+            paths = generate_corpus(assets_root, docs, diagrams, prose_kb)
+            remote = assets_root / "remote.git"
+            publisher = kp.Publisher(renderer="stub", jobs=jobs, assets_branch="assets")
+            touch_prose(paths[0])
+            scenarios["publish_assets"] = run_scenario(
+                "publish_assets", lambda: publisher.publish()
+            )
+            checks = result["checks"]
+            checks.update(check_assets(remote, docs * diagrams, paths[0]))
+
+            drop_last_diagram(paths[0])
+            with contextlib.redirect_stdout(io.StringIO()):
+                publisher.publish()
+            main_before = remote_rev(remote, "main")
+            scenarios["prune_assets"] = run_scenario(
+                "prune_assets",
+                lambda: kp.prune_assets(
+                    publisher.images_roots(), "origin", "assets", publisher.manifest
+                ),
+            )
+            pruned = remote_tree(remote, "assets")
+            checks["prune_keeps_referenced"] = len(pruned) == docs * diagrams - 1
+            checks["prune_rewrites_assets_only"] = remote_rev(
+                remote, "main"
+            ) == main_before and not remote_rev(remote, "assets^")
+    finally:
+        os.chdir(cwd)
+        kp.RENDERERS.pop("stub", None)
+
+    return result
+
+
+def print_corpus_results(result: dict) -> None:
+    c = result["config"]
+    print(f"\n{'='*60}")
+    print(
+        f"📊 合成知识库: {c['docs']} 篇 × {c['diagrams_per_doc']} 图，"
+        f"正文 {c['prose_kb_per_diagram']} KB/图，"
+        f"桩渲染 {c['render_latency'] * 1000:.0f} ms，jobs={c['jobs']}"
+    )
+    print(f"{'='*60}")
+    for name, r in result["scenarios"].items():
+        status = "✅" if r["exit_code"] == 0 else "❌"
+        print(
+            f"\n{status} {name}: {r['total_seconds'] * 1000:.1f} ms，渲染 {r['renders']} 次"
+        )
+        for stage, v in sorted(
+            r["stages"].items(), key=lambda kv: kv[1]["seconds"], reverse=True
+        ):
+            print(f"    {stage:<30}{v['calls']:>5} 次{v['seconds'] * 1000:>12.1f} ms")
+    if result["checks"]:
+        print("\n🔍 资源分支检查（bare 仓库）")
+        for name, ok in result["checks"].items():
+            print(f"    {'✅' if ok else '❌'} {name}")
+    print()
+
+
+# ==================== PDF 导入基准 ====================
+
+
+def pdf_text(text: str) -> str:
+    """PDF 字符串字面量转义"""
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def synthetic_page(n: int, revision: int = 0) -> bytes:
+    """一页内容流：大字号标题 + 若干段正文 + 一个带边框的表格"""
+    ops = [f"BT /F2 20 Tf 72 750 Td ({pdf_text(f'Chapter {n}: Section title')}) Tj ET"]
+    y = 715
+    for p in range(3):
+        ops.append(f"BT /F1 11 Tf 14 TL 72 {y} Td")
+        for line in range(5):
+            words = " ".join(
+                f"word{(n * 31 + p * 7 + line + i + revision) % 997}" for i in range(9)
+            )
+            ops.append(f"({pdf_text(f'Paragraph {p} line {line}: {words}')}) Tj T*")
+        ops.append("ET")
+        y -= 90
+
+    # 3 列 × 4 行的表格（有边框线，pdfplumber 能识别）
+    left, top, width, height = 72, y - 10, 150, 20
+    for r in range(5):
+        ops.append(
+            f"{left} {top - r * height} m {left + 3 * width} {top - r * height} l S"
+        )
+    for c in range(4):
+        ops.append(
+            f"{left + c * width} {top} m {left + c * width} {top - 4 * height} l S"
+        )
+    for r in range(4):
+        for c in range(3):
+            cell = "Name Type Value".split()[c] if r == 0 else f"r{r}c{c}-{n}"
+            ops.append(
+                f"BT /F1 10 Tf {left + c * width + 5} {top - r * height - 14} Td "
+                f"({cell}) Tj ET"
+            )
+    return "\n".join(ops).encode("latin-1")
+
+
+def synthetic_pdf(path: Path, pages: int, changed: set = frozenset()) -> None:
+    """
+    手写一个最小的多页 PDF（不依赖任何库）：Helvetica 字体、压缩内容流
+    changed 中的页（从 1 开始）内容会变化，用于测试逐页缓存
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # 页树，最后填写
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>",
+    ]
+    kids = []
+    for n in range(1, pages + 1):
+        data = zlib.compress(synthetic_page(n, 1 if n in changed else 0))
+        objects.append(
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data)
+            + data
+            + b"\nendstream"
+        )
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> "
+            b"/Contents %d 0 R >>" % content_id
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(bytes(out))
+
+
+def run_importer(workdir: Path, pdf: Path, jobs: int) -> dict:
+    """在独立进程里导入（峰值 RSS 按进程统计），返回导入工具的 JSON 统计"""
+    tool = Path(__file__).resolve().parent / "pdf_importer.py"
+    proc = subprocess.run(
+        [sys.executable, str(tool), str(pdf), "-o", "out.md", "-j", str(jobs)]
+        + ["--force", "--json"],
+        cwd=workdir,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stdout + proc.stderr)
+    return json.loads(proc.stdout)
+
+
+def bench_pdf(pages: int, jobs: int, changed: int) -> dict:
+    """
+    合成 PDF 上的导入吞吐与峰值 RSS：
+      cold_serial   : 无缓存，单进程
+      cold_parallel : 无缓存，jobs 个进程
+      warm          : 同一个 PDF 再导入一次（全部命中页缓存）
+      changed       : 修改 changed 页后重新导入（只处理变化的页）
+    """
+    results = {"pages": pages, "jobs": jobs}
+    with tempfile.TemporaryDirectory(prefix="bench-pdf-") as tmp:
+        tmp = Path(tmp)
+        pdf = tmp / "synthetic.pdf"
+        synthetic_pdf(pdf, pages)
+        results["pdf_bytes"] = pdf.stat().st_size
+
+        serial_dir = tmp / "serial"
+        serial_dir.mkdir()
+        results["cold_serial"] = run_importer(serial_dir, pdf, 1)
+
+        workdir = tmp / "parallel"
+        workdir.mkdir()
+        results["cold_parallel"] = run_importer(workdir, pdf, jobs)
+        results["warm"] = run_importer(workdir, pdf, jobs)
+
+        step = max(1, pages // max(changed, 1))
+        synthetic_pdf(pdf, pages, set(range(1, pages + 1, step)[:changed]))
+        results["changed"] = run_importer(workdir, pdf, jobs)
+        results["changed_pages"] = min(changed, pages)
+
+    return results
+
+
+def print_pdf_results(r: dict) -> None:
+    print(f"\n{'='*60}")
+    print(f"📊 PDF 导入（{r['pages']} 页，{r['pdf_bytes'] / 1024:.0f} KB）")
+    print(f"{'='*60}")
+    print(
+        f"{'场景':<16}{'进程':>5}{'缓存命中':>10}{'耗时(s)':>10}{'页/秒':>10}{'峰值RSS(MB)':>14}"
+    )
+    for name in ("cold_serial", "cold_parallel", "warm", "changed"):
+        s = r[name]
+        rss = s["peak_rss_mb"]
+        peak = f"{rss.get('self', 0)}+{rss.get('children', 0)}" if rss else "-"
+        print(
+            f"{name:<16}{s['jobs']:>5}{s['cached']:>10}{s['seconds']:>10.2f}"
+            f"{s['pages_per_second']:>10}{peak:>14}"
+        )
+    print(f"\n  changed 场景修改了 {r['changed_pages']} 页")
+    print("  峰值 RSS = 主进程 + 单个工作进程的最大值")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publisher Bench - 知识发布器性能基准")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="输出 JSON 结果")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    render = sub.add_parser("render", parents=[common], help="对比渲染后端吞吐量")
+    render.add_argument("--count", type=int, default=10, help="图表数量")
+    render.add_argument(
+        "--backends",
+        nargs="+",
+        choices=sorted(kp.RENDERERS),
+        default=["spawn", "batch"],
+        help="要测试的后端",
+    )
+    render.add_argument("--jobs", type=int, default=1, help="并发 mmdc 进程数")
+
+    scan = sub.add_parser("scan", parents=[common], help="测试围栏扫描与回写")
+    scan.add_argument("--size-mb", type=float, default=10, help="文档大小（MB）")
+    scan.add_argument("--fences", type=int, default=5000, help="围栏数量")
+    scan.add_argument(
+        "--legacy", action="store_true", help="同时测试旧的正则 + str.replace 实现"
+    )
+
+    corpus = sub.add_parser(
+        "corpus", parents=[common], help="合成知识库上的端到端分阶段耗时"
+    )
+    corpus.add_argument("--docs", type=int, default=20, help="文档数")
+    corpus.add_argument("--diagrams", type=int, default=10, help="每篇文档的图表数")
+    corpus.add_argument("--prose-kb", type=int, default=20, help="每个图表前的正文 KB")
+    corpus.add_argument(
+        "--latency", type=float, default=0.05, help="桩渲染器单图延迟（秒）"
+    )
+    corpus.add_argument("--jobs", type=int, default=1, help="并发渲染数")
+    corpus.add_argument("--output", type=Path, help="把 JSON 结果写入文件")
+
+    pdf = sub.add_parser(
+        "pdf", parents=[common], help="合成 PDF 上的导入吞吐与峰值 RSS"
+    )
+    pdf.add_argument("--pages", type=int, default=300, help="页数")
+    pdf.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="并行进程数")
+    pdf.add_argument("--changed", type=int, default=10, help="重新导入前修改的页数")
+
+    args = parser.parse_args()
+
+    if args.command == "render":
+        if not kp.check_mmdc():
+            sys.exit(1)
+        results = bench_render(args.count, args.backends, args.jobs)
+        if args.json:
+            print(json.dumps({"render": results}, ensure_ascii=False, indent=2))
+        else:
+            print_render_results(results)
+
+    elif args.command == "corpus":
+        result = bench_corpus(
+            args.docs, args.diagrams, args.prose_kb, args.latency, args.jobs
+        )
+        if args.output:
+            args.output.write_text(
+                json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            print_corpus_results(result)
+        if not all(result["checks"].values()):
+            sys.exit(1)
+
+    elif args.command == "pdf":
+        result = bench_pdf(args.pages, args.jobs, args.changed)
+        if args.json:
+            print(json.dumps({"pdf": result}, ensure_ascii=False, indent=2))
+        else:
+            print_pdf_results(result)
+
+    elif args.command == "scan":
+        result = bench_scan(args.size_mb, args.fences, args.legacy)
+        if args.json:
+            print(json.dumps({"scan": result}, ensure_ascii=False, indent=2))
+        else:
+            print_scan_results(result)
+
+
+if __name__ == "__main__":
+    main()